@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from . import models
+
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", "10000"))
+# Upper bound on how long another worker's logout can go unnoticed here.
+SESSION_CACHE_TTL = float(os.getenv("SESSION_CACHE_TTL", "60"))
+
+
+@dataclass(frozen=True)
+class AuthUser:
+    """Snapshot of the signed-in user, safe to share between requests."""
+
+    id: int
+    email: str
+    username: str
+    created_at: datetime | None = None
+
+
+class SessionCache:
+    """Bounded LRU of session token -> AuthUser with a TTL per entry."""
+
+    def __init__(self, max_size: int, ttl: float) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[str, tuple[float, AuthUser]] = OrderedDict()
+        self._by_user: dict[int, set[str]] = {}
+        # Bumped by every invalidation so a lookup that raced one doesn't
+        # put the stale user back.
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, db: Session, token: str) -> AuthUser | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        row = (
+            db.query(models.User.id, models.User.email, models.User.username, models.User.created_at)
+            .join(models.Session, models.Session.user_id == models.User.id)
+            .filter(models.Session.id == token)
+            .first()
+        )
+        if row is None:
+            return None
+        user = AuthUser(id=row.id, email=row.email, username=row.username, created_at=row.created_at)
+        with self._lock:
+            if generation == self._generation:
+                self._store(token, user, now + self.ttl)
+        return user
+
+    def _store(self, token: str, user: AuthUser, expires: float) -> None:
+        self._discard(token)
+        self._entries[token] = (expires, user)
+        self._by_user.setdefault(user.id, set()).add(token)
+        while len(self._entries) > self.max_size:
+            self._discard(next(iter(self._entries)))
+
+    def _discard(self, token: str) -> None:
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._by_user.get(entry[1].id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[entry[1].id]
+
+    def invalidate(self, token: str) -> None:
+        with self._lock:
+            self._generation += 1
+            self._discard(token)
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            self._generation += 1
+            for token in list(self._by_user.get(user_id, ())):
+                self._discard(token)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+session_cache = SessionCache(SESSION_CACHE_SIZE, SESSION_CACHE_TTL)
+
+
+# ORM-level user changes drop that user's cached sessions. Bulk query
+# deletes skip these hooks, so callers doing those invalidate explicitly.
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _user_changed(_mapper, _connection, target: models.User) -> None:
+    session_cache.invalidate_user(target.id)
+
+
+@event.listens_for(models.Session, "after_delete")
+def _session_deleted(_mapper, _connection, target: models.Session) -> None:
+    session_cache.invalidate(target.id)
@@ -0,0 +1,186 @@
+from __future__ import annotations
+
+import gzip
+import hashlib
+import os
+import threading
+import zlib
+from collections import OrderedDict
+
+from sqlalchemy import event, select, text
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+
+from .models import CodeBlob, Game
+
+try:
+    import zstandard
+except ImportError:  # zlib is always available; zstd is optional
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:  # without it only gzip variants are served
+    brotli = None
+
+CACHE_BYTES = int(os.getenv("CODE_BLOB_CACHE_MB", "64")) * 1024 * 1024
+BROTLI_QUALITY = int(os.getenv("BROTLI_QUALITY", "11"))
+# Encodings prepared outside the writer thread, waiting for put() to store them.
+PREPARED_MAX = 32
+
+
+def hash_code(code: str) -> str:
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+def compress(code: str) -> tuple[str, bytes]:
+    raw = code.encode()
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=19).compress(raw)
+    return "zlib", zlib.compress(raw, 9)
+
+
+def decompress(codec: str, data: bytes) -> str:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd code blobs")
+        return zstandard.ZstdDecompressor().decompress(data).decode()
+    return zlib.decompress(data).decode()
+
+
+class _TextCache:
+    """LRU of decompressed code by hash; blobs are immutable so it never goes stale."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self._items: OrderedDict[str, str] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: str) -> None:
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self._items.move_to_end(key)
+                return
+            self._items[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+
+cache = _TextCache(CACHE_BYTES)
+
+
+def decode(blob: CodeBlob) -> str:
+    code = cache.get(blob.hash)
+    if code is None:
+        code = decompress(blob.codec, blob.data)
+        cache.put(blob.hash, code)
+    return code
+
+
+def http_variants(code: str) -> dict[str, bytes | None]:
+    """Precompressed response bodies served by GET /games/{id}/html."""
+    raw = code.encode()
+    return {
+        "gzip_data": gzip.compress(raw, 9, mtime=0),
+        "br_data": brotli.compress(raw, quality=BROTLI_QUALITY) if brotli is not None else None,
+    }
+
+
+_prepared: OrderedDict[str, dict] = OrderedDict()
+_prepared_lock = threading.Lock()
+
+
+def prepare(code: str) -> str:
+    """Compress code ahead of a write so put() doesn't hold up the writer thread."""
+    code_hash = hash_code(code)
+    codec, data = compress(code)
+    values = {"codec": codec, "size": len(code), "data": data, **http_variants(code)}
+    with _prepared_lock:
+        _prepared[code_hash] = values
+        while len(_prepared) > PREPARED_MAX:
+            _prepared.popitem(last=False)
+    return code_hash
+
+
+def _encoded(code: str, code_hash: str) -> dict:
+    with _prepared_lock:
+        values = _prepared.pop(code_hash, None)
+    if values is None:
+        codec, data = compress(code)
+        values = {"codec": codec, "size": len(code), "data": data, **http_variants(code)}
+    return values
+
+
+def put(db: Session, code: str, code_hash: str | None = None) -> str:
+    """Store code once under its hash and return the hash."""
+    code_hash = code_hash or hash_code(code)
+    exists = db.execute(text("SELECT 1 FROM code_blobs WHERE hash = :h"), {"h": code_hash}).first()
+    if not exists:
+        db.execute(
+            insert(CodeBlob)
+            .values(hash=code_hash, **_encoded(code, code_hash))
+            .on_conflict_do_nothing(index_elements=["hash"])
+        )
+    cache.put(code_hash, code)
+    return code_hash
+
+
+def backfill_variants(db: Session) -> int:
+    """Precompress HTTP variants for game blobs stored before they existed."""
+    rows = db.query(CodeBlob).filter(
+        CodeBlob.gzip_data.is_(None),
+        CodeBlob.hash.in_(select(Game.code_hash)),
+    )
+    count = 0
+    for blob in rows:
+        for key, value in http_variants(decode(blob)).items():
+            setattr(blob, key, value)
+        count += 1
+    return count
+
+
+def stored_size(db: Session, code_hash: str) -> int | None:
+    """Compressed size of an existing blob, or None if it isn't stored."""
+    return db.execute(text("SELECT length(data) FROM code_blobs WHERE hash = :h"), {"h": code_hash}).scalar()
+
+
+def get(db: Session, code_hash: str) -> str | None:
+    code = cache.get(code_hash)
+    if code is not None:
+        return code
+    blob = db.get(CodeBlob, code_hash)
+    return decode(blob) if blob is not None else None
+
+
+def collect_garbage(db: Session) -> int:
+    """Delete blobs no game or keyframe version references."""
+    result = db.execute(
+        text(
+            "DELETE FROM code_blobs WHERE hash NOT IN "
+            "(SELECT code_hash FROM games WHERE code_hash IS NOT NULL) "
+            "AND hash NOT IN (SELECT code_hash FROM game_versions WHERE storage = 'blob')"
+        )
+    )
+    return result.rowcount
+
+
+@event.listens_for(Session, "before_flush")
+def _store_pending_code(session: Session, _flush_context, _instances) -> None:
+    # Game.code's setter only records the hash; write the blob itself just
+    # before the row that references it.
+    for obj in list(session.new) + list(session.dirty):
+        pending = obj.__dict__.pop("_pending_code", None)
+        if pending is not None:
+            put(session, pending, obj.code_hash)
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import os
+
+from .pubsub import (
+    OP_HELLO,
+    OP_PEER_LOST,
+    OP_PUBLISH,
+    OP_SUBSCRIBE,
+    OP_UNSUBSCRIBE,
+    PUBSUB_BUFFER_MAX,
+    PUBSUB_URL,
+    can_write,
+    encode_frame,
+    parse_url,
+    read_frame,
+)
+
+
+class Broker:
+    """Fans each published frame out to every other subscriber of its channel.
+
+    Run one next to the API workers and point them at it with PUBSUB_URL.
+    A worker that stops reading has frames dropped rather than buffered
+    without bound; one that disconnects is reported to the rest of its
+    channels' subscribers so they forget its players.
+    """
+
+    def __init__(self, buffer_max: int) -> None:
+        self.buffer_max = buffer_max
+        self.subscribers: dict[str, set[asyncio.StreamWriter]] = {}
+        self.forwarded = 0
+        self.dropped = 0
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        worker_id = ""
+        channels: set[str] = set()
+        try:
+            while True:
+                op, channel, payload = await read_frame(reader)
+                if op == OP_PUBLISH:
+                    self._fan_out(channel, encode_frame(OP_PUBLISH, channel, payload), writer)
+                elif op == OP_SUBSCRIBE:
+                    channels.add(channel)
+                    self.subscribers.setdefault(channel, set()).add(writer)
+                elif op == OP_UNSUBSCRIBE:
+                    channels.discard(channel)
+                    self._remove(channel, writer)
+                elif op == OP_HELLO:
+                    worker_id = channel
+        except (asyncio.IncompleteReadError, OSError, ValueError):
+            pass
+        finally:
+            for channel in channels:
+                self._remove(channel, writer)
+                if worker_id:
+                    self._fan_out(channel, encode_frame(OP_PEER_LOST, channel, worker_id.encode()), writer)
+            writer.close()
+
+    def _fan_out(self, channel: str, frame: bytes, sender: asyncio.StreamWriter) -> None:
+        for peer in self.subscribers.get(channel, ()):
+            if peer is sender:
+                continue
+            if can_write(peer, self.buffer_max):
+                peer.write(frame)
+                self.forwarded += 1
+            else:
+                self.dropped += 1
+
+    def _remove(self, channel: str, writer: asyncio.StreamWriter) -> None:
+        peers = self.subscribers.get(channel)
+        if peers is not None:
+            peers.discard(writer)
+            if not peers:
+                del self.subscribers[channel]
+
+
+async def serve(url: str, buffer_max: int = PUBSUB_BUFFER_MAX) -> None:
+    broker = Broker(buffer_max)
+    kind, host, port = parse_url(url)
+    if kind == "unix":
+        if os.path.exists(host):
+            os.unlink(host)
+        server = await asyncio.start_unix_server(broker.handle, host)
+    else:
+        server = await asyncio.start_server(broker.handle, host, port)
+    print(f"Pub/sub broker listening on {url}")
+    async with server:
+        await server.serve_forever()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m apps.api.broker")
+    parser.add_argument(
+        "--listen",
+        default=PUBSUB_URL if PUBSUB_URL != "local" else "unix:/tmp/game-factory-pubsub.sock",
+        help="unix:/path/to.sock or tcp://host:port (default: $PUBSUB_URL)",
+    )
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(serve(args.listen))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
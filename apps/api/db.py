@@ -1,22 +1,154 @@
 from __future__ import annotations
 
+import asyncio
+import os
+import queue
+import threading
+from concurrent.futures import Future
 from pathlib import Path
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker, declarative_base
+from typing import Any, Callable, TypeVar
+
+from fastapi import HTTPException
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker, declarative_base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 
 DB_PATH = Path(__file__).parent / "game_factory.db"
 DATABASE_URL = f"sqlite:///{DB_PATH}"
+ASYNC_DATABASE_URL = f"sqlite+aiosqlite:///{DB_PATH}"
+
+# Applied to every new connection. WAL lets readers proceed while a write is
+# in progress; busy_timeout makes lock waits block instead of failing with
+# "database is locked".
+SQLITE_PRAGMAS: dict[str, Any] = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "wal"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "normal"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": -int(os.getenv("SQLITE_CACHE_SIZE_KB", "65536")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": "memory",
+}
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={"check_same_thread": False},
+# Pool for the async engine that serves request reads; each aiosqlite
+# connection runs on its own thread, so concurrent reads don't queue.
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "40"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+# The sync engine only serves the writer thread, startup migrations and
+# maintenance commands.
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
 )
+
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def _apply_pragmas(dbapi_conn, _record) -> None:
+    cursor = dbapi_conn.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Request handlers only read through this; writes go through `writer`.
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+# Writer jobs hand their ORM objects back to other threads, so keep them
+# loaded after commit.
+WriterSession = sessionmaker(autocommit=False, autoflush=False, bind=engine, expire_on_commit=False)
 Base = declarative_base()
 
+T = TypeVar("T")
+
+
+class DbWriter:
+    """Runs write jobs one at a time on a dedicated thread.
+
+    SQLite allows a single writer; funnelling every write through one queue
+    means writers never contend for the lock and readers, under WAL, never
+    wait on them. A job is a callable taking a Session; it is committed when
+    it returns and rolled back if it raises.
+    """
+
+    def __init__(self, session_factory: sessionmaker = WriterSession, max_pending: int = 10000) -> None:
+        self._session_factory = session_factory
+        self._queue: queue.Queue[tuple[Callable[[Session], Any], Future] | None] = queue.Queue(max_pending)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._loop, name="db-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        with self._lock:
+            thread = self._thread
+            self._thread = None
+        if thread and thread.is_alive():
+            self._queue.put(None)
+            thread.join(timeout)
+
+    def submit(self, job: Callable[[Session], T], block: bool = True) -> Future[T]:
+        """Queue job; with block=False, raise queue.Full rather than wait for room."""
+        self.start()
+        future: Future[T] = Future()
+        self._queue.put((job, future), block=block)
+        return future
+
+    def run(self, job: Callable[[Session], T], timeout: float | None = None) -> T:
+        return self.submit(job).result(timeout)
+
+    async def run_async(self, job: Callable[[Session], T]) -> T:
+        # This runs on the event loop, so it never waits for room in the
+        # queue: a saturated writer turns requests away instead of freezing
+        # every handler and socket with it.
+        try:
+            future = self.submit(job, block=False)
+        except queue.Full:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Server busy, try again", headers={"Retry-After": "1"})
+        return await asyncio.wrap_future(future)
+
+    def stats(self) -> dict[str, int]:
+        return {"pending": self._queue.qsize(), "rejected": self.rejected}
+
+    def _loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            job, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            db = self._session_factory()
+            try:
+                result = job(db)
+                db.commit()
+            except BaseException as exc:
+                db.rollback()
+                future.set_exception(exc)
+            else:
+                future.set_result(result)
+            finally:
+                db.close()
+
+
+writer = DbWriter()
+
 
 def init_db() -> None:
-    from . import models  # noqa: F401
+    from . import blobs, models  # noqa: F401
 
     Base.metadata.create_all(bind=engine)
     # Lightweight migration for new columns
@@ -65,3 +197,60 @@ def init_db() -> None:
             conn.execute(text("CREATE TABLE IF NOT EXISTS party_votes (id INTEGER PRIMARY KEY, party_id VARCHAR(120) NOT NULL, user_id INTEGER NOT NULL, game_id INTEGER NOT NULL, created_at DATETIME, UNIQUE(party_id,user_id))"))
         except Exception:
             pass
+        try:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_games_public_created ON games (is_public, created_at, id)"))
+        except Exception:
+            pass
+        likes_added = False
+        try:
+            conn.execute(text("ALTER TABLE games ADD COLUMN likes INTEGER NOT NULL DEFAULT 0"))
+            likes_added = True
+        except Exception:
+            pass
+        try:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_games_public_likes ON games (is_public, likes, created_at, id)"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE game_versions ADD COLUMN storage VARCHAR(10) NOT NULL DEFAULT 'full'"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE game_versions ADD COLUMN base_id INTEGER"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE game_versions ADD COLUMN payload BLOB"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE game_versions ADD COLUMN code_hash VARCHAR(64)"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE games ADD COLUMN code_hash VARCHAR(64)"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_games_code_hash ON games (code_hash)"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE code_blobs ADD COLUMN gzip_data BLOB"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("ALTER TABLE code_blobs ADD COLUMN br_data BLOB"))
+        except Exception:
+            pass
+        try:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_game_comments_game_created ON game_comments (game_id, created_at, id)"))
+        except Exception:
+            pass
+    if likes_added:
+        from .maintenance import reconcile_likes
+
+        reconcile_likes(engine)
+    from .search import init_search
+
+    init_search(engine)
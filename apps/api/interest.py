@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import json
+import os
+from typing import Any, Iterable
+
+from fastapi import WebSocket
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Interest management inside a room. A relayed message may carry
+#   "_channel": "chat"   only for sockets subscribed to that channel
+#   "_cell": [x, y]      only for sockets whose area of interest holds that grid cell
+# (both: only sockets matching both). Filtering is opt-in per socket: one
+# that never subscribed to a channel still gets every channel message, and
+# one that never set an area gets every cell message, as before.
+INTEREST_TYPES = ("_subscribe", "_unsubscribe", "_aoi")
+WS_MAX_CHANNELS = int(os.getenv("WS_MAX_CHANNELS", "32"))
+# Largest area of interest, in cells from the centre: (2r+1)^2 cells.
+AOI_MAX_RADIUS = int(os.getenv("WS_AOI_MAX_RADIUS", "4"))
+
+Cell = tuple[int, int]
+
+_TEXT_KEYS = ('"_channel"', '"_cell"')
+_PACKED_KEYS = (b"\xa8_channel", b"\xa5_cell")
+
+
+def _route(payload: Any) -> tuple[str | None, Cell | None]:
+    if not isinstance(payload, dict):
+        return None, None
+    channel = payload.get("_channel")
+    cell = payload.get("_cell")
+    if isinstance(cell, (list, tuple)) and len(cell) == 2:
+        try:
+            cell = (int(cell[0]), int(cell[1]))
+        except (TypeError, ValueError):
+            cell = None
+    else:
+        cell = None
+    return (str(channel) if channel is not None else None), cell
+
+
+def route_text(text: str) -> tuple[str | None, Cell | None]:
+    """(channel, cell) a JSON message is addressed to; parsed only if it mentions one."""
+    if not any(key in text for key in _TEXT_KEYS):
+        return None, None
+    try:
+        return _route(json.loads(text))
+    except json.JSONDecodeError:
+        return None, None
+
+
+def route_packed(data: bytes) -> tuple[str | None, Cell | None]:
+    if msgpack is None or not any(key in data for key in _PACKED_KEYS):
+        return None, None
+    try:
+        return _route(msgpack.unpackb(data))
+    except Exception:
+        return None, None
+
+
+def area(x: Any, y: Any, radius: Any) -> set[Cell]:
+    x, y = int(x), int(y)
+    radius = max(0, min(int(radius), AOI_MAX_RADIUS))
+    return {(x + dx, y + dy) for dx in range(-radius, radius + 1) for dy in range(-radius, radius + 1)}
+
+
+def parse_area(raw: str | None) -> set[Cell] | None:
+    """?aoi=x,y,radius"""
+    if not raw:
+        return None
+    try:
+        x, y, radius = raw.split(",")
+        return area(x, y, radius)
+    except ValueError:
+        return None
+
+
+class InterestIndex:
+    """One room's channel and cell subscriptions, indexed both ways.
+
+    Routing a message costs a lookup of its channel's or cell's subscriber
+    set plus the sockets that haven't opted into filtering.
+    """
+
+    def __init__(self) -> None:
+        self.channels: dict[str, set[WebSocket]] = {}
+        self.cells: dict[Cell, set[WebSocket]] = {}
+        self.socket_channels: dict[WebSocket, set[str]] = {}
+        self.socket_cells: dict[WebSocket, set[Cell]] = {}
+
+    def subscribe(self, websocket: WebSocket, names: Iterable[str]) -> None:
+        mine = self.socket_channels.setdefault(websocket, set())
+        for name in names:
+            if len(mine) >= WS_MAX_CHANNELS:
+                break
+            mine.add(name)
+            self.channels.setdefault(name, set()).add(websocket)
+
+    def unsubscribe(self, websocket: WebSocket, names: Iterable[str]) -> None:
+        mine = self.socket_channels.get(websocket)
+        if mine is None:
+            return
+        for name in names:
+            mine.discard(name)
+            self._discard(self.channels, name, websocket)
+        if not mine:
+            del self.socket_channels[websocket]
+
+    def set_area(self, websocket: WebSocket, cells: set[Cell] | None) -> None:
+        old = self.socket_cells.pop(websocket, set())
+        new = cells or set()
+        for cell in old - new:
+            self._discard(self.cells, cell, websocket)
+        for cell in new - old:
+            self.cells.setdefault(cell, set()).add(websocket)
+        if new:
+            self.socket_cells[websocket] = new
+
+    def remove(self, websocket: WebSocket) -> None:
+        self.unsubscribe(websocket, list(self.socket_channels.get(websocket, ())))
+        self.set_area(websocket, None)
+
+    def recipients(self, members: set[WebSocket], channel: str | None, cell: Cell | None) -> set[WebSocket]:
+        result: set[WebSocket] | None = None
+        if channel is not None:
+            result = self._match(members, self.channels.get(channel), self.socket_channels)
+        if cell is not None:
+            matched = self._match(members, self.cells.get(cell), self.socket_cells)
+            result = matched if result is None else result & matched
+        return members if result is None else result
+
+    def wants(self, websocket: WebSocket, channel: str | None, cell: Cell | None) -> bool:
+        if channel is not None and websocket in self.socket_channels and channel not in self.socket_channels[websocket]:
+            return False
+        if cell is not None and websocket in self.socket_cells and cell not in self.socket_cells[websocket]:
+            return False
+        return True
+
+    def __bool__(self) -> bool:
+        return bool(self.socket_channels or self.socket_cells)
+
+    @staticmethod
+    def _match(members: set[WebSocket], subscribers: set[WebSocket] | None, filtered: dict[WebSocket, Any]) -> set[WebSocket]:
+        matched = set(subscribers or ())
+        if len(filtered) < len(members):
+            matched |= members.difference(filtered)
+        return matched
+
+    @staticmethod
+    def _discard(index: dict[Any, set[WebSocket]], key: Any, websocket: WebSocket) -> None:
+        sockets = index.get(key)
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                del index[key]
@@ -0,0 +1,159 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, replace
+from typing import Any, Callable, Mapping
+
+# Inbound limits per connection: token buckets on messages and on bytes.
+# These are the defaults and also the ceilings; a room's first player can
+# ask for lower ones with ?msg_rate=, ?byte_rate= and ?throttle=.
+WS_MSG_RATE = float(os.getenv("WS_MSG_RATE", "60"))
+WS_MSG_BURST = float(os.getenv("WS_MSG_BURST", "120"))
+WS_BYTE_RATE = float(os.getenv("WS_BYTE_RATE", str(256 * 1024)))
+WS_BYTE_BURST = float(os.getenv("WS_BYTE_BURST", str(1024 * 1024)))
+# Frames larger than this close the socket with 1009.
+WS_MAX_MESSAGE = int(os.getenv("WS_MAX_MESSAGE", str(256 * 1024)))
+# What happens to a game message over the limit; see Throttle.
+WS_THROTTLE_POLICY = os.getenv("WS_THROTTLE_POLICY", "coalesce")
+THROTTLE_POLICIES = ("coalesce", "drop")
+
+
+def _lower(raw: str | None, ceiling: float) -> float:
+    try:
+        value = float(raw) if raw else 0.0
+    except ValueError:
+        value = 0.0
+    return min(value, ceiling) if value > 0 else ceiling
+
+
+@dataclass(frozen=True)
+class RoomLimits:
+    msg_rate: float
+    msg_burst: float
+    byte_rate: float
+    byte_burst: float
+    policy: str
+
+    @classmethod
+    def from_query(cls, params: Mapping[str, str]) -> RoomLimits:
+        msg_rate = _lower(params.get("msg_rate"), WS_MSG_RATE)
+        byte_rate = _lower(params.get("byte_rate"), WS_BYTE_RATE)
+        policy = params.get("throttle")
+        return cls(
+            msg_rate=msg_rate,
+            msg_burst=max(1.0, WS_MSG_BURST * msg_rate / WS_MSG_RATE),
+            byte_rate=byte_rate,
+            # Any frame under WS_MAX_MESSAGE has to fit eventually.
+            byte_burst=max(float(WS_MAX_MESSAGE), WS_BYTE_BURST * byte_rate / WS_BYTE_RATE),
+            policy=policy if policy in THROTTLE_POLICIES else WS_THROTTLE_POLICY,
+        )
+
+    def for_tick_rate(self, rate: float) -> RoomLimits:
+        """Room limits raised to fit an input and a patch every tick.
+
+        Acks aren't counted at all. The tick rate is already capped by
+        TICK_MAX_RATE, so this can't lift the budget without bound.
+        """
+        msg_rate = max(self.msg_rate, 2 * rate)
+        if msg_rate == self.msg_rate:
+            return self
+        return replace(self, msg_rate=msg_rate, msg_burst=max(self.msg_burst, 2 * msg_rate))
+
+
+def new_counters() -> dict[str, int]:
+    return {"throttled": 0, "coalesced": 0, "dropped": 0, "oversized": 0}
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "stamp")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.stamp = time.monotonic()
+
+    def refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+
+    def wait(self, amount: float) -> float:
+        return max(0.0, (amount - self.tokens) / self.rate)
+
+
+class Throttle:
+    """Inbound rate limit for one connection.
+
+    Game messages over the limit follow the room's policy:
+      coalesce - hold the newest one back, replacing any already held, and
+                 relay it as soon as the buckets allow
+      drop     - discard it
+    Control messages are never held or merged; over the limit they are
+    dropped.
+    """
+
+    def __init__(self, limits: RoomLimits, counters: dict[str, int], release: Callable[[Any], None]) -> None:
+        self.limits = limits
+        self.counters = counters
+        self.messages = TokenBucket(limits.msg_rate, limits.msg_burst)
+        self.bytes = TokenBucket(limits.byte_rate, limits.byte_burst)
+        self.pending: tuple[Any, int] | None = None
+        self._release = release
+        self._timer: asyncio.TimerHandle | None = None
+
+    def admit(self, size: int) -> bool:
+        """Whether a control message of size bytes may be acted on now."""
+        if self._take(size):
+            return True
+        self.counters["throttled"] += 1
+        self.counters["dropped"] += 1
+        return False
+
+    def relay(self, message: Any, size: int) -> None:
+        # Nothing overtakes a held message, so order is kept.
+        if self.pending is None and self._take(size):
+            self._release(message)
+            return
+        self.counters["throttled"] += 1
+        if self.limits.policy == "drop":
+            self.counters["dropped"] += 1
+            return
+        if self.pending is not None:
+            self.counters["coalesced"] += 1
+        self.pending = (message, size)
+        if self._timer is None:
+            self._schedule()
+
+    def close(self) -> None:
+        self.pending = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _take(self, size: int) -> bool:
+        now = time.monotonic()
+        self.messages.refill(now)
+        self.bytes.refill(now)
+        if self.messages.tokens >= 1 and self.bytes.tokens >= size:
+            self.messages.tokens -= 1
+            self.bytes.tokens -= size
+            return True
+        return False
+
+    def _schedule(self) -> None:
+        size = self.pending[1]
+        delay = max(self.messages.wait(1), self.bytes.wait(size))
+        self._timer = asyncio.get_running_loop().call_later(delay, self._flush)
+
+    def _flush(self) -> None:
+        self._timer = None
+        if self.pending is None:
+            return
+        message, size = self.pending
+        if self._take(size):
+            self.pending = None
+            self._release(message)
+        else:
+            self._schedule()
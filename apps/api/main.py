@@ -1,5 +1,8 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import itertools
 import json
 import os
 import re
@@ -8,19 +11,48 @@ from typing import Any, Dict, Optional
 
 from dotenv import load_dotenv
 import uuid
-from fastapi import Depends, FastAPI, HTTPException, WebSocket, WebSocketDisconnect, Response, Request
+from fastapi import Depends, FastAPI, HTTPException, Query, WebSocket, WebSocketDisconnect, Response, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, defer, lazyload, load_only
+from sqlalchemy import String, func, select, tuple_, type_coerce
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from openrouter import OpenRouter
 from openai import OpenAI
 
-from .db import SessionLocal, init_db
-from passlib.hash import pbkdf2_sha256
+from . import blobs, search, versions
+from .auth import AuthUser, session_cache
+from .db import AsyncSessionLocal, async_engine, init_db, writer
+from .interest import INTEREST_TYPES
+from .passwords import password_pool
+from .plays import play_buffer
+from .recorder import (
+    RECORD_BINARY,
+    RECORD_JOIN,
+    RECORD_KINDS,
+    RECORD_LEAVE,
+    RECORD_TEXT,
+    ROOM_RECORD_ADMINS,
+    read_entries,
+    recorder,
+)
+from .rooms import (
+    CONTROL_TYPES,
+    TICK_CONTROL_TYPES,
+    Outbound,
+    is_json_object,
+    manager,
+    parse_control,
+    parse_packed_control,
+    room_registry,
+)
+from .shards import rebalance, route, shard_map
+from .ticks import TICK_TYPES
+from .usernames import usernames
 
-from .models import Game, GameVersion, Room, User, Session, GameVote, GameComment, Party, PartyMember, PartyVote
+from .models import CodeBlob, Game, GameVersion, User, Session, GameVote, GameComment, Party, PartyMember, PartyVote, Room
 from .schemas import (
     AiIn,
     AiOut,
@@ -31,6 +63,7 @@ from .schemas import (
     EditIn,
     GameCreate,
     GameOut,
+    GameSummaryOut,
     GameUpdate,
     GameVersionOut,
     GenerateIn,
@@ -58,30 +91,53 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+GAMES_PAGE_MAX = int(os.getenv("GAMES_PAGE_MAX", "100"))
+COMMENTS_PAGE_MAX = int(os.getenv("COMMENTS_PAGE_MAX", "50"))
+
 
 @app.on_event("startup")
-def on_startup() -> None:
+async def on_startup() -> None:
     init_db()
-
-
-def get_db():
-    db = SessionLocal()
-    try:
+    writer.start()
+    play_buffer.start()
+    password_pool.start()
+    # Only a lone process may assume every persisted room emptied on restart.
+    room_registry.start(reset_counts=not (manager.pubsub.distributed or shard_map.enabled))
+    recorder.start()
+    await manager.start()
+    shard_map.start(rebalance)
+
+
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    shard_map.stop()
+    await manager.stop()
+    room_registry.stop()
+    recorder.stop()
+    play_buffer.stop()
+    writer.stop()
+    password_pool.stop()
+    await async_engine.dispose()
+
+
+# Handlers are async and read through an AsyncSession. Query code stays in
+# the synchronous ORM style inside `def load(db)` closures run with
+# `await db.run_sync(load)`: SQLAlchemy drives those queries over aiosqlite,
+# so they never block the event loop. Writes are closures handed to
+# `await writer.run_async(apply)`.
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
 
-def get_current_user(request: Request, db: Session = Depends(get_db)) -> User | None:
+async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)) -> AuthUser | None:
     token = request.cookies.get("session_token")
     if not token:
         return None
-    sess = db.query(Session).filter(Session.id == token).first()
-    if not sess:
-        return None
-    return db.query(User).filter(User.id == sess.user_id).first()
+    return await db.run_sync(session_cache.lookup, token)
 
 
 def _extract_json(text: str) -> Optional[Dict[str, Any]]:
@@ -496,298 +552,300 @@ def ai_call(payload: AiIn) -> AiOut:
     return AiOut(content=content or "")
 
 
-class ConnectionManager:
-    def __init__(self) -> None:
-        self.rooms: dict[str, set[WebSocket]] = {}
-        self.players: dict[WebSocket, dict[str, str | bool]] = {}
-        self.clients: dict[str, dict[str, WebSocket]] = {}
-
-    async def connect(self, room: str, websocket: WebSocket) -> None:
-        await websocket.accept()
-        client_id = (websocket.query_params.get("client_id") or "").strip()
-        raw_max = (websocket.query_params.get("max_players") or "").strip()
-        max_players: int | None = None
-        if raw_max:
-            try:
-                max_players = max(1, int(raw_max))
-            except ValueError:
-                max_players = None
-        room_max = _get_room_max(room, max_players)
-        if not client_id:
-            client_id = uuid.uuid4().hex[:12]
-        name = (websocket.query_params.get("name") or "Player").strip()[:24]
-        self.clients.setdefault(room, {})
-        if room_max is not None and client_id not in self.clients[room] and len(self.rooms.get(room, set())) >= room_max:
-            try:
-                await websocket.close(code=1008)
-            except Exception:
-                pass
-            return
-        if client_id in self.clients[room]:
-            old = self.clients[room][client_id]
-            if old in self.rooms.get(room, set()):
-                self.rooms[room].discard(old)
-            self.players.pop(old, None)
-            try:
-                await old.close()
-            except Exception:
-                pass
-        self.clients[room][client_id] = websocket
-        self.rooms.setdefault(room, set()).add(websocket)
-        self.players[websocket] = {
-            "id": client_id,
-            "name": name or "Player",
-            "ready": False,
-            "room": room,
-        }
-        _upsert_room(room, len(self.rooms.get(room, [])), room_max)
-
-    def disconnect(self, room: str, websocket: WebSocket) -> None:
-        if room in self.rooms:
-            self.rooms[room].discard(websocket)
-            if not self.rooms[room]:
-                self.rooms.pop(room, None)
-        meta = self.players.pop(websocket, None)
-        if meta and room in self.clients:
-            client_id = str(meta.get("id") or "")
-            if client_id and self.clients[room].get(client_id) is websocket:
-                self.clients[room].pop(client_id, None)
-            if not self.clients[room]:
-                self.clients.pop(room, None)
-        _upsert_room(room, len(self.rooms.get(room, [])), None)
-
-    async def broadcast(self, room: str, message: str) -> None:
-        for ws in list(self.rooms.get(room, [])):
-            try:
-                await ws.send_text(message)
-            except Exception:
-                self.disconnect(room, ws)
-
-    def room_state(self, room: str) -> list[dict[str, str | bool]]:
-        players = []
-        for ws in self.rooms.get(room, []):
-            meta = self.players.get(ws)
-            if meta:
-                players.append(
-                    {"id": meta["id"], "name": meta["name"], "ready": meta["ready"]}
-                )
-        return players
-
-
-manager = ConnectionManager()
-
-
-def _upsert_room(room_id: str, count: int, max_players: int | None) -> None:
-    db = SessionLocal()
-    try:
-        room = db.query(Room).filter(Room.id == room_id).first()
-        if not room:
-            room = Room(id=room_id, count=count, max_players=max_players)
-            db.add(room)
-        else:
-            room.count = count
-            if max_players and not room.max_players:
-                room.max_players = max_players
-        db.commit()
-    finally:
-        db.close()
-
-
-def _get_room_max(room_id: str, incoming: int | None) -> int | None:
-    db = SessionLocal()
-    try:
-        room = db.query(Room).filter(Room.id == room_id).first()
-        if not room:
-            return incoming
-        if incoming and not room.max_players:
-            room.max_players = incoming
-            db.commit()
-        return room.max_players
-    finally:
-        db.close()
-
-
 @app.websocket("/ws/{room_id}")
 async def ws_room(websocket: WebSocket, room_id: str):
-    await manager.connect(room_id, websocket)
-    await manager.broadcast(
-        room_id, json.dumps({"type": "room_state", "players": manager.room_state(room_id)})
-    )
+    if await route(websocket, room_id):
+        return
+    if not await manager.connect(room_id, websocket):
+        return
+    if websocket in manager.spectating:
+        # Spectators only watch; whatever they send just shows they're alive.
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                manager.touch(websocket)
+        finally:
+            manager.disconnect(room_id, websocket)
+        return
+    manager.broadcast_room_state(room_id)
+    player_id = str(manager.players[websocket]["id"])
+    recorder.record(room_id, RECORD_JOIN, player_id)
     try:
         while True:
-            data = await websocket.receive_text()
-            try:
-                payload = json.loads(data)
-            except json.JSONDecodeError:
-                payload = {"type": "message", "data": data}
-
-            if payload.get("type") == "set_name":
-                name = str(payload.get("name") or "Player")[:24]
-                if websocket in manager.players:
-                    manager.players[websocket]["name"] = name
-                await manager.broadcast(
-                    room_id,
-                    json.dumps(
-                        {
-                            "type": "room_state",
-                            "players": manager.room_state(room_id),
-                        }
-                    ),
-                )
+            tick = manager.ticks.get(room_id)
+            kinds = TICK_CONTROL_TYPES if tick is not None else CONTROL_TYPES
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            manager.touch(websocket)
+            data = message.get("text")
+            raw = message.get("bytes") if data is None else None
+            if data is None and raw is None:
                 continue
-
-            if payload.get("type") == "ready":
-                ready = bool(payload.get("ready"))
-                if websocket in manager.players:
-                    manager.players[websocket]["ready"] = ready
-                await manager.broadcast(
-                    room_id,
-                    json.dumps(
-                        {
-                            "type": "room_state",
-                            "players": manager.room_state(room_id),
-                        }
-                    ),
-                )
+            size = len(data) if data is not None else len(raw)
+            if not manager.check_size(room_id, size):
+                await websocket.close(code=1009)
+                raise WebSocketDisconnect(1009)
+            if data is not None:
+                recorder.record(room_id, RECORD_TEXT, player_id, data)
+            else:
+                recorder.record(room_id, RECORD_BINARY, player_id, raw)
+            if raw is not None:
+                if not manager.is_packed(websocket):
+                    manager.relay(room_id, websocket, Outbound(raw=raw), size)
+                    continue
+                payload = parse_packed_control(raw, kinds)
+                if payload is None:
+                    manager.relay(room_id, websocket, Outbound(packed=raw), size)
+                    continue
+            else:
+                payload = parse_control(data, kinds)
+
+            if payload is not None:
+                # Acks only move a client's delta base forward and are sent
+                # once per snapshot; throttling them would just grow the deltas.
+                if payload["type"] != "_ack" and not manager.admit(websocket, size):
+                    continue
+                if tick is not None and payload["type"] in TICK_TYPES:
+                    tick.handle(websocket, player_id, payload)
+                    continue
+                if payload["type"] == "_pong":
+                    continue
+                if payload["type"] in INTEREST_TYPES:
+                    manager.update_interest(room_id, websocket, payload)
+                    continue
+                if payload["type"] == "set_name":
+                    changed = manager.update_player(room_id, websocket, "name", str(payload.get("name") or "Player")[:24])
+                else:
+                    changed = manager.update_player(room_id, websocket, "ready", bool(payload.get("ready")))
+                if changed:
+                    manager.broadcast_room_state(room_id)
                 continue
 
-            await manager.broadcast(room_id, json.dumps(payload))
+            # Game messages that are JSON objects go out exactly as
+            # received; anything else is wrapped as {"type": "message"}.
+            if not is_json_object(data):
+                data = json.dumps({"type": "message", "data": data})
+            manager.relay(room_id, websocket, data, size)
     except WebSocketDisconnect:
+        recorder.record(room_id, RECORD_LEAVE, player_id)
         manager.disconnect(room_id, websocket)
-        await manager.broadcast(
-            room_id, json.dumps({"type": "room_state", "players": manager.room_state(room_id)})
-        )
+        manager.broadcast_room_state(room_id)
 
 
 @app.get("/lobby/rooms")
-def lobby_rooms():
-    db = SessionLocal()
-    try:
-        rooms = []
-        for r in db.query(Room).all():
-            rooms.append({"room_id": r.id, "count": r.count, "max_players": r.max_players})
-        rooms.sort(key=lambda r: r["count"], reverse=True)
-        return rooms
-    finally:
-        db.close()
+async def lobby_rooms(db: AsyncSession = Depends(get_db)):
+    """Rooms across all processes, from the `rooms` table.
+
+    This process's own rooms come from its registry, which is up to one
+    flush ahead of the table.
+    """
+
+    def load(db: Session) -> dict[str, dict[str, Any]]:
+        return {
+            r.id: {"room_id": r.id, "count": r.count, "max_players": r.max_players}
+            for r in db.query(Room.id, Room.count, Room.max_players)
+        }
+
+    rooms = await db.run_sync(load)
+    for entry in room_registry.snapshot():
+        rooms[entry["room_id"]] = entry
+    return sorted(rooms.values(), key=lambda r: r["count"], reverse=True)
+
+
+@app.get("/rooms/{room_id}/recording")
+async def room_recording(
+    room_id: str,
+    speed: float = 1.0,
+    max_gap: float = 5.0,
+    user: AuthUser | None = Depends(get_current_user),
+):
+    """Stream the room's recording as NDJSON, one entry per line.
+
+    Entries are paced at `speed` times the original rate (0 sends them as
+    fast as possible); quiet spells longer than `max_gap` seconds, such as
+    the time between two sessions, are cut down to max_gap. Recordings hold
+    players' raw traffic, so only ROOM_RECORD_ADMINS may read them.
+    """
+    if not user:
+        raise HTTPException(status_code=401, detail="Login required")
+    if user.username not in ROOM_RECORD_ADMINS:
+        raise HTTPException(status_code=403, detail="Not allowed")
+    paths = recorder.paths(room_id)
+    if not paths:
+        raise HTTPException(status_code=404, detail="No recording for this room")
+
+    async def entries():
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        offset = 0.0
+        last: float | None = None
+        for stamp, kind, sender, data in itertools.chain.from_iterable(map(read_entries, paths)):
+            if last is not None:
+                offset += min(max(0.0, stamp - last), max_gap)
+            last = stamp
+            if speed > 0:
+                delay = offset / speed - (loop.time() - started)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            entry: dict[str, Any] = {"t": round(offset, 3), "time": stamp, "kind": RECORD_KINDS.get(kind, kind), "sender": sender}
+            if kind == RECORD_TEXT:
+                entry["data"] = data.decode(errors="replace")
+            elif kind == RECORD_BINARY:
+                entry["data"] = base64.b64encode(data).decode()
+            yield json.dumps(entry) + "\n"
+
+    return StreamingResponse(entries(), media_type="application/x-ndjson")
+
+
+@app.get("/rooms/{room_id}/shard")
+async def room_shard(room_id: str) -> dict[str, Any]:
+    """Where to open the room's socket; url is null when it's this server."""
+    owner = shard_map.owner(room_id)
+    return {"room": room_id, "url": shard_map.ws_url(owner, room_id) if owner else None}
 
 
 @app.get("/parties", response_model=list[PartyOut])
-def list_parties(db: Session = Depends(get_db)) -> list[PartyOut]:
-    parties = db.query(Party).filter(Party.is_private == False).order_by(Party.updated_at.desc()).all()
-    counts = dict(
-        db.query(PartyMember.party_id, func.count(PartyMember.id))
-        .group_by(PartyMember.party_id)
-        .all()
-    )
-    for p in parties:
-        setattr(p, "member_count", counts.get(p.id, 0))
-    return parties
+async def list_parties(db: AsyncSession = Depends(get_db)) -> list[PartyOut]:
+    def load(db: Session) -> list[Party]:
+        parties = db.query(Party).filter(Party.is_private == False).order_by(Party.updated_at.desc()).all()
+        counts = dict(
+            db.query(PartyMember.party_id, func.count(PartyMember.id))
+            .group_by(PartyMember.party_id)
+            .all()
+        )
+        for p in parties:
+            setattr(p, "member_count", counts.get(p.id, 0))
+        return parties
+
+    return await db.run_sync(load)
 
 
 @app.post("/parties", response_model=PartyOut)
-def create_party(payload: PartyCreate, user: User | None = Depends(get_current_user), db: Session = Depends(get_db)) -> PartyOut:
+async def create_party(payload: PartyCreate, user: AuthUser | None = Depends(get_current_user)) -> PartyOut:
     if not user:
         raise HTTPException(status_code=401, detail="Login required")
     party_id = uuid.uuid4().hex[:8]
     join_code = None
     if payload.is_private:
         join_code = uuid.uuid4().hex[:6]
-    party = Party(
-        id=party_id,
-        name=payload.name,
-        is_private=payload.is_private,
-        join_code=join_code,
-        max_players=payload.max_players,
-    )
-    db.add(party)
-    db.commit()
-    member = PartyMember(party_id=party.id, user_id=user.id)
-    db.add(member)
-    db.commit()
-    db.refresh(party)
-    return party
+
+    def apply(db: Session) -> Party:
+        party = Party(
+            id=party_id,
+            name=payload.name,
+            is_private=payload.is_private,
+            join_code=join_code,
+            max_players=payload.max_players,
+        )
+        db.add(party)
+        db.add(PartyMember(party_id=party.id, user_id=user.id))
+        db.flush()
+        db.refresh(party)
+        return party
+
+    return await writer.run_async(apply)
 
 
 @app.get("/parties/{party_id}", response_model=PartyDetailOut)
-def get_party(party_id: str, user: User | None = Depends(get_current_user), db: Session = Depends(get_db)) -> PartyDetailOut:
-    party = db.query(Party).filter(Party.id == party_id).first()
-    if not party:
-        raise HTTPException(status_code=404, detail="Party not found")
-    if party.is_private and not user:
-        raise HTTPException(status_code=403, detail="Login required")
-    members = (
-        db.query(PartyMember, User)
-        .join(User, User.id == PartyMember.user_id)
-        .filter(PartyMember.party_id == party_id)
-        .order_by(PartyMember.joined_at.asc())
-        .all()
-    )
-    out_members = [
-        PartyMemberOut(user_id=u.id, username=u.username, joined_at=m.joined_at)
-        for m, u in members
-    ]
-    return PartyDetailOut(party=PartyOut.model_validate(party), members=out_members)
+async def get_party(
+    party_id: str,
+    user: AuthUser | None = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> PartyDetailOut:
+    def load(db: Session) -> PartyDetailOut:
+        party = db.query(Party).filter(Party.id == party_id).first()
+        if not party:
+            raise HTTPException(status_code=404, detail="Party not found")
+        if party.is_private and not user:
+            raise HTTPException(status_code=403, detail="Login required")
+        members = (
+            db.query(PartyMember.user_id, PartyMember.joined_at)
+            .filter(PartyMember.party_id == party_id)
+            .order_by(PartyMember.joined_at.asc())
+            .all()
+        )
+        names = usernames.lookup(db, [m.user_id for m in members])
+        out_members = [
+            PartyMemberOut(user_id=m.user_id, username=names[m.user_id], joined_at=m.joined_at)
+            for m in members
+            if m.user_id in names
+        ]
+        return PartyDetailOut(party=PartyOut.model_validate(party), members=out_members)
+
+    return await db.run_sync(load)
 
 
 @app.post("/parties/{party_id}/join", response_model=PartyOut)
-def join_party(party_id: str, payload: PartyJoinIn, user: User | None = Depends(get_current_user), db: Session = Depends(get_db)) -> PartyOut:
+async def join_party(party_id: str, payload: PartyJoinIn, user: AuthUser | None = Depends(get_current_user)) -> PartyOut:
     if not user:
         raise HTTPException(status_code=401, detail="Login required")
-    party = db.query(Party).filter(Party.id == party_id).first()
-    if not party:
-        raise HTTPException(status_code=404, detail="Party not found")
-    if party.is_private and payload.code != party.join_code:
-        raise HTTPException(status_code=403, detail="Invalid join code")
-    if party.max_players:
-        count = db.query(PartyMember).filter(PartyMember.party_id == party_id).count()
-        if count >= party.max_players:
-            raise HTTPException(status_code=403, detail="Party is full")
-    exists = db.query(PartyMember).filter(PartyMember.party_id == party_id, PartyMember.user_id == user.id).first()
-    if not exists:
-        db.add(PartyMember(party_id=party_id, user_id=user.id))
-        db.commit()
-    return party
+
+    def apply(db: Session) -> Party:
+        party = db.query(Party).filter(Party.id == party_id).first()
+        if not party:
+            raise HTTPException(status_code=404, detail="Party not found")
+        if party.is_private and payload.code != party.join_code:
+            raise HTTPException(status_code=403, detail="Invalid join code")
+        if party.max_players:
+            count = db.query(PartyMember).filter(PartyMember.party_id == party_id).count()
+            if count >= party.max_players:
+                raise HTTPException(status_code=403, detail="Party is full")
+        exists = db.query(PartyMember).filter(PartyMember.party_id == party_id, PartyMember.user_id == user.id).first()
+        if not exists:
+            db.add(PartyMember(party_id=party_id, user_id=user.id))
+        return party
+
+    return await writer.run_async(apply)
 
 
 @app.post("/parties/{party_id}/leave")
-def leave_party(party_id: str, user: User | None = Depends(get_current_user), db: Session = Depends(get_db)) -> dict[str, bool]:
+async def leave_party(party_id: str, user: AuthUser | None = Depends(get_current_user)) -> dict[str, bool]:
     if not user:
         raise HTTPException(status_code=401, detail="Login required")
-    db.query(PartyMember).filter(PartyMember.party_id == party_id, PartyMember.user_id == user.id).delete()
-    db.commit()
+    await writer.run_async(
+        lambda db: db.query(PartyMember)
+        .filter(PartyMember.party_id == party_id, PartyMember.user_id == user.id)
+        .delete()
+    )
     return {"ok": True}
 
 
 @app.post("/parties/{party_id}/vote")
-def vote_party(party_id: str, payload: PartyVoteIn, user: User | None = Depends(get_current_user), db: Session = Depends(get_db)) -> dict[str, bool]:
+async def vote_party(party_id: str, payload: PartyVoteIn, user: AuthUser | None = Depends(get_current_user)) -> dict[str, bool]:
     if not user:
         raise HTTPException(status_code=401, detail="Login required")
-    party = db.query(Party).filter(Party.id == party_id).first()
-    if not party:
-        raise HTTPException(status_code=404, detail="Party not found")
-    vote = db.query(PartyVote).filter(PartyVote.party_id == party_id, PartyVote.user_id == user.id).first()
-    if vote:
-        vote.game_id = payload.game_id
-    else:
-        db.add(PartyVote(party_id=party_id, user_id=user.id, game_id=payload.game_id))
-    db.commit()
+
+    def apply(db: Session) -> None:
+        party = db.query(Party).filter(Party.id == party_id).first()
+        if not party:
+            raise HTTPException(status_code=404, detail="Party not found")
+        vote = db.query(PartyVote).filter(PartyVote.party_id == party_id, PartyVote.user_id == user.id).first()
+        if vote:
+            vote.game_id = payload.game_id
+        else:
+            db.add(PartyVote(party_id=party_id, user_id=user.id, game_id=payload.game_id))
+
+    await writer.run_async(apply)
     return {"ok": True}
 
 
 @app.get("/parties/{party_id}/votes")
-def party_votes(party_id: str, db: Session = Depends(get_db)) -> list[dict[str, int]]:
+async def party_votes(party_id: str, db: AsyncSession = Depends(get_db)) -> list[dict[str, int]]:
     rows = (
-        db.query(PartyVote.game_id, func.count(PartyVote.id).label("votes"))
-        .filter(PartyVote.party_id == party_id)
-        .group_by(PartyVote.game_id)
-        .all()
-    )
+        await db.execute(
+            select(PartyVote.game_id, func.count(PartyVote.id).label("votes"))
+            .where(PartyVote.party_id == party_id)
+            .group_by(PartyVote.game_id)
+        )
+    ).all()
     return [{"game_id": r[0], "votes": r[1]} for r in rows]
 
 
 @app.post("/games", response_model=GameOut)
-def create_game(payload: GameCreate, user: User | None = Depends(get_current_user), db: Session = Depends(get_db)) -> GameOut:
+async def create_game(payload: GameCreate, user: AuthUser | None = Depends(get_current_user)) -> GameOut:
     if not user:
         raise HTTPException(status_code=401, detail="Login required")
     data = payload.dict()
@@ -795,226 +853,408 @@ def create_game(payload: GameCreate, user: User | None = Depends(get_current_use
     multiplayer, max_players = _infer_multiplayer_meta(data["code"])
     data["multiplayer"] = multiplayer
     data["max_players"] = max_players
-    game = Game(**data)
-    if user:
-        game.creator_id = user.id
-    db.add(game)
-    db.commit()
-    db.refresh(game)
-    version = GameVersion(
-        game_id=game.id,
-        title=game.title,
-        description=game.description,
-        prompt=game.prompt,
-        code=game.code,
-        action="create",
-    )
-    db.add(version)
-    db.commit()
-    return game
+    # Compression at brotli's top level takes real CPU; keep it off the loop.
+    await run_in_threadpool(blobs.prepare, data["code"])
+
+    def apply(db: Session) -> Game:
+        game = Game(**data)
+        if user:
+            game.creator_id = user.id
+        db.add(game)
+        db.flush()
+        db.refresh(game)
+        versions.snapshot(db, game, "create")
+        return game
+
+    return await writer.run_async(apply)
 
 
-@app.get("/games", response_model=list[GameOut])
-def list_games(
+def _encode_cursor(values: list[Any]) -> str:
+    raw = json.dumps(values, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, size: int) -> list[Any]:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, json.JSONDecodeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # Keys are compared in SQL, so anything but plain scalars is rejected.
+    if any(isinstance(value, bool) or not isinstance(value, (str, int, float)) for value in values):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+
+@app.get("/games", response_model=list[GameOut] | list[GameSummaryOut])
+async def list_games(
+    response: Response,
     q: str | None = None,
-    sort: str = "recent",
+    sort: str | None = None,
     multiplayer: bool = False,
     min_players: int | None = None,
-    db: Session = Depends(get_db),
-) -> list[GameOut]:
-    query = db.query(Game).filter(Game.is_public == True)
-    if q:
-        like = f"%{q}%"
-        query = query.filter((Game.title.ilike(like)) | (Game.description.ilike(like)))
-    if multiplayer:
-        query = query.filter(Game.multiplayer == True)
-    if min_players:
-        query = query.filter(Game.max_players >= min_players)
-    if sort == "top":
-        vote_counts = (
-            db.query(GameVote.game_id, func.count(GameVote.id).label("votes"))
-            .group_by(GameVote.game_id)
-            .subquery()
-        )
-        query = query.outerjoin(vote_counts, Game.id == vote_counts.c.game_id).order_by(func.coalesce(vote_counts.c.votes, 0).desc(), Game.created_at.desc())
-    else:
-        query = query.order_by(Game.created_at.desc())
-    games = query.all()
-    # attach likes
-    counts = dict(
-        db.query(GameVote.game_id, func.count(GameVote.id))
-        .group_by(GameVote.game_id)
-        .all()
-    )
-    for g in games:
-        setattr(g, "likes", counts.get(g.id, 0))
-    return games
-
-
-@app.get("/games/{game_id}", response_model=GameOut)
-def get_game(game_id: int, user: User | None = Depends(get_current_user), db: Session = Depends(get_db)) -> GameOut:
-    game = db.query(Game).filter(Game.id == game_id).first()
+    view: str = "full",
+    limit: int | None = Query(None, ge=1),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_db),
+) -> list[GameOut] | list[GameSummaryOut]:
+    # Keyset pagination: rows are ordered by (likes, created_at, id) or
+    # (created_at, id) descending, or by (rank, id) ascending for relevance,
+    # and the cursor holds the last row's key. created_at is compared as the
+    # raw stored text so the cursor matches exactly what SQLite sorts on.
+    if not sort:
+        sort = "relevance" if q else "recent"
+
+    def load(db: Session) -> list[GameOut] | list[GameSummaryOut]:
+        created_key = type_coerce(Game.created_at, String)
+        query = db.query(Game, created_key.label("created_key")).filter(Game.is_public == True)
+        if view == "summary":
+            query = query.options(
+                lazyload(Game.blob),
+                load_only(
+                    Game.id,
+                    Game.title,
+                    Game.description,
+                    Game.code_hash,
+                    Game.created_at,
+                    Game.creator_id,
+                    Game.is_public,
+                    Game.play_count,
+                    Game.likes,
+                    Game.multiplayer,
+                    Game.max_players,
+                )
+            )
+        matches = search.match_subquery(q) if q else None
+        if matches is not None:
+            query = query.join(matches, Game.id == matches.c.game_id)
+        elif q:
+            like = f"%{q}%"
+            query = query.filter((Game.title.ilike(like)) | (Game.description.ilike(like)))
+        if multiplayer:
+            query = query.filter(Game.multiplayer == True)
+        if min_players:
+            query = query.filter(Game.max_players >= min_players)
+        if sort == "relevance" and matches is not None:
+            query = query.add_columns(matches.c.rank.label("rank"))
+            if cursor:
+                after = _decode_cursor(cursor, 2)
+                query = query.filter(tuple_(matches.c.rank, Game.id) > tuple_(*after))
+            query = query.order_by(matches.c.rank.asc(), Game.id.asc())
+        elif sort == "top":
+            if cursor:
+                after = _decode_cursor(cursor, 3)
+                query = query.filter(tuple_(Game.likes, created_key, Game.id) < tuple_(*after))
+            query = query.order_by(Game.likes.desc(), created_key.desc(), Game.id.desc())
+        else:
+            if cursor:
+                after = _decode_cursor(cursor, 2)
+                query = query.filter(tuple_(created_key, Game.id) < tuple_(*after))
+            query = query.order_by(created_key.desc(), Game.id.desc())
+        # Only clients that page (limit= or cursor=) get pages; the rest
+        # still get the whole list, since they never follow X-Next-Cursor.
+        paged = limit is not None or cursor is not None
+        page_size = min(limit or GAMES_PAGE_MAX, GAMES_PAGE_MAX)
+        rows = query.limit(page_size + 1).all() if paged else query.all()
+        if paged and len(rows) > page_size:
+            rows = rows[:page_size]
+            last = rows[-1]
+            if sort == "relevance" and matches is not None:
+                key = [last.rank, last.Game.id]
+            else:
+                key = [last.created_key, last.Game.id]
+                if sort == "top":
+                    key.insert(0, last.Game.likes)
+            response.headers["X-Next-Cursor"] = _encode_cursor(key)
+        games = [row.Game for row in rows]
+        if view == "summary":
+            return [GameSummaryOut.model_validate(g) for g in games]
+        return games
+
+    return await db.run_sync(load)
+
+
+@app.get("/games/{game_id}", response_model=GameOut | GameSummaryOut)
+async def get_game(
+    game_id: int,
+    view: str = "full",
+    user: AuthUser | None = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> GameOut | GameSummaryOut:
+    query = select(Game).where(Game.id == game_id)
+    if view == "summary":
+        query = query.options(lazyload(Game.blob), defer(Game.legacy_code), defer(Game.prompt))
+    game = (await db.execute(query)).unique().scalar_one_or_none()
     if not game:
         raise HTTPException(status_code=404, detail="Game not found")
     if not game.is_public and (not user or game.creator_id != user.id):
         raise HTTPException(status_code=403, detail="Not allowed")
-    likes = db.query(GameVote).filter(GameVote.game_id == game.id).count()
-    setattr(game, "likes", likes)
+    if view == "summary":
+        return GameSummaryOut.model_validate(game)
     return game
 
 
+def _pick_encoding(accept: str) -> list[str]:
+    """Content codings the client accepts, best first, always ending in identity."""
+    accepted = {}
+    for part in accept.split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return [enc for enc in ("br", "gzip") if accepted.get(enc, accepted.get("*", 0.0)) > 0] + ["identity"]
+
+
+@app.get("/games/{game_id}/html")
+async def game_html(
+    game_id: int,
+    request: Request,
+    user: AuthUser | None = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> Response:
+    row = (await db.execute(select(Game.code_hash, Game.is_public, Game.creator_id).where(Game.id == game_id))).first()
+    if not row:
+        raise HTTPException(status_code=404, detail="Game not found")
+    if not row.is_public and (not user or row.creator_id != user.id):
+        raise HTTPException(status_code=403, detail="Not allowed")
+    code_hash = row.code_hash
+    legacy = None
+    if not code_hash:
+        legacy = await db.scalar(select(Game.legacy_code).where(Game.id == game_id)) or ""
+        code_hash = blobs.hash_code(legacy)
+
+    headers = {
+        "Cache-Control": "no-cache" if row.is_public else "private, no-cache",
+        "Vary": "Accept-Encoding",
+    }
+    # One strong ETag per representation; any of them proves the client
+    # already has this code.
+    tags = [t.strip().removeprefix("W/") for t in request.headers.get("if-none-match", "").split(",")]
+    if "*" in tags or any(t.strip('"').split("-")[0] == code_hash for t in tags if t):
+        headers["ETag"] = f'"{code_hash}"'
+        return Response(status_code=304, headers=headers)
+
+    for encoding in _pick_encoding(request.headers.get("accept-encoding", "")):
+        if encoding == "identity":
+            code = legacy if legacy is not None else await db.run_sync(blobs.get, code_hash)
+            body = (code or "").encode()
+            headers["ETag"] = f'"{code_hash}"'
+            break
+        if legacy is not None:
+            continue
+        column = CodeBlob.br_data if encoding == "br" else CodeBlob.gzip_data
+        body = await db.scalar(select(column).where(CodeBlob.hash == code_hash))
+        if body:
+            headers["ETag"] = f'"{code_hash}-{encoding}"'
+            headers["Content-Encoding"] = encoding
+            break
+    return Response(content=body, media_type="text/html; charset=utf-8", headers=headers)
+
+
 @app.get("/games/mine", response_model=list[GameOut])
-def my_games(user: User | None = Depends(get_current_user), db: Session = Depends(get_db)) -> list[GameOut]:
+async def my_games(user: AuthUser | None = Depends(get_current_user), db: AsyncSession = Depends(get_db)) -> list[GameOut]:
     if not user:
         return []
-    return db.query(Game).filter(Game.creator_id == user.id).order_by(Game.created_at.desc()).all()
+    query = select(Game).where(Game.creator_id == user.id).order_by(Game.created_at.desc())
+    return (await db.execute(query)).unique().scalars().all()
 
 
-@app.put("/games/{game_id}", response_model=GameOut)
-def update_game(game_id: int, payload: GameUpdate, db: Session = Depends(get_db)) -> GameOut:
-    game = db.query(Game).filter(Game.id == game_id).first()
-    if not game:
-        raise HTTPException(status_code=404, detail="Game not found")
+async def _prepare_legacy_code(db: AsyncSession, game_id: int) -> None:
+    """Compress a pre-blob-store game's code ahead of a snapshot.
 
-    # Save current version before manual update
-    version = GameVersion(
-        game_id=game.id,
-        title=game.title,
-        description=game.description,
-        prompt=game.prompt,
-        code=game.code,
-        action="manual",
+    versions.snapshot moves such code into the blob store from inside the
+    writer job; prepared here, that move doesn't compress on the writer thread.
+    """
+    legacy = await db.scalar(
+        select(Game.legacy_code).where(Game.id == game_id, func.coalesce(Game.code_hash, "") == "")
     )
-    db.add(version)
-    db.commit()
-
-    if payload.title is not None:
-        game.title = payload.title
-    if payload.description is not None:
-        game.description = payload.description
-    if payload.prompt is not None:
-        game.prompt = payload.prompt
-    if payload.code is not None:
-        game.code = _sanitize_html(payload.code)
-        multiplayer, max_players = _infer_multiplayer_meta(game.code)
-        game.multiplayer = multiplayer
-        game.max_players = max_players
-    db.commit()
-    db.refresh(game)
-    return game
+    if legacy:
+        await run_in_threadpool(blobs.prepare, legacy)
+
+
+@app.put("/games/{game_id}", response_model=GameOut)
+async def update_game(game_id: int, payload: GameUpdate, db: AsyncSession = Depends(get_db)) -> GameOut:
+    code = _sanitize_html(payload.code) if payload.code is not None else None
+    if code is not None:
+        await run_in_threadpool(blobs.prepare, code)
+    await _prepare_legacy_code(db, game_id)
+
+    def apply(db: Session) -> Game:
+        game = db.query(Game).filter(Game.id == game_id).first()
+        if not game:
+            raise HTTPException(status_code=404, detail="Game not found")
+
+        # Save current version before manual update
+        versions.snapshot(db, game, "manual")
+
+        if payload.title is not None:
+            game.title = payload.title
+        if payload.description is not None:
+            game.description = payload.description
+        if payload.prompt is not None:
+            game.prompt = payload.prompt
+        if code is not None:
+            if blobs.hash_code(code) != game.code_hash:
+                game.code = code
+                multiplayer, max_players = _infer_multiplayer_meta(game.code)
+                game.multiplayer = multiplayer
+                game.max_players = max_players
+        return game
+
+    return await writer.run_async(apply)
 
 
 @app.post("/games/{game_id}/publish", response_model=GameOut)
-def publish_game(game_id: int, user: User | None = Depends(get_current_user), db: Session = Depends(get_db)) -> GameOut:
-    game = db.query(Game).filter(Game.id == game_id).first()
-    if not game:
-        raise HTTPException(status_code=404, detail="Game not found")
-    if not user or game.creator_id != user.id:
-        raise HTTPException(status_code=403, detail="Not allowed")
-    game.is_public = True
-    db.commit()
-    db.refresh(game)
-    return game
+async def publish_game(game_id: int, user: AuthUser | None = Depends(get_current_user)) -> GameOut:
+    def apply(db: Session) -> Game:
+        game = db.query(Game).filter(Game.id == game_id).first()
+        if not game:
+            raise HTTPException(status_code=404, detail="Game not found")
+        if not user or game.creator_id != user.id:
+            raise HTTPException(status_code=403, detail="Not allowed")
+        game.is_public = True
+        return game
+
+    return await writer.run_async(apply)
 
 
 @app.post("/games/{game_id}/unpublish", response_model=GameOut)
-def unpublish_game(game_id: int, user: User | None = Depends(get_current_user), db: Session = Depends(get_db)) -> GameOut:
-    game = db.query(Game).filter(Game.id == game_id).first()
-    if not game:
-        raise HTTPException(status_code=404, detail="Game not found")
-    if not user or game.creator_id != user.id:
-        raise HTTPException(status_code=403, detail="Not allowed")
-    game.is_public = False
-    db.commit()
-    db.refresh(game)
-    return game
+async def unpublish_game(game_id: int, user: AuthUser | None = Depends(get_current_user)) -> GameOut:
+    def apply(db: Session) -> Game:
+        game = db.query(Game).filter(Game.id == game_id).first()
+        if not game:
+            raise HTTPException(status_code=404, detail="Game not found")
+        if not user or game.creator_id != user.id:
+            raise HTTPException(status_code=403, detail="Not allowed")
+        game.is_public = False
+        return game
+
+    return await writer.run_async(apply)
 
 
 @app.post("/games/{game_id}/vote")
-def vote_game(game_id: int, user: User | None = Depends(get_current_user), db: Session = Depends(get_db)):
+async def vote_game(game_id: int, user: AuthUser | None = Depends(get_current_user)):
     if not user:
         raise HTTPException(status_code=401, detail="Login required")
-    vote = db.query(GameVote).filter(GameVote.game_id == game_id, GameVote.user_id == user.id).first()
-    if vote:
-        db.delete(vote)
-        db.commit()
-        return {"voted": False}
-    vote = GameVote(game_id=game_id, user_id=user.id)
-    db.add(vote)
-    db.commit()
-    return {"voted": True}
+
+    # The vote row and the denormalized counter change in one transaction.
+    def apply(db: Session) -> bool:
+        likes = db.query(Game).filter(Game.id == game_id)
+        vote = db.query(GameVote).filter(GameVote.game_id == game_id, GameVote.user_id == user.id).first()
+        if vote:
+            db.delete(vote)
+            likes.update({Game.likes: Game.likes - 1}, synchronize_session=False)
+            return False
+        db.add(GameVote(game_id=game_id, user_id=user.id))
+        likes.update({Game.likes: Game.likes + 1}, synchronize_session=False)
+        return True
+
+    return {"voted": await writer.run_async(apply)}
 
 
 @app.post("/games/{game_id}/play")
-def track_play(game_id: int, db: Session = Depends(get_db)):
-    game = db.query(Game).filter(Game.id == game_id).first()
-    if not game:
+async def track_play(game_id: int, db: AsyncSession = Depends(get_db)):
+    row = (await db.execute(select(Game.play_count).where(Game.id == game_id))).first()
+    if not row:
         raise HTTPException(status_code=404, detail="Game not found")
-    game.play_count = (game.play_count or 0) + 1
-    db.commit()
-    return {"plays": game.play_count}
+    return {"plays": (row.play_count or 0) + play_buffer.add(game_id)}
 
 
 @app.get("/games/{game_id}/votes")
-def vote_count(game_id: int, db: Session = Depends(get_db)):
-    count = db.query(GameVote).filter(GameVote.game_id == game_id).count()
-    return {"count": count}
-
-
-@app.get("/games/{game_id}/comments")
-def list_comments(game_id: int, db: Session = Depends(get_db)):
-    comments = (
-        db.query(GameComment)
-        .filter(GameComment.game_id == game_id)
-        .order_by(GameComment.created_at.desc())
-        .all()
-    )
-    result = []
-    for c in comments:
-        user = db.query(User).filter(User.id == c.user_id).first()
-        result.append(
-            {
-                "id": c.id,
-                "game_id": c.game_id,
-                "user_id": c.user_id,
-                "username": user.username if user else "Unknown",
-                "content": c.content,
-                "created_at": c.created_at,
-            }
-        )
-    return result
+async def vote_count(game_id: int, db: AsyncSession = Depends(get_db)):
+    count = await db.scalar(select(Game.likes).where(Game.id == game_id))
+    return {"count": count or 0}
+
+
+@app.get("/games/{game_id}/comments", response_model=list[CommentOut])
+async def list_comments(
+    game_id: int,
+    response: Response,
+    limit: int | None = Query(None, ge=1),
+    cursor: str | None = None,
+    db: AsyncSession = Depends(get_db),
+) -> list[CommentOut]:
+    # Newest first, keyset-paged over the (game_id, created_at, id) index.
+    # Usernames come from the shared cache, so a warm page is one query.
+    def load(db: Session) -> list[CommentOut]:
+        created_key = type_coerce(GameComment.created_at, String)
+        query = db.query(GameComment, created_key.label("created_key")).filter(GameComment.game_id == game_id)
+        if cursor:
+            after = _decode_cursor(cursor, 2)
+            query = query.filter(tuple_(created_key, GameComment.id) < tuple_(*after))
+        page_size = min(limit or COMMENTS_PAGE_MAX, COMMENTS_PAGE_MAX)
+        rows = query.order_by(created_key.desc(), GameComment.id.desc()).limit(page_size + 1).all()
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            response.headers["X-Next-Cursor"] = _encode_cursor([rows[-1].created_key, rows[-1].GameComment.id])
+        names = usernames.lookup(db, list({row.GameComment.user_id for row in rows}))
+        return [
+            CommentOut(
+                id=c.id,
+                game_id=c.game_id,
+                user_id=c.user_id,
+                username=names.get(c.user_id, "Unknown"),
+                content=c.content,
+                created_at=c.created_at,
+            )
+            for c in (row.GameComment for row in rows)
+        ]
+
+    return await db.run_sync(load)
 
 
 @app.post("/games/{game_id}/comments", response_model=CommentOut)
-def create_comment(game_id: int, payload: CommentIn, user: User | None = Depends(get_current_user), db: Session = Depends(get_db)) -> CommentOut:
+async def create_comment(game_id: int, payload: CommentIn, user: AuthUser | None = Depends(get_current_user)) -> CommentOut:
     if not user:
         raise HTTPException(status_code=401, detail="Login required")
-    comment = GameComment(game_id=game_id, user_id=user.id, content=payload.content)
-    db.add(comment)
-    db.commit()
-    db.refresh(comment)
-    return comment
+
+    def apply(db: Session) -> GameComment:
+        comment = GameComment(game_id=game_id, user_id=user.id, content=payload.content)
+        db.add(comment)
+        db.flush()
+        db.refresh(comment)
+        return comment
+
+    comment = await writer.run_async(apply)
+    usernames.put(user.id, user.username)
+    return CommentOut(
+        id=comment.id,
+        game_id=comment.game_id,
+        user_id=comment.user_id,
+        username=user.username,
+        content=comment.content,
+        created_at=comment.created_at,
+    )
 
 
 @app.post("/auth/register", response_model=UserOut)
-def register(payload: AuthIn, response: Response, db: Session = Depends(get_db)) -> UserOut:
+async def register(payload: AuthIn, response: Response, db: AsyncSession = Depends(get_db)) -> UserOut:
     if not payload.username:
         raise HTTPException(status_code=400, detail="Username required")
-    if db.query(User).filter(User.email == payload.email).first():
+    if await db.scalar(select(User.id).where(User.email == payload.email)):
         raise HTTPException(status_code=400, detail="Email already in use")
-    if db.query(User).filter(User.username == payload.username).first():
+    if await db.scalar(select(User.id).where(User.username == payload.username)):
         raise HTTPException(status_code=400, detail="Username already in use")
-    user = User(
-        email=payload.email,
-        username=payload.username,
-        password_hash=pbkdf2_sha256.hash(payload.password),
-    )
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    password_hash = await password_pool.hash(payload.password)
     token = uuid.uuid4().hex
-    db.add(Session(id=token, user_id=user.id))
-    db.commit()
+
+    def apply(db: Session) -> User:
+        # Re-check inside the write transaction; the checks above only fail fast.
+        if db.query(User).filter((User.email == payload.email) | (User.username == payload.username)).first():
+            raise HTTPException(status_code=400, detail="Email or username already in use")
+        user = User(email=payload.email, username=payload.username, password_hash=password_hash)
+        db.add(user)
+        db.flush()
+        db.add(Session(id=token, user_id=user.id))
+        return user
+
+    user = await writer.run_async(apply)
     secure_cookie = bool(os.getenv("COOKIE_SECURE"))
     response.set_cookie(
         "session_token",
@@ -1027,13 +1267,24 @@ def register(payload: AuthIn, response: Response, db: Session = Depends(get_db))
 
 
 @app.post("/auth/login", response_model=UserOut)
-def login(payload: AuthIn, response: Response, db: Session = Depends(get_db)) -> UserOut:
-    user = db.query(User).filter(User.email == payload.email).first()
-    if not user or not pbkdf2_sha256.verify(payload.password, user.password_hash):
+async def login(payload: AuthIn, response: Response, db: AsyncSession = Depends(get_db)) -> UserOut:
+    user = await db.scalar(select(User).where(User.email == payload.email))
+    if not user:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+    ok, new_hash = await password_pool.verify(payload.password, user.password_hash)
+    if not ok:
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = uuid.uuid4().hex
-    db.add(Session(id=token, user_id=user.id))
-    db.commit()
+    user_id = user.id
+
+    def apply(db: Session) -> None:
+        db.add(Session(id=token, user_id=user_id))
+        if new_hash:
+            # PASSWORD_ROUNDS changed since this hash was made; upgrade it now
+            # that we have the plaintext.
+            db.query(User).filter(User.id == user_id).update({User.password_hash: new_hash})
+
+    await writer.run_async(apply)
     secure_cookie = bool(os.getenv("COOKIE_SECURE"))
     response.set_cookie(
         "session_token",
@@ -1046,64 +1297,89 @@ def login(payload: AuthIn, response: Response, db: Session = Depends(get_db)) ->
 
 
 @app.post("/auth/logout")
-def logout(request: Request, response: Response, db: Session = Depends(get_db)):
+async def logout(request: Request, response: Response):
     token = request.cookies.get("session_token")
     if token:
-        sess = db.query(Session).filter(Session.id == token).first()
-        if sess:
-            db.delete(sess)
-            db.commit()
+        await writer.run_async(lambda db: db.query(Session).filter(Session.id == token).delete())
+        session_cache.invalidate(token)
     response.delete_cookie("session_token")
     return {"ok": True}
 
 
 @app.get("/auth/me", response_model=UserOut | None)
-def me(user: User | None = Depends(get_current_user)) -> UserOut | None:
+async def me(user: AuthUser | None = Depends(get_current_user)) -> UserOut | None:
     return user
 
 
+@app.get("/metrics")
+async def metrics() -> dict[str, Any]:
+    return {
+        "session_cache": session_cache.stats(),
+        "db_writer": writer.stats(),
+        "password_pool": password_pool.stats(),
+        "websockets": manager.stats(),
+        "throttle": manager.throttle_stats(),
+        "pubsub": manager.pubsub.stats(),
+        "shards": shard_map.stats(),
+        "recorder": recorder.stats(),
+    }
+
+
 @app.get("/games/{game_id}/versions", response_model=list[GameVersionOut])
-def list_versions(game_id: int, db: Session = Depends(get_db)) -> list[GameVersionOut]:
-    return (
-        db.query(GameVersion)
-        .filter(GameVersion.game_id == game_id)
-        .order_by(GameVersion.created_at.desc())
-        .all()
-    )
+async def list_versions(game_id: int, db: AsyncSession = Depends(get_db)) -> list[GameVersionOut]:
+    history = await db.run_sync(versions.load_history, game_id)
+    history.sort(key=lambda item: (item[0].created_at, item[0].id), reverse=True)
+    return [
+        GameVersionOut(
+            id=v.id,
+            game_id=v.game_id,
+            title=v.title,
+            description=v.description,
+            prompt=v.prompt,
+            code=code,
+            action=v.action,
+            created_at=v.created_at,
+        )
+        for v, code in history
+    ]
 
 
 @app.post("/games/{game_id}/edit", response_model=GameOut)
-def edit_game(game_id: int, payload: EditIn, db: Session = Depends(get_db)) -> GameOut:
-    game = db.query(Game).filter(Game.id == game_id).first()
-    if not game:
-        raise HTTPException(status_code=404, detail="Game not found")
+async def edit_game(game_id: int, payload: EditIn, db: AsyncSession = Depends(get_db)) -> GameOut:
+    await _prepare_legacy_code(db, game_id)
 
-    # Save current version before editing
-    version = GameVersion(
-        game_id=game.id,
-        title=game.title,
-        description=game.description,
-        prompt=game.prompt,
-        code=game.code,
-        action="edit",
-    )
-    db.add(version)
-    db.commit()
+    def snapshot(db: Session) -> Game:
+        game = db.query(Game).filter(Game.id == game_id).first()
+        if not game:
+            raise HTTPException(status_code=404, detail="Game not found")
+
+        # Save current version before editing
+        versions.snapshot(db, game, "edit")
+        return game
 
+    game = await writer.run_async(snapshot)
+
+    # The model call runs outside the writer so it never holds up other writes.
     try:
-        updated = _edit_game(game.code, payload.instruction, game.prompt)
+        updated = await run_in_threadpool(_edit_game, game.code, payload.instruction, game.prompt)
     except Exception as exc:
         raise HTTPException(status_code=500, detail=str(exc))
+    code = _sanitize_html(updated["code"])
+    await run_in_threadpool(blobs.prepare, code)
+
+    def apply(db: Session) -> Game:
+        game = db.query(Game).filter(Game.id == game_id).first()
+        if not game:
+            raise HTTPException(status_code=404, detail="Game not found")
+        game.title = updated["title"]
+        game.description = updated["description"]
+        game.code = code
+        multiplayer, max_players = _infer_multiplayer_meta(game.code)
+        game.multiplayer = multiplayer
+        game.max_players = max_players
+        return game
 
-    game.title = updated["title"]
-    game.description = updated["description"]
-    game.code = _sanitize_html(updated["code"])
-    multiplayer, max_players = _infer_multiplayer_meta(game.code)
-    game.multiplayer = multiplayer
-    game.max_players = max_players
-    db.commit()
-    db.refresh(game)
-    return game
+    return await writer.run_async(apply)
 
 
 @app.post("/edit-preview", response_model=GenerateOut)
@@ -1116,37 +1392,44 @@ def edit_preview(payload: EditPreviewIn):
 
 
 @app.post("/games/{game_id}/rollback/{version_id}", response_model=GameOut)
-def rollback_game(game_id: int, version_id: int, db: Session = Depends(get_db)) -> GameOut:
-    game = db.query(Game).filter(Game.id == game_id).first()
-    if not game:
-        raise HTTPException(status_code=404, detail="Game not found")
-    version = (
-        db.query(GameVersion)
-        .filter(GameVersion.id == version_id, GameVersion.game_id == game_id)
-        .first()
-    )
-    if not version:
-        raise HTTPException(status_code=404, detail="Version not found")
-
-    # Save current before rollback
-    current = GameVersion(
-        game_id=game.id,
-        title=game.title,
-        description=game.description,
-        prompt=game.prompt,
-        code=game.code,
-        action="rollback",
-    )
-    db.add(current)
-    db.commit()
-
-    game.title = version.title
-    game.description = version.description
-    game.prompt = version.prompt
-    game.code = version.code
-    multiplayer, max_players = _infer_multiplayer_meta(game.code)
-    game.multiplayer = multiplayer
-    game.max_players = max_players
-    db.commit()
-    db.refresh(game)
-    return game
+async def rollback_game(game_id: int, version_id: int, db: AsyncSession = Depends(get_db)) -> GameOut:
+    def load(db: Session) -> str:
+        version = (
+            db.query(GameVersion)
+            .filter(GameVersion.id == version_id, GameVersion.game_id == game_id)
+            .first()
+        )
+        if not version:
+            raise HTTPException(status_code=404, detail="Version not found")
+        return versions.load_code(db, version)
+
+    # Rebuild and compress the old code before taking the writer.
+    code = await db.run_sync(load)
+    await run_in_threadpool(blobs.prepare, code)
+    await _prepare_legacy_code(db, game_id)
+
+    def apply(db: Session) -> Game:
+        game = db.query(Game).filter(Game.id == game_id).first()
+        if not game:
+            raise HTTPException(status_code=404, detail="Game not found")
+        version = (
+            db.query(GameVersion)
+            .filter(GameVersion.id == version_id, GameVersion.game_id == game_id)
+            .first()
+        )
+        if not version:
+            raise HTTPException(status_code=404, detail="Version not found")
+
+        # Save current before rollback
+        versions.snapshot(db, game, "rollback")
+
+        game.title = version.title
+        game.description = version.description
+        game.prompt = version.prompt
+        game.code = code
+        multiplayer, max_players = _infer_multiplayer_meta(game.code)
+        game.multiplayer = multiplayer
+        game.max_players = max_players
+        return game
+
+    return await writer.run_async(apply)
@@ -0,0 +1,119 @@
+from __future__ import annotations
+
+import argparse
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+from . import blobs, search, versions
+from .db import SessionLocal, engine, init_db
+from .models import Game, GameVersion
+
+
+def reconcile_likes(engine: Engine) -> int:
+    """Reset Game.likes from game_votes wherever the counter has drifted."""
+    with engine.begin() as conn:
+        result = conn.execute(
+            text(
+                "UPDATE games SET likes = (SELECT COUNT(*) FROM game_votes WHERE game_votes.game_id = games.id) "
+                "WHERE likes IS NOT (SELECT COUNT(*) FROM game_votes WHERE game_votes.game_id = games.id)"
+            )
+        )
+        return result.rowcount
+
+
+def compress_versions() -> int:
+    """Re-encode legacy full-text versions as keyframes and deltas."""
+    db = SessionLocal()
+    try:
+        game_ids = [
+            row.game_id
+            for row in db.query(GameVersion.game_id).filter(GameVersion.storage.in_(["full", "key"])).distinct()
+        ]
+        changed = 0
+        for game_id in game_ids:
+            changed += versions.compress_history(db, game_id)
+            db.commit()
+    finally:
+        db.close()
+    return changed
+
+
+def migrate_blobs() -> int:
+    """Move games' inline code into the blob store; returns games moved."""
+    db = SessionLocal()
+    try:
+        moved = 0
+        while True:
+            batch = db.query(Game).filter(Game.code_hash.is_(None)).limit(100).all()
+            if not batch:
+                break
+            for game in batch:
+                game.code = game.legacy_code
+            db.commit()
+            moved += len(batch)
+    finally:
+        db.close()
+    return moved
+
+
+def backfill_variants() -> int:
+    db = SessionLocal()
+    try:
+        count = blobs.backfill_variants(db)
+        db.commit()
+    finally:
+        db.close()
+    return count
+
+
+def gc_blobs() -> int:
+    db = SessionLocal()
+    try:
+        deleted = blobs.collect_garbage(db)
+        db.commit()
+    finally:
+        db.close()
+    return deleted
+
+
+def vacuum() -> None:
+    """Return freed pages to the filesystem."""
+    with engine.connect() as conn:
+        conn.execute(text("VACUUM"))
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m apps.api.maintenance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild-search", help="Rebuild the full-text search index from the games table")
+    sub.add_parser("reconcile-likes", help="Repair like counters that drifted from game_votes")
+    sub.add_parser("compress-versions", help="Convert legacy version rows to keyframe/delta storage")
+    sub.add_parser("migrate-blobs", help="Move inline game code into the blob store and compress versions")
+    sub.add_parser("gc-blobs", help="Delete code blobs nothing references")
+    args = parser.parse_args(argv)
+
+    init_db()
+    if args.command == "rebuild-search":
+        if not search.fts_enabled:
+            raise SystemExit("SQLite was built without FTS5; search falls back to LIKE")
+        search.rebuild_index(engine)
+        print("Search index rebuilt")
+    elif args.command == "reconcile-likes":
+        print(f"Repaired {reconcile_likes(engine)} like counters")
+    elif args.command == "compress-versions":
+        print(f"Compressed {compress_versions()} versions")
+        vacuum()
+    elif args.command == "migrate-blobs":
+        print(f"Moved {migrate_blobs()} games into the blob store")
+        print(f"Compressed {compress_versions()} versions")
+        print(f"Deleted {gc_blobs()} unreferenced blobs")
+        print(f"Precompressed {backfill_variants()} game blobs")
+        vacuum()
+    elif args.command == "gc-blobs":
+        print(f"Deleted {gc_blobs()} unreferenced blobs")
+        vacuum()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,7 @@
 from __future__ import annotations
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, UniqueConstraint
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, ForeignKey, Index, LargeBinary, UniqueConstraint
+from sqlalchemy.orm import deferred, relationship
 from sqlalchemy.sql import func
 
 from .db import Base
@@ -8,19 +9,61 @@ from .db import Base
 
 class Game(Base):
     __tablename__ = "games"
+    __table_args__ = (
+        Index("ix_games_public_created", "is_public", "created_at", "id"),
+        Index("ix_games_public_likes", "is_public", "likes", "created_at", "id"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String(200), nullable=False)
     description = Column(String(400), nullable=False)
     prompt = Column(Text, nullable=False)
-    code = Column(Text, nullable=False)
+    # Code lives in code_blobs; the old column only holds games that predate
+    # the blob store until `maintenance migrate-blobs` moves them.
+    legacy_code = Column("code", Text, nullable=False, default="")
+    code_hash = Column(String(64), nullable=True, index=True)
+    blob = relationship("CodeBlob", primaryjoin="foreign(Game.code_hash) == CodeBlob.hash", viewonly=True, lazy="joined")
     creator_id = Column(Integer, nullable=True, index=True)
     is_public = Column(Boolean, nullable=False, default=True)
     play_count = Column(Integer, nullable=False, default=0)
+    likes = Column(Integer, nullable=False, default=0)
     multiplayer = Column(Boolean, nullable=False, default=False)
     max_players = Column(Integer, nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
+    @property
+    def code(self) -> str:
+        from .blobs import decode
+
+        if "_code" in self.__dict__:
+            return self.__dict__["_code"]
+        if self.blob is not None:
+            return decode(self.blob)
+        return self.legacy_code
+
+    @code.setter
+    def code(self, value: str) -> None:
+        from .blobs import hash_code
+
+        self.code_hash = hash_code(value)
+        self.legacy_code = ""
+        self.__dict__["_code"] = value
+        self.__dict__["_pending_code"] = value
+
+
+class CodeBlob(Base):
+    __tablename__ = "code_blobs"
+
+    hash = Column(String(64), primary_key=True)
+    codec = Column(String(10), nullable=False)
+    size = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+    # Precompressed bodies for the raw HTML endpoint, which selects the one it
+    # serves; deferred so the eager Game.blob join doesn't drag them along.
+    gzip_data = deferred(Column(LargeBinary, nullable=True))
+    br_data = deferred(Column(LargeBinary, nullable=True))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 
 class GameVersion(Base):
     __tablename__ = "game_versions"
@@ -30,7 +73,12 @@ class GameVersion(Base):
     title = Column(String(200), nullable=False)
     description = Column(String(400), nullable=False)
     prompt = Column(Text, nullable=False)
-    code = Column(Text, nullable=False)
+    # Only legacy "full" rows keep text here; see versions.py for the encoding.
+    code = Column(Text, nullable=False, default="")
+    storage = Column(String(10), nullable=False, default="full")
+    base_id = Column(Integer, nullable=True)
+    code_hash = Column(String(64), nullable=True)
+    payload = Column(LargeBinary, nullable=True)
     action = Column(String(50), nullable=False, default="edit")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
@@ -106,6 +154,7 @@ class GameVote(Base):
 
 class GameComment(Base):
     __tablename__ = "game_comments"
+    __table_args__ = (Index("ix_game_comments_game_created", "game_id", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     game_id = Column(Integer, index=True, nullable=False)
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fastapi import HTTPException
+from passlib.hash import pbkdf2_sha256
+
+# Hashes with a different round count are upgraded on the next login.
+PASSWORD_ROUNDS = int(os.getenv("PASSWORD_ROUNDS", str(pbkdf2_sha256.default_rounds)))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Hash jobs allowed running or queued before new ones are turned away.
+HASH_QUEUE_MAX = int(os.getenv("HASH_QUEUE_MAX", str(HASH_WORKERS * 8)))
+HASH_TIMEOUT = float(os.getenv("HASH_TIMEOUT", "10"))
+
+
+# These run in the worker processes.
+
+
+def _hash(password: str, rounds: int) -> str:
+    return pbkdf2_sha256.using(rounds=rounds).hash(password)
+
+
+def _verify(password: str, stored: str, rounds: int) -> tuple[bool, str | None]:
+    """Check password; on success also return a new hash if stored uses other settings."""
+    hasher = pbkdf2_sha256.using(rounds=rounds)
+    if not hasher.verify(password, stored):
+        return False, None
+    if hasher.needs_update(stored):
+        return True, hasher.hash(password)
+    return True, None
+
+
+class PasswordPool:
+    """Runs pbkdf2 in worker processes so it holds neither the GIL nor the event loop."""
+
+    def __init__(self, workers: int, max_pending: int) -> None:
+        self.workers = workers
+        self.max_pending = max_pending
+        self.rejected = 0
+        self.restarts = 0
+        self._pending = 0
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._lock:
+            if self._executor is None:
+                # spawn rather than fork: the API process has threads (the DB
+                # writer among them) whose locks a forked child would inherit.
+                self._executor = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+
+    def stop(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    def _discard(self, executor: ProcessPoolExecutor) -> None:
+        """Drop a pool whose worker died; the next job starts a fresh one."""
+        with self._lock:
+            if self._executor is not executor:
+                return
+            self._executor = None
+            self.restarts += 1
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    async def _run(self, fn, *args):
+        self.start()
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.rejected += 1
+                raise HTTPException(status_code=503, detail="Server busy, try again", headers={"Retry-After": "1"})
+            executor = self._executor
+            try:
+                future: Future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                future = None
+            else:
+                self._pending += 1
+        if future is None:
+            self._discard(executor)
+            raise HTTPException(status_code=503, detail="Server busy, try again", headers={"Retry-After": "1"})
+        future.add_done_callback(self._done)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), HASH_TIMEOUT)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=503, detail="Server busy, try again", headers={"Retry-After": "1"})
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise HTTPException(status_code=503, detail="Server busy, try again", headers={"Retry-After": "1"})
+
+    def _done(self, _future: Future) -> None:
+        with self._lock:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(_hash, password, PASSWORD_ROUNDS)
+
+    async def verify(self, password: str, stored: str) -> tuple[bool, str | None]:
+        return await self._run(_verify, password, stored, PASSWORD_ROUNDS)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            return {"workers": self.workers, "pending": self._pending, "rejected": self.rejected, "restarts": self.restarts}
+
+
+password_pool = PasswordPool(HASH_WORKERS, HASH_QUEUE_MAX)
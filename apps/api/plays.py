@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import os
+import threading
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import writer
+
+# Plays are added to games.play_count in one batch every PLAY_FLUSH_INTERVAL
+# seconds, or sooner once PLAY_FLUSH_MAX_PENDING are waiting.
+PLAY_FLUSH_INTERVAL = float(os.getenv("PLAY_FLUSH_INTERVAL", "2.0"))
+PLAY_FLUSH_MAX_PENDING = int(os.getenv("PLAY_FLUSH_MAX_PENDING", "1000"))
+
+
+class PlayBuffer:
+    """Collects play counts in memory and writes them as one batch per flush."""
+
+    def __init__(self, interval: float, max_pending: int) -> None:
+        self.interval = interval
+        self.max_pending = max_pending
+        self._counts: dict[int, int] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+
+    def add(self, game_id: int) -> int:
+        with self._lock:
+            self._counts[game_id] = self._counts.get(game_id, 0) + 1
+            self._pending += 1
+            buffered = self._counts[game_id]
+            if self._pending >= self.max_pending:
+                self._wake.set()
+        return buffered
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="play-buffer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        # Final flush waits for the write so no plays are lost on shutdown.
+        rows = self._take()
+        if rows:
+            writer.run(lambda db: self._write(db, rows))
+
+    def flush(self) -> None:
+        rows = self._take()
+        if not rows:
+            return
+        future = writer.submit(lambda db: self._write(db, rows))
+        future.add_done_callback(lambda f: f.exception() and self._restore(rows))
+
+    def _take(self) -> list[dict[str, int]]:
+        with self._lock:
+            counts, self._counts, self._pending = self._counts, {}, 0
+        return [{"id": game_id, "n": n} for game_id, n in counts.items()]
+
+    @staticmethod
+    def _write(db: Session, rows: list[dict[str, int]]) -> None:
+        db.execute(text("UPDATE games SET play_count = COALESCE(play_count, 0) + :n WHERE id = :id"), rows)
+
+    def _restore(self, rows: list[dict[str, int]]) -> None:
+        with self._lock:
+            for row in rows:
+                self._counts[row["id"]] = self._counts.get(row["id"], 0) + row["n"]
+                self._pending += row["n"]
+
+    def _loop(self) -> None:
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping:
+                return
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+
+play_buffer = PlayBuffer(PLAY_FLUSH_INTERVAL, PLAY_FLUSH_MAX_PENDING)
@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import struct
+import uuid
+from typing import Callable
+
+# Rooms span API workers by publishing relayed messages and membership on a
+# channel per room. "local" keeps everything in this process; unix:/path or
+# tcp://host:port connects to the broker (python -m apps.api.broker).
+PUBSUB_URL = os.getenv("PUBSUB_URL", "local")
+# Unsent bytes allowed to pile up for one connection before publishes to it
+# are dropped instead.
+PUBSUB_BUFFER_MAX = int(os.getenv("PUBSUB_BUFFER_MAX", str(4 * 1024 * 1024)))
+PUBSUB_RECONNECT = float(os.getenv("PUBSUB_RECONNECT", "1.0"))
+
+# Wire format, shared with the broker: 4-byte big-endian body length, then
+# op (1 byte), channel length (2 bytes), channel, payload.
+OP_HELLO = b"H"  # channel is the sender's worker id
+OP_SUBSCRIBE = b"S"
+OP_UNSUBSCRIBE = b"U"
+OP_PUBLISH = b"P"
+OP_PEER_LOST = b"L"  # broker -> subscribers; payload is the lost worker id
+MAX_FRAME = 16 * 1024 * 1024
+
+_HEADER = struct.Struct("!IcH")
+_CHANNEL_LEN = struct.Struct("!H")
+
+logger = logging.getLogger(__name__)
+
+OnMessage = Callable[[str, bytes], None]
+OnPeerLost = Callable[[str, str], None]
+OnConnect = Callable[[], None]
+
+
+def encode_frame(op: bytes, channel: str, payload: bytes = b"") -> bytes:
+    name = channel.encode()
+    return _HEADER.pack(_HEADER.size - 4 + len(name) + len(payload), op, len(name)) + name + payload
+
+
+async def read_frame(reader: asyncio.StreamReader) -> tuple[bytes, str, bytes]:
+    (size,) = struct.unpack("!I", await reader.readexactly(4))
+    if size > MAX_FRAME:
+        raise ValueError(f"pub/sub frame of {size} bytes")
+    body = await reader.readexactly(size)
+    (length,) = _CHANNEL_LEN.unpack_from(body, 1)
+    return body[:1], body[3 : 3 + length].decode(), body[3 + length :]
+
+
+def parse_url(url: str) -> tuple[str, str, int | None]:
+    """("unix", path, None) or ("tcp", host, port)."""
+    if url.startswith("unix:"):
+        return "unix", url[len("unix:") :], None
+    if url.startswith("tcp://"):
+        host, _, port = url[len("tcp://") :].rpartition(":")
+        return "tcp", host or "127.0.0.1", int(port)
+    raise ValueError(f"Unsupported pub/sub URL: {url!r}")
+
+
+def can_write(writer: asyncio.StreamWriter, buffer_max: int) -> bool:
+    return not writer.is_closing() and writer.transport.get_write_buffer_size() <= buffer_max
+
+
+class PubSub:
+    """In-process backend: every member of a room is in this process, so
+    there is nobody to publish to. Also the interface BrokerPubSub fills in.
+    """
+
+    # False lets callers skip encoding messages nobody will receive.
+    distributed = False
+
+    def __init__(self) -> None:
+        self.worker_id = uuid.uuid4().hex[:12]
+
+    async def start(self, on_message: OnMessage, on_peer_lost: OnPeerLost, on_connect: OnConnect) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+    def subscribe(self, channel: str) -> None:
+        pass
+
+    def unsubscribe(self, channel: str) -> None:
+        pass
+
+    def publish(self, channel: str, payload: bytes) -> None:
+        pass
+
+    def stats(self) -> dict[str, object]:
+        return {"backend": "local"}
+
+
+class BrokerPubSub(PubSub):
+    """Client for the broker in broker.py, over a Unix socket or TCP.
+
+    publish never waits: frames go into the transport buffer, and are dropped
+    and counted while the broker is unreachable or that buffer is over
+    buffer_max. Subscriptions are replayed on every reconnect.
+    """
+
+    distributed = True
+
+    def __init__(self, url: str, buffer_max: int) -> None:
+        super().__init__()
+        self.url = url
+        self.buffer_max = buffer_max
+        self.channels: set[str] = set()
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.reconnects = 0
+        self.handler_errors = 0
+        self._writer: asyncio.StreamWriter | None = None
+        self._task: asyncio.Task | None = None
+        parse_url(url)
+
+    async def start(self, on_message: OnMessage, on_peer_lost: OnPeerLost, on_connect: OnConnect) -> None:
+        self._on_message = on_message
+        self._on_peer_lost = on_peer_lost
+        self._on_connect = on_connect
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+
+    def subscribe(self, channel: str) -> None:
+        if channel not in self.channels:
+            self.channels.add(channel)
+            self._send(encode_frame(OP_SUBSCRIBE, channel))
+
+    def unsubscribe(self, channel: str) -> None:
+        if channel in self.channels:
+            self.channels.discard(channel)
+            self._send(encode_frame(OP_UNSUBSCRIBE, channel))
+
+    def publish(self, channel: str, payload: bytes) -> None:
+        if self._send(encode_frame(OP_PUBLISH, channel, payload)):
+            self.published += 1
+        else:
+            self.dropped += 1
+
+    def stats(self) -> dict[str, object]:
+        return {
+            "backend": self.url,
+            "worker_id": self.worker_id,
+            "connected": self._writer is not None,
+            "channels": len(self.channels),
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+            "reconnects": self.reconnects,
+            "handler_errors": self.handler_errors,
+        }
+
+    def _send(self, frame: bytes) -> bool:
+        writer = self._writer
+        if writer is None or not can_write(writer, self.buffer_max):
+            return False
+        writer.write(frame)
+        return True
+
+    async def _connect(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        kind, host, port = parse_url(self.url)
+        if kind == "unix":
+            return await asyncio.open_unix_connection(host)
+        return await asyncio.open_connection(host, port)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                reader, writer = await self._connect()
+            except OSError:
+                await asyncio.sleep(PUBSUB_RECONNECT)
+                continue
+            writer.write(encode_frame(OP_HELLO, self.worker_id))
+            for channel in self.channels:
+                writer.write(encode_frame(OP_SUBSCRIBE, channel))
+            self._writer = writer
+            try:
+                self._on_connect()
+                while True:
+                    op, channel, payload = await read_frame(reader)
+                    self.received += 1
+                    # A message the handlers choke on is skipped; it must not
+                    # end the loop and cut this worker off from its rooms.
+                    try:
+                        if op == OP_PUBLISH:
+                            self._on_message(channel, payload)
+                        elif op == OP_PEER_LOST:
+                            self._on_peer_lost(channel, payload.decode())
+                    except Exception:
+                        self.handler_errors += 1
+                        logger.exception("pubsub: failed to handle op %r on %r", op, channel)
+            except (asyncio.IncompleteReadError, OSError, ValueError):
+                pass
+            finally:
+                self._writer = None
+                writer.close()
+            self.reconnects += 1
+            await asyncio.sleep(PUBSUB_RECONNECT)
+
+
+def create_pubsub(url: str) -> PubSub:
+    if url in ("", "local"):
+        return PubSub()
+    return BrokerPubSub(url, PUBSUB_BUFFER_MAX)
+
+
+pubsub = create_pubsub(PUBSUB_URL)
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from typing import Iterator
+from urllib.parse import quote
+
+# Session recording: with ROOM_RECORD_DIR set, every frame players send to a
+# room is appended to <dir>/<room>.gfrec, along with joins and leaves. Files
+# start with RECORD_MAGIC, followed by entries of
+#   !I   length of the rest of the entry
+#   !d   wall-clock time, seconds
+#   !B   kind (RECORD_TEXT, RECORD_BINARY, RECORD_JOIN, RECORD_LEAVE)
+#   !B   length of the sender's player id
+#   the sender id, then the frame as received (UTF-8 for text)
+ROOM_RECORD_DIR = os.getenv("ROOM_RECORD_DIR", "")
+ROOM_RECORD_INTERVAL = float(os.getenv("ROOM_RECORD_INTERVAL", "1.0"))
+# Flush early once this much is buffered; past ROOM_RECORD_MAX_PENDING,
+# entries are dropped (and counted) rather than held in memory.
+ROOM_RECORD_FLUSH_BYTES = int(os.getenv("ROOM_RECORD_FLUSH_BYTES", str(1024 * 1024)))
+ROOM_RECORD_MAX_PENDING = int(os.getenv("ROOM_RECORD_MAX_PENDING", str(64 * 1024 * 1024)))
+# Retention. A room's log past ROOM_RECORD_MAX_FILE_BYTES is rotated to
+# <room>.gfrec.1, replacing the previous one. Every ROOM_RECORD_PRUNE_INTERVAL
+# seconds, logs untouched for ROOM_RECORD_MAX_AGE seconds are deleted, then
+# the oldest ones until the directory is under ROOM_RECORD_MAX_TOTAL_BYTES.
+ROOM_RECORD_MAX_FILE_BYTES = int(os.getenv("ROOM_RECORD_MAX_FILE_BYTES", str(64 * 1024 * 1024)))
+ROOM_RECORD_MAX_TOTAL_BYTES = int(os.getenv("ROOM_RECORD_MAX_TOTAL_BYTES", str(1024 * 1024 * 1024)))
+ROOM_RECORD_MAX_AGE = float(os.getenv("ROOM_RECORD_MAX_AGE", str(7 * 24 * 3600)))
+ROOM_RECORD_PRUNE_INTERVAL = float(os.getenv("ROOM_RECORD_PRUNE_INTERVAL", "60"))
+# Usernames allowed to download recordings; nobody when empty.
+ROOM_RECORD_ADMINS = {name.strip() for name in os.getenv("ROOM_RECORD_ADMINS", "").split(",") if name.strip()}
+
+RECORD_MAGIC = b"GFREC1\n"
+RECORD_SUFFIX = ".gfrec"
+ROTATED_SUFFIX = ".1"
+RECORD_TEXT = 0
+RECORD_BINARY = 1
+RECORD_JOIN = 2
+RECORD_LEAVE = 3
+RECORD_KINDS = {RECORD_TEXT: "text", RECORD_BINARY: "binary", RECORD_JOIN: "join", RECORD_LEAVE: "leave"}
+
+_ENTRY = struct.Struct("!IdBB")
+_LENGTH = struct.Struct("!I")
+
+
+def record_path(directory: str, room: str) -> str:
+    name = quote(room, safe="")
+    if len(name) > 200:
+        name = hashlib.blake2b(room.encode(), digest_size=16).hexdigest()
+    return os.path.join(directory, name + RECORD_SUFFIX)
+
+
+def read_entries(path: str) -> Iterator[tuple[float, int, str, bytes]]:
+    """(time, kind, sender, data) for each entry, read through mmap.
+
+    Only what was on disk when the file was opened is read, and a torn
+    entry at the end (from a crash mid-append) is ignored.
+    """
+    with open(path, "rb") as fh:
+        size = os.fstat(fh.fileno()).st_size
+        if size <= len(RECORD_MAGIC):
+            return
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            if view[: len(RECORD_MAGIC)] != RECORD_MAGIC:
+                return
+            offset = len(RECORD_MAGIC)
+            while offset + _ENTRY.size <= size:
+                length, stamp, kind, sender_len = _ENTRY.unpack_from(view, offset)
+                end = offset + _LENGTH.size + length
+                if end > size:
+                    return
+                start = offset + _ENTRY.size
+                sender = view[start : start + sender_len].decode(errors="replace")
+                yield stamp, kind, sender, view[start + sender_len : end]
+                offset = end
+
+
+class Recorder:
+    """Write-behind recorder for room traffic.
+
+    record() only packs the entry onto the room's in-memory buffer; a
+    background thread appends the buffers to their files every `interval`
+    seconds, or sooner once `flush_bytes` are waiting.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        interval: float,
+        flush_bytes: int,
+        max_pending: int,
+        max_file_bytes: int = ROOM_RECORD_MAX_FILE_BYTES,
+        max_total_bytes: int = ROOM_RECORD_MAX_TOTAL_BYTES,
+        max_age: float = ROOM_RECORD_MAX_AGE,
+    ) -> None:
+        self.directory = directory
+        self.interval = interval
+        self.flush_bytes = flush_bytes
+        self.max_pending = max_pending
+        self.max_file_bytes = max_file_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_age = max_age
+        self.recorded = 0
+        self.dropped = 0
+        self.written = 0
+        self.errors = 0
+        self.rotated = 0
+        self.pruned = 0
+        self._pruned_at = 0.0
+        self._buffers: dict[str, bytearray] = {}
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    def record(self, room: str, kind: int, sender: str, data: str | bytes = b"") -> None:
+        if not self.directory:
+            return
+        if isinstance(data, str):
+            data = data.encode()
+        sender_bytes = sender.encode()[:255]
+        entry = _ENTRY.pack(_ENTRY.size - _LENGTH.size + len(sender_bytes) + len(data), time.time(), kind, len(sender_bytes))
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return
+            buffer = self._buffers.get(room)
+            if buffer is None:
+                buffer = self._buffers[room] = bytearray()
+            buffer += entry
+            buffer += sender_bytes
+            buffer += data
+            self._pending += len(entry) + len(sender_bytes) + len(data)
+            self.recorded += 1
+            if self._pending >= self.flush_bytes:
+                self._wake.set()
+
+    def paths(self, room: str) -> list[str]:
+        """The room's recording files, oldest first; empty if it has none."""
+        if not self.directory:
+            return []
+        path = record_path(self.directory, room)
+        return [p for p in (path + ROTATED_SUFFIX, path) if os.path.exists(p)]
+
+    def start(self) -> None:
+        if not self.directory or (self._thread and self._thread.is_alive()):
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="room-recorder", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        if self.directory:
+            self.flush()
+
+    def flush(self) -> None:
+        with self._lock:
+            buffers, self._buffers, self._pending = self._buffers, {}, 0
+        for room, buffer in buffers.items():
+            path = record_path(self.directory, room)
+            try:
+                if os.path.exists(path) and os.path.getsize(path) + len(buffer) > self.max_file_bytes:
+                    os.replace(path, path + ROTATED_SUFFIX)
+                    self.rotated += 1
+                with open(path, "ab") as fh:
+                    if fh.tell() == 0:
+                        fh.write(RECORD_MAGIC)
+                    fh.write(buffer)
+                self.written += len(buffer)
+            except OSError:
+                self.errors += 1
+
+    def prune(self, now: float) -> int:
+        """Delete expired logs, then the oldest until under max_total_bytes."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and (entry.name.endswith(RECORD_SUFFIX) or entry.name.endswith(RECORD_SUFFIX + ROTATED_SUFFIX)):
+                info = entry.stat()
+                files.append((info.st_mtime, info.st_size, entry.path))
+        files.sort()
+        total = sum(size for _, size, _ in files)
+        removed = 0
+        for mtime, size, path in files:
+            if now - mtime <= self.max_age and total <= self.max_total_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                self.errors += 1
+                continue
+            total -= size
+            removed += 1
+        self.pruned += removed
+        return removed
+
+    def stats(self) -> dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "recorded": self.recorded,
+            "dropped": self.dropped,
+            "written_bytes": self.written,
+            "pending_bytes": self._pending,
+            "errors": self.errors,
+            "rotated": self.rotated,
+            "pruned": self.pruned,
+        }
+
+    def _loop(self) -> None:
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping:
+                return
+            try:
+                self.flush()
+                now = time.time()
+                if now - self._pruned_at >= ROOM_RECORD_PRUNE_INTERVAL:
+                    self._pruned_at = now
+                    self.prune(now)
+            except Exception:
+                pass
+
+
+recorder = Recorder(ROOM_RECORD_DIR, ROOM_RECORD_INTERVAL, ROOM_RECORD_FLUSH_BYTES, ROOM_RECORD_MAX_PENDING)
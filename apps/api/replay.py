@@ -0,0 +1,85 @@
+from __future__ import annotations
+
+import asyncio
+import os
+import uuid
+from collections import deque
+from typing import Any
+
+# Relayed messages kept per room for clients that reconnect with ?since=.
+REPLAY_BUFFER = int(os.getenv("WS_REPLAY_BUFFER", "256"))
+# How long an empty room's buffer outlives its last player.
+REPLAY_TTL = float(os.getenv("WS_REPLAY_TTL", "60"))
+# Field carrying a message's sequence number to clients that opted in.
+SEQ_FIELD = "_seq"
+
+_PACKED_SEQ_KEY = bytes([0xA0 | len(SEQ_FIELD)]) + SEQ_FIELD.encode()
+
+
+class ReplayBuffer:
+    """Ring of one room's recent relayed messages, numbered from 1.
+
+    The epoch changes whenever a buffer is created, so a since= from before
+    a restart, an expiry or another worker is recognised rather than
+    replayed against the wrong numbering.
+    """
+
+    def __init__(self, size: int) -> None:
+        self.epoch = uuid.uuid4().hex[:8]
+        self.seq = 0
+        self.items: deque[Any] = deque(maxlen=size)
+        self.expiry: asyncio.TimerHandle | None = None
+
+    def append(self, message: Any) -> int:
+        self.seq += 1
+        self.items.append(message)
+        return self.seq
+
+    def since(self, epoch: str | None, seq: int) -> list[Any] | None:
+        """Messages after seq, or None if they are no longer all here."""
+        if epoch != self.epoch or seq < 0 or seq > self.seq:
+            return None
+        missed = self.seq - seq
+        if missed > len(self.items):
+            return None
+        return list(self.items)[len(self.items) - missed :] if missed else []
+
+
+def stamp_text(text: str, seq: int) -> str:
+    """Add the sequence field to a JSON object without parsing it."""
+    body = text.lstrip()
+    if not body.startswith("{"):
+        return text
+    separator = "" if body[1:].lstrip().startswith("}") else ","
+    return f'{{"{SEQ_FIELD}":{seq}{separator}' + body[1:]
+
+
+def _pack_uint(value: int) -> bytes:
+    if value < 0x80:
+        return bytes([value])
+    if value < 0x10000:
+        return b"\xcd" + value.to_bytes(2, "big")
+    if value < 0x100000000:
+        return b"\xce" + value.to_bytes(4, "big")
+    return b"\xcf" + value.to_bytes(8, "big")
+
+
+def stamp_packed(packed: bytes, seq: int) -> bytes:
+    """stamp_text for a MessagePack map: bump the entry count and prepend the field."""
+    if not packed:
+        return packed
+    field = _PACKED_SEQ_KEY + _pack_uint(seq)
+    head = packed[0]
+    if 0x80 <= head < 0x8F:
+        return bytes([head + 1]) + field + packed[1:]
+    if head == 0x8F:
+        return b"\xde" + (16).to_bytes(2, "big") + field + packed[1:]
+    if head == 0xDE:
+        count = int.from_bytes(packed[1:3], "big") + 1
+        if count <= 0xFFFF:
+            return b"\xde" + count.to_bytes(2, "big") + field + packed[3:]
+        return b"\xdf" + count.to_bytes(4, "big") + field + packed[3:]
+    if head == 0xDF:
+        count = int.from_bytes(packed[1:5], "big") + 1
+        return b"\xdf" + count.to_bytes(4, "big") + field + packed[5:]
+    return packed
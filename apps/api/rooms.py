@@ -0,0 +1,1033 @@
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Callable
+
+from fastapi import WebSocket
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal, writer
+from .interest import INTEREST_TYPES, Cell, InterestIndex, area, parse_area, route_packed, route_text
+from .limits import WS_MAX_MESSAGE, RoomLimits, Throttle, new_counters
+from .models import Room
+from .pubsub import PubSub, pubsub
+from .replay import REPLAY_BUFFER, REPLAY_TTL, ReplayBuffer, stamp_packed, stamp_text
+from .spectators import SPECTATOR_INTERVAL, SPECTATOR_ROLE, SpectatorFeed
+from .ticks import TICK_TYPES, TickRoom, parse_rate
+
+try:
+    import msgpack
+except ImportError:  # without it every client is offered JSON text only
+    msgpack = None
+
+SEND_QUEUE_MAX = int(os.getenv("WS_SEND_QUEUE_MAX", "256"))
+# drop-oldest, coalesce or disconnect; see Connection.
+SLOW_CONSUMER_POLICY = os.getenv("WS_SLOW_CONSUMER_POLICY", "drop-oldest")
+# Heartbeat: sockets quiet for WS_PING_INTERVAL seconds get a ping, and
+# sockets that have sent nothing at all, pongs included, for WS_IDLE_TIMEOUT
+# are closed and removed from their room. WS_REAP_INTERVAL is how often
+# that is checked.
+WS_PING_INTERVAL = float(os.getenv("WS_PING_INTERVAL", "20"))
+WS_IDLE_TIMEOUT = float(os.getenv("WS_IDLE_TIMEOUT", "60"))
+WS_REAP_INTERVAL = float(os.getenv("WS_REAP_INTERVAL", "5"))
+# Sockets this process holds before new players are told to retry (1013).
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "10000"))
+# Inbound message types the server acts on; everything else is relayed as is.
+# Types the server added to the protocol start with "_" so they never
+# collide with a game's own messages.
+CONTROL_TYPES = ("set_name", "ready", "_pong") + INTEREST_TYPES
+# WebSocket subprotocols. Clients offer both and get MessagePack frames when
+# the server has msgpack installed; connections that offer neither are JSON.
+SUBPROTOCOL_MSGPACK = "gf.msgpack"
+SUBPROTOCOL_JSON = "gf.json"
+# Authoritative (tick) rooms also act on their clients' inputs and acks.
+TICK_CONTROL_TYPES = CONTROL_TYPES + TICK_TYPES
+# First byte of each payload on a room's pub/sub channel.
+REMOTE_TEXT = b"t"
+REMOTE_PACKED = b"p"
+REMOTE_RAW = b"r"
+REMOTE_PRESENCE = b"s"  # a worker's local players in the room
+REMOTE_SYNC = b"q"  # asks every worker in the room for its presence
+
+
+def negotiate_subprotocol(websocket: WebSocket) -> str | None:
+    offered = websocket.scope.get("subprotocols") or []
+    if msgpack is not None and SUBPROTOCOL_MSGPACK in offered:
+        return SUBPROTOCOL_MSGPACK
+    # A browser fails the handshake if it offered protocols and none is
+    # selected.
+    if SUBPROTOCOL_JSON in offered:
+        return SUBPROTOCOL_JSON
+    return None
+
+
+def _packed_str(kind: str) -> bytes:
+    # msgpack fixstr encoding, for the same cheap pre-check parse_control
+    # does on text.
+    return bytes([0xA0 | len(kind)]) + kind.encode()
+
+
+def parse_control(data: str, kinds: tuple[str, ...] = CONTROL_TYPES) -> dict[str, Any] | None:
+    """The frame as a dict if it is a control message, else None.
+
+    Frames that don't even mention a control type are never parsed, so
+    game traffic is relayed without a JSON round trip.
+    """
+    if not any(f'"{kind}"' in data for kind in kinds):
+        return None
+    try:
+        payload = json.loads(data)
+    except json.JSONDecodeError:
+        return None
+    if isinstance(payload, dict) and payload.get("type") in kinds:
+        return payload
+    return None
+
+
+def is_json_object(data: str) -> bool:
+    """Whether a text frame looks like a JSON object, the only kind relayed as is.
+
+    Only the braces are checked, so relaying costs no parse; a malformed
+    body is the sender's to fix, and peers that need it parsed (MessagePack
+    clients, spectators) fall back on their own.
+    """
+    body = data.strip()
+    return body.startswith("{") and body.endswith("}")
+
+
+def parse_packed_control(data: bytes, kinds: tuple[str, ...] = CONTROL_TYPES) -> dict[str, Any] | None:
+    """parse_control for a MessagePack frame."""
+    if not any(_packed_str(kind) in data for kind in kinds):
+        return None
+    try:
+        payload = msgpack.unpackb(data)
+    except Exception:
+        return None
+    if isinstance(payload, dict) and payload.get("type") in kinds:
+        return payload
+    return None
+
+
+class Outbound:
+    """One broadcast message, encoded at most once per wire format.
+
+    A message arrives as JSON text, as MessagePack, or as opaque bytes from
+    a JSON client. Each is sent untouched to clients on the same format and
+    converted once, on first need, for the rest. Relayed messages also get
+    a room sequence number, which the stamped forms carry for clients that
+    asked for replay.
+    """
+
+    __slots__ = ("text", "packed", "raw", "seq", "channel", "cell", "sender", "_stamped_text", "_stamped_packed")
+
+    def __init__(self, text: str | None = None, packed: bytes | None = None, raw: bytes | None = None) -> None:
+        self.text = text
+        self.packed = packed
+        self.raw = raw
+        self.seq: int | None = None
+        # Where the message is addressed inside its room; see interest.py.
+        self.channel: str | None = None
+        self.cell: Cell | None = None
+        # Id of the player who sent it, if any; spectators see the latest per sender.
+        self.sender: str | None = None
+        self._stamped_text: str | None = None
+        self._stamped_packed: bytes | None = None
+
+    def for_text(self, stamped: bool = False) -> str | bytes | None:
+        if stamped and self.seq is not None and self.raw is None:
+            # Opaque bytes have nowhere to put a number and go out as they are.
+            if self._stamped_text is None:
+                text = self.for_text()
+                if text is None:
+                    return None
+                self._stamped_text = stamp_text(text, self.seq)
+            return self._stamped_text
+        if self.raw is not None:
+            return self.raw
+        if self.text is None:
+            try:
+                self.text = json.dumps(msgpack.unpackb(self.packed))
+            except (TypeError, ValueError):
+                # Binary payloads have no JSON form; text clients skip them.
+                return None
+        return self.text
+
+    def route(self) -> None:
+        if self.raw is not None:
+            return
+        if self.text is not None:
+            self.channel, self.cell = route_text(self.text)
+        else:
+            self.channel, self.cell = route_packed(self.packed)
+
+    def for_packed(self, stamped: bool = False) -> bytes:
+        if stamped and self.seq is not None:
+            if self._stamped_packed is None:
+                self._stamped_packed = stamp_packed(self.for_packed(), self.seq)
+            return self._stamped_packed
+        if self.packed is None:
+            if self.raw is not None:
+                payload: Any = {"type": "message", "data": self.raw}
+            else:
+                try:
+                    payload = json.loads(self.text)
+                except json.JSONDecodeError:
+                    payload = {"type": "message", "data": self.text}
+            self.packed = msgpack.packb(payload)
+        return self.packed
+
+
+@dataclass
+class RoomInfo:
+    count: int = 0
+    max_players: int | None = None
+    last_active: float = field(default_factory=time.monotonic)
+
+
+class RoomRegistry:
+    """This process's rooms in memory, persisted to `rooms` write-behind.
+
+    Joins and leaves only touch the dict; a background thread writes the
+    rooms that changed since the last flush in one batch, and evicts rooms
+    that have been empty for `idle_ttl` seconds from memory and the table.
+    The table is what spans processes: the lobby reads it, and a process
+    whose players have all left a room that lives on elsewhere releases
+    the row to the others instead of zeroing it.
+    """
+
+    def __init__(self, interval: float, idle_ttl: float) -> None:
+        self.interval = interval
+        self.idle_ttl = idle_ttl
+        self._rooms: dict[str, RoomInfo] = {}
+        self._dirty: set[str] = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopping = False
+        self._thread: threading.Thread | None = None
+        # Persisted caps of rooms not in _rooms, when counts weren't reset.
+        self._max_players: dict[str, int] = {}
+
+    def load(self, reset_counts: bool = True) -> None:
+        # Connections don't survive a restart, so only max_players carries
+        # over; marking every room dirty zeroes the persisted counts. With
+        # several processes the others' rooms are still live, so the counts
+        # are left to them and only max_players is read.
+        db = SessionLocal()
+        try:
+            rooms = {r.id: RoomInfo(max_players=r.max_players) for r in db.query(Room.id, Room.max_players)}
+        finally:
+            db.close()
+        with self._lock:
+            if reset_counts:
+                self._rooms = rooms
+                self._dirty = set(rooms)
+            else:
+                self._max_players = {room_id: info.max_players for room_id, info in rooms.items() if info.max_players}
+
+    def claim_max(self, room_id: str, incoming: int | None) -> int | None:
+        """The room's player cap; the first joiner to name one sets it."""
+        with self._lock:
+            info = self._rooms.get(room_id)
+            if info is None:
+                info = self._rooms[room_id] = RoomInfo(max_players=self._max_players.pop(room_id, None))
+            if incoming and not info.max_players:
+                info.max_players = incoming
+                self._dirty.add(room_id)
+            return info.max_players if info.max_players else incoming
+
+    def peek_max(self, room_id: str, incoming: int | None) -> int | None:
+        """What claim_max would return, without recording anything."""
+        with self._lock:
+            info = self._rooms.get(room_id)
+            current = info.max_players if info is not None else self._max_players.get(room_id)
+            return current if current else incoming
+
+    def set_count(self, room_id: str, count: int) -> None:
+        with self._lock:
+            info = self._rooms.setdefault(room_id, RoomInfo())
+            info.count = count
+            info.last_active = time.monotonic()
+            self._dirty.add(room_id)
+
+    def release(self, room_id: str) -> None:
+        """Forget a room whose row other processes now keep up to date."""
+        with self._lock:
+            info = self._rooms.pop(room_id, None)
+            self._dirty.discard(room_id)
+            if info is not None and info.max_players:
+                self._max_players[room_id] = info.max_players
+
+    def snapshot(self) -> list[dict[str, Any]]:
+        with self._lock:
+            rooms = [
+                {"room_id": room_id, "count": info.count, "max_players": info.max_players}
+                for room_id, info in self._rooms.items()
+            ]
+        rooms.sort(key=lambda r: r["count"], reverse=True)
+        return rooms
+
+    def start(self, reset_counts: bool = True) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self.load(reset_counts)
+        self._stopping = False
+        self._thread = threading.Thread(target=self._loop, name="room-registry", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._wake.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+        upserts, deletes = self._take()
+        if upserts or deletes:
+            writer.run(lambda db: self._write(db, upserts, deletes))
+
+    def flush(self) -> None:
+        upserts, deletes = self._take()
+        if not upserts and not deletes:
+            return
+        future = writer.submit(lambda db: self._write(db, upserts, deletes))
+        future.add_done_callback(lambda f: f.exception() and self._restore(upserts))
+
+    def _take(self) -> tuple[list[dict[str, Any]], list[dict[str, str]]]:
+        cutoff = time.monotonic() - self.idle_ttl
+        with self._lock:
+            stale = [room_id for room_id, info in self._rooms.items() if info.count == 0 and info.last_active < cutoff]
+            for room_id in stale:
+                del self._rooms[room_id]
+                self._dirty.discard(room_id)
+            upserts = [
+                {"id": room_id, "count": self._rooms[room_id].count, "max_players": self._rooms[room_id].max_players}
+                for room_id in self._dirty
+            ]
+            self._dirty = set()
+        return upserts, [{"id": room_id} for room_id in stale]
+
+    @staticmethod
+    def _write(db: Session, upserts: list[dict[str, Any]], deletes: list[dict[str, str]]) -> None:
+        if upserts:
+            db.execute(
+                text(
+                    "INSERT INTO rooms (id, count, max_players, updated_at) "
+                    "VALUES (:id, :count, :max_players, CURRENT_TIMESTAMP) "
+                    "ON CONFLICT(id) DO UPDATE SET count = excluded.count, "
+                    "max_players = excluded.max_players, updated_at = excluded.updated_at"
+                ),
+                upserts,
+            )
+        if deletes:
+            # Another process may have filled the room since.
+            db.execute(text("DELETE FROM rooms WHERE id = :id AND count = 0"), deletes)
+
+    def _restore(self, upserts: list[dict[str, Any]]) -> None:
+        with self._lock:
+            self._dirty.update(row["id"] for row in upserts if row["id"] in self._rooms)
+
+    def _loop(self) -> None:
+        while not self._stopping:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stopping:
+                return
+            try:
+                self.flush()
+            except Exception:
+                pass
+
+
+room_registry = RoomRegistry(
+    interval=float(os.getenv("ROOM_FLUSH_INTERVAL", "5.0")),
+    idle_ttl=float(os.getenv("ROOM_IDLE_TTL", "600")),
+)
+
+
+class Connection:
+    """One socket's outbound queue, drained by its own task.
+
+    Broadcasting only appends here, so a slow client delays nobody but
+    itself. When the queue is full the policy decides what gives:
+      drop-oldest - discard the oldest queued message
+      coalesce    - discard every queued game message, keeping control
+                    messages, so the client skips ahead to the newest
+      disconnect  - close the socket; the client can reconnect and resync
+    """
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        policy: str,
+        queue_max: int,
+        on_close: Callable[[], None],
+        packed: bool = False,
+        replay: bool = False,
+    ) -> None:
+        self.websocket = websocket
+        self.packed = packed
+        # Gets sequence-stamped messages so it can resume with ?since=.
+        self.replay = replay
+        self.policy = policy
+        self.queue_max = queue_max
+        self.queue: deque[tuple[str | bytes, bool]] = deque()
+        self.dropped = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+        self.closed = False
+        self.last_seen = time.monotonic()
+        self.pinged = 0.0
+        self._on_close = on_close
+        self._ready = asyncio.Event()
+        self._task = asyncio.create_task(self._pump())
+
+    def send(self, message: str | bytes, control: bool = False) -> None:
+        if self.closed:
+            return
+        if len(self.queue) >= self.queue_max:
+            if self.policy == "disconnect":
+                self.slow_disconnects += 1
+                self._on_close()
+                self.close(1013)
+                return
+            if self.policy == "coalesce":
+                kept = deque(item for item in self.queue if item[1])
+                self.coalesced += len(self.queue) - len(kept)
+                self.queue = kept
+            if len(self.queue) >= self.queue_max:
+                self.queue.popleft()
+                self.dropped += 1
+        self.queue.append((message, control))
+        self._ready.set()
+
+    def stop(self) -> None:
+        self.closed = True
+        self._task.cancel()
+
+    def close(self, code: int, reason: str = "") -> None:
+        self.stop()
+        asyncio.create_task(self._close(code, reason))
+
+    async def _close(self, code: int, reason: str) -> None:
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            pass
+
+    async def _pump(self) -> None:
+        try:
+            while True:
+                await self._ready.wait()
+                while self.queue:
+                    message, _ = self.queue.popleft()
+                    if isinstance(message, bytes):
+                        await self.websocket.send_bytes(message)
+                    else:
+                        await self.websocket.send_text(message)
+                self._ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self._on_close()
+
+
+class ConnectionManager:
+    """Sockets, players and rooms for this process.
+
+    With a distributed pub/sub backend a room can span workers: each
+    message relayed here is also published on the room's channel, and each
+    worker publishes its players whenever they change, so room_state and
+    capacity cover the whole room. room_state itself is rendered by every
+    worker for its own sockets and never crosses the channel.
+    """
+
+    def __init__(self, policy: str, queue_max: int, pubsub: PubSub) -> None:
+        self.policy = policy
+        self.queue_max = queue_max
+        self.pubsub = pubsub
+        self.rooms: dict[str, set[WebSocket]] = {}
+        self.players: dict[WebSocket, dict[str, str | bool]] = {}
+        self.clients: dict[str, dict[str, WebSocket]] = {}
+        self.connections: dict[WebSocket, Connection] = {}
+        self.ticks: dict[str, TickRoom] = {}
+        # Players connected through other workers: room -> worker id -> players.
+        self.remote: dict[str, dict[str, list[dict[str, Any]]]] = {}
+        self.replays: dict[str, ReplayBuffer] = {}
+        # Channel and area-of-interest subscriptions, per room.
+        self.interest: dict[str, InterestIndex] = {}
+        # Inbound limits, set by each room's first player.
+        self.limits: dict[str, RoomLimits] = {}
+        self.throttles: dict[WebSocket, Throttle] = {}
+        self.throttle_counters: dict[str, dict[str, int]] = {}
+        # Spectators, who are neither members nor players, by room and by socket.
+        self.feeds: dict[str, SpectatorFeed] = {}
+        self.spectating: dict[WebSocket, str] = {}
+        self.spectator_frames = 0
+        self._closed_throttle_counters = new_counters()
+        self.reaped = 0
+        self.rejected = 0
+        self._reaper: asyncio.Task | None = None
+        self._spectate_task: asyncio.Task | None = None
+        # Encoded room_state per room, dropped whenever membership or a
+        # player's name or ready flag changes.
+        self._room_state_cache: dict[str, Outbound] = {}
+        # Totals from connections that have since closed.
+        self._closed_stats = {"dropped": 0, "coalesced": 0, "slow_disconnects": 0}
+
+    async def start(self) -> None:
+        await self.pubsub.start(self._on_remote, self._on_peer_lost, self._on_pubsub_connect)
+        if self._reaper is None:
+            self._reaper = asyncio.create_task(self._reap_loop())
+        if self._spectate_task is None:
+            self._spectate_task = asyncio.create_task(self._spectate_loop())
+
+    async def stop(self) -> None:
+        for task in (self._reaper, self._spectate_task):
+            if task is not None:
+                task.cancel()
+        self._reaper = self._spectate_task = None
+        await self.pubsub.stop()
+
+    def touch(self, websocket: WebSocket) -> None:
+        conn = self.connections.get(websocket)
+        if conn is not None:
+            conn.last_seen = time.monotonic()
+
+    def reap(self, now: float) -> None:
+        """Close sockets idle past WS_IDLE_TIMEOUT; ping the quiet ones."""
+        ping: Outbound | None = None
+        for websocket, conn in list(self.connections.items()):
+            idle = now - conn.last_seen
+            if idle > WS_IDLE_TIMEOUT:
+                self.reaped += 1
+                meta = self.players.get(websocket)
+                if websocket in self.spectating:
+                    self.disconnect(self.spectating[websocket], websocket)
+                elif meta is not None:
+                    room = str(meta["room"])
+                    self.disconnect(room, websocket)
+                    self.broadcast_room_state(room)
+                else:
+                    self._drop_connection(websocket)
+                conn.close(1001)
+            elif idle > WS_PING_INTERVAL and now - conn.pinged > WS_PING_INTERVAL:
+                if ping is None:
+                    ping = Outbound(text=json.dumps({"type": "_ping", "t": int(time.time() * 1000)}))
+                conn.pinged = now
+                frame = ping.for_packed() if conn.packed else ping.for_text()
+                conn.send(frame, control=True)
+
+    async def _reap_loop(self) -> None:
+        while True:
+            await asyncio.sleep(WS_REAP_INTERVAL)
+            try:
+                self.reap(time.monotonic())
+            except Exception:
+                pass
+
+    def member_count(self, room: str) -> int:
+        return len(self.rooms.get(room, ())) + sum(len(players) for players in self.remote.get(room, {}).values())
+
+    async def connect(self, room: str, websocket: WebSocket) -> bool:
+        """Admit the socket to the room; False if it was turned away."""
+        subprotocol = negotiate_subprotocol(websocket)
+        await websocket.accept(subprotocol=subprotocol)
+        if websocket.query_params.get("role") == SPECTATOR_ROLE:
+            return await self._add_spectator(room, websocket, subprotocol)
+        client_id = (websocket.query_params.get("client_id") or "").strip()
+        raw_max = (websocket.query_params.get("max_players") or "").strip()
+        max_players: int | None = None
+        if raw_max:
+            try:
+                max_players = max(1, int(raw_max))
+            except ValueError:
+                max_players = None
+        if not client_id:
+            client_id = uuid.uuid4().hex[:12]
+        name = (websocket.query_params.get("name") or "Player").strip()[:24]
+        # Admission is decided before anything is recorded for the room, so
+        # turned-away joins leave nothing behind.
+        known = client_id in self.clients.get(room, ())
+        room_max = room_registry.peek_max(room, max_players)
+        if room_max is not None and not known and self.member_count(room) >= room_max:
+            try:
+                await websocket.close(code=1008)
+            except Exception:
+                pass
+            return False
+        # Players reconnecting replace a socket, so they are let in regardless.
+        if len(self.connections) >= WS_MAX_CONNECTIONS and not known:
+            self.rejected += 1
+            try:
+                await websocket.close(code=1013)
+            except Exception:
+                pass
+            return False
+        room_registry.claim_max(room, max_players)
+        self.clients.setdefault(room, {})
+        if known:
+            old = self.clients[room][client_id]
+            if old in self.rooms.get(room, set()):
+                self.rooms[room].discard(old)
+            self.players.pop(old, None)
+            self._drop_connection(old)
+            try:
+                await old.close()
+            except Exception:
+                pass
+        if not self.rooms.get(room):
+            self.limits[room] = RoomLimits.from_query(websocket.query_params)
+        # The first player into an empty room can make it authoritative.
+        tick_rate = parse_rate(websocket.query_params.get("tick_rate"))
+        if tick_rate and not self.rooms.get(room) and room not in self.ticks:
+            self.ticks[room] = TickRoom(
+                tick_rate,
+                lambda: list(self.rooms.get(room, ())),
+                lambda message, recipients: self.send_to(recipients, Outbound(text=message)),
+            )
+            self.limits[room] = self.limits[room].for_tick_rate(tick_rate)
+        self.clients[room][client_id] = websocket
+        self.connections[websocket] = Connection(
+            websocket,
+            self.policy,
+            self.queue_max,
+            lambda: self.disconnect(room, websocket),
+            packed=subprotocol == SUBPROTOCOL_MSGPACK,
+            replay=bool(websocket.query_params.get("replay") or websocket.query_params.get("since")),
+        )
+        if not self.rooms.get(room):
+            self.pubsub.subscribe(room)
+            self._publish(room, REMOTE_SYNC)
+        self.rooms.setdefault(room, set()).add(websocket)
+        self.throttles[websocket] = Throttle(
+            self.limits[room],
+            self.throttle_counters.setdefault(room, new_counters()),
+            lambda message: self.broadcast(room, message),
+        )
+        self.players[websocket] = {
+            "id": client_id,
+            "name": name or "Player",
+            "ready": False,
+            "room": room,
+        }
+        self._room_state_cache.pop(room, None)
+        self._publish_presence(room)
+        room_registry.set_count(room, self.member_count(room))
+        channels = websocket.query_params.get("channels")
+        if channels:
+            self.update_interest(room, websocket, {"type": "_subscribe", "channels": channels.split(",")})
+        cells = parse_area(websocket.query_params.get("aoi"))
+        if cells:
+            self.interest.setdefault(room, InterestIndex()).set_area(websocket, cells)
+        self._start_replay(room, websocket)
+        return True
+
+    async def _add_spectator(self, room: str, websocket: WebSocket, subprotocol: str | None) -> bool:
+        # Spectators don't take a seat, but they do hold a socket.
+        if len(self.connections) >= WS_MAX_CONNECTIONS:
+            self.rejected += 1
+            try:
+                await websocket.close(code=1013)
+            except Exception:
+                pass
+            return False
+        feed = self.feeds.get(room)
+        if feed is None:
+            feed = self.feeds[room] = SpectatorFeed()
+            if room not in self.rooms:
+                self.pubsub.subscribe(room)
+                self._publish(room, REMOTE_SYNC)
+        feed.spectators.add(websocket)
+        self.spectating[websocket] = room
+        self.connections[websocket] = Connection(
+            websocket,
+            self.policy,
+            self.queue_max,
+            lambda: self.disconnect(room, websocket),
+            packed=subprotocol == SUBPROTOCOL_MSGPACK,
+        )
+        # Latecomers start from the last frame instead of waiting for the next change.
+        if feed.last is not None:
+            self.send_to([websocket], feed.last)
+        return True
+
+    def _start_replay(self, room: str, websocket: WebSocket) -> None:
+        """Tell an opted-in socket where the room's numbering stands.
+
+        Whatever it missed since ?since= is queued right behind, ahead of
+        anything new.
+        """
+        buffer = self.replays.get(room)
+        if buffer is None:
+            buffer = self.replays[room] = ReplayBuffer(REPLAY_BUFFER)
+        elif buffer.expiry is not None:
+            buffer.expiry.cancel()
+            buffer.expiry = None
+        conn = self.connections[websocket]
+        if not conn.replay:
+            return
+        raw_since = websocket.query_params.get("since")
+        missed: list[Outbound] | None = []
+        if raw_since:
+            try:
+                missed = buffer.since(websocket.query_params.get("epoch"), int(raw_since))
+            except ValueError:
+                missed = None
+        info = {"type": "_replay", "epoch": buffer.epoch, "seq": buffer.seq, "complete": missed is not None, "count": len(missed or ())}
+        self.send_to([websocket], Outbound(text=json.dumps(info)), control=True)
+        index = self.interest.get(room)
+        for message in missed or ():
+            if index is None or index.wants(websocket, message.channel, message.cell):
+                self.send_to([websocket], message)
+
+    def _expire_replay(self, room: str) -> None:
+        if room not in self.rooms:
+            self.replays.pop(room, None)
+
+    def disconnect(self, room: str, websocket: WebSocket) -> None:
+        if websocket in self.spectating:
+            self._remove_spectator(room, websocket)
+            return
+        if room in self.rooms:
+            self.rooms[room].discard(websocket)
+            if not self.rooms[room]:
+                self.rooms.pop(room, None)
+        meta = self.players.pop(websocket, None)
+        throttle = self.throttles.pop(websocket, None)
+        if throttle is not None:
+            throttle.close()
+        index = self.interest.get(room)
+        if index is not None:
+            index.remove(websocket)
+        if room not in self.rooms:
+            self.interest.pop(room, None)
+            self.limits.pop(room, None)
+            for key, value in self.throttle_counters.pop(room, {}).items():
+                self._closed_throttle_counters[key] += value
+        tick = self.ticks.get(room)
+        if tick is not None:
+            tick.remove(websocket, str(meta["id"]) if meta else None)
+            if room not in self.rooms:
+                tick.stop()
+                del self.ticks[room]
+        if meta and room in self.clients:
+            client_id = str(meta.get("id") or "")
+            if client_id and self.clients[room].get(client_id) is websocket:
+                self.clients[room].pop(client_id, None)
+            if not self.clients[room]:
+                self.clients.pop(room, None)
+        self._drop_connection(websocket)
+        self._room_state_cache.pop(room, None)
+        if meta:
+            self._publish_presence(room)
+            feed = self.feeds.get(room)
+            if feed is not None:
+                feed.forget(str(meta["id"]))
+        count = self.member_count(room)
+        if room not in self.rooms:
+            if room not in self.feeds:
+                self.pubsub.unsubscribe(room)
+                self.remote.pop(room, None)
+            buffer = self.replays.get(room)
+            if buffer is not None and buffer.expiry is None:
+                buffer.expiry = asyncio.get_running_loop().call_later(REPLAY_TTL, self._expire_replay, room)
+            if count:
+                # The workers still holding players keep the row current.
+                room_registry.release(room)
+                return
+        room_registry.set_count(room, count)
+
+    def _remove_spectator(self, room: str, websocket: WebSocket) -> None:
+        self.spectating.pop(websocket, None)
+        self._drop_connection(websocket)
+        feed = self.feeds.get(room)
+        if feed is None:
+            return
+        feed.spectators.discard(websocket)
+        if not feed.spectators:
+            del self.feeds[room]
+            if room not in self.rooms:
+                self.pubsub.unsubscribe(room)
+                self.remote.pop(room, None)
+
+    def _drop_connection(self, websocket: WebSocket) -> None:
+        conn = self.connections.pop(websocket, None)
+        if conn is not None:
+            conn.stop()
+            for key in self._closed_stats:
+                self._closed_stats[key] += getattr(conn, key)
+
+    def close_room(self, room: str, code: int, reason: str = "") -> None:
+        """Close every local socket in the room with code."""
+        feed = self.feeds.get(room)
+        for websocket in [*self.rooms.get(room, ()), *(feed.spectators if feed else ())]:
+            conn = self.connections.get(websocket)
+            self.disconnect(room, websocket)
+            if conn is not None:
+                conn.close(code, reason)
+
+    def is_packed(self, websocket: WebSocket) -> bool:
+        conn = self.connections.get(websocket)
+        return conn is not None and conn.packed
+
+    def broadcast(self, room: str, message: str | Outbound, control: bool = False) -> None:
+        """Queue message for every socket in the room; never waits on a client.
+
+        The same encoded message object is shared by every recipient's queue,
+        and it is published once for the room's members on other workers.
+        """
+        if isinstance(message, str):
+            message = Outbound(text=message)
+        self._deliver(room, message, control)
+        if self.pubsub.distributed:
+            sender = (message.sender or "").encode()[:255]
+            head = bytes([len(sender)]) + sender
+            if message.raw is not None:
+                self._publish(room, REMOTE_RAW, head + message.raw)
+            elif message.text is not None:
+                self._publish(room, REMOTE_TEXT, head + message.text.encode())
+            else:
+                self._publish(room, REMOTE_PACKED, head + message.packed)
+
+    def _deliver(self, room: str, message: Outbound, control: bool = False) -> None:
+        """Number message in the room's replay buffer and queue it locally."""
+        buffer = self.replays.get(room)
+        if buffer is not None:
+            message.seq = buffer.append(message)
+        members = self.rooms.get(room, set())
+        index = self.interest.get(room)
+        # Rooms where nobody filters never look inside their messages.
+        if index:
+            message.route()
+            if message.channel is not None or message.cell is not None:
+                members = index.recipients(members, message.channel, message.cell)
+        self.send_to(list(members), message, control)
+        feed = self.feeds.get(room)
+        if feed is not None:
+            feed.record(message.sender, message)
+
+    def update_interest(self, room: str, websocket: WebSocket, payload: dict[str, Any]) -> None:
+        """Apply a _subscribe, _unsubscribe or _aoi control message."""
+        if websocket not in self.rooms.get(room, ()):
+            return
+        index = self.interest.setdefault(room, InterestIndex())
+        kind = payload["type"]
+        if kind == "_aoi":
+            if payload.get("x") is None:
+                index.set_area(websocket, None)
+                return
+            try:
+                cells = area(payload["x"], payload.get("y"), payload.get("radius", 1))
+            except (TypeError, ValueError):
+                return
+            index.set_area(websocket, cells)
+            return
+        names = payload.get("channels")
+        if isinstance(names, str):
+            names = [names]
+        if not isinstance(names, list):
+            return
+        names = [str(name)[:64] for name in names if name is not None and str(name)]
+        if kind == "_subscribe":
+            index.subscribe(websocket, names)
+        else:
+            index.unsubscribe(websocket, names)
+
+    def relay(self, room: str, websocket: WebSocket, message: str | Outbound, size: int) -> None:
+        """Broadcast a player's game message, subject to their rate limit."""
+        if isinstance(message, str):
+            message = Outbound(text=message)
+        meta = self.players.get(websocket)
+        if meta is not None:
+            message.sender = str(meta["id"])
+        throttle = self.throttles.get(websocket)
+        if throttle is None:
+            self.broadcast(room, message)
+        else:
+            throttle.relay(message, size)
+
+    def admit(self, websocket: WebSocket, size: int) -> bool:
+        """Whether a player's control message is within their rate limit."""
+        throttle = self.throttles.get(websocket)
+        return throttle is None or throttle.admit(size)
+
+    def check_size(self, room: str, size: int) -> bool:
+        if size <= WS_MAX_MESSAGE:
+            return True
+        counters = self.throttle_counters.get(room)
+        if counters is not None:
+            counters["oversized"] += 1
+        return False
+
+    def send_to(self, websockets: list[WebSocket], message: str | Outbound, control: bool = False) -> None:
+        if isinstance(message, str):
+            message = Outbound(text=message)
+        for ws in websockets:
+            conn = self.connections.get(ws)
+            if conn is None:
+                continue
+            frame = message.for_packed(conn.replay) if conn.packed else message.for_text(conn.replay)
+            if frame is not None:
+                conn.send(frame, control)
+
+    def stats(self) -> dict[str, Any]:
+        depths = [len(conn.queue) for conn in self.connections.values()]
+        totals = dict(self._closed_stats)
+        for conn in self.connections.values():
+            for key in totals:
+                totals[key] += getattr(conn, key)
+        return {
+            "policy": self.policy,
+            "connections": len(depths),
+            "queued": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "tick_rooms": len(self.ticks),
+            "filtered_rooms": sum(1 for index in self.interest.values() if index),
+            "max_connections": WS_MAX_CONNECTIONS,
+            "rejected": self.rejected,
+            "reaped": self.reaped,
+            "spectators": len(self.spectating),
+            "spectated_rooms": len(self.feeds),
+            "spectator_frames": self.spectator_frames,
+            **totals,
+        }
+
+    def throttle_stats(self) -> dict[str, Any]:
+        """Throttle counters in total and for each live room that has hit a limit."""
+        totals = dict(self._closed_throttle_counters)
+        rooms = {}
+        for room, counters in self.throttle_counters.items():
+            for key, value in counters.items():
+                totals[key] += value
+            if any(counters.values()):
+                rooms[room] = {**counters, "policy": self.limits[room].policy} if room in self.limits else dict(counters)
+        return {"totals": totals, "rooms": rooms}
+
+    def update_player(self, room: str, websocket: WebSocket, key: str, value: str | bool) -> bool:
+        """Set a player field; False if the socket is gone or nothing changed."""
+        meta = self.players.get(websocket)
+        if meta is None or meta[key] == value:
+            return False
+        meta[key] = value
+        self._room_state_cache.pop(room, None)
+        self._publish_presence(room)
+        return True
+
+    def broadcast_room_state(self, room: str) -> None:
+        # Every worker sends its own sockets their copy.
+        self.send_to(list(self.rooms.get(room, [])), self._room_state_message(room), control=True)
+
+    def _room_state_message(self, room: str) -> Outbound:
+        message = self._room_state_cache.get(room)
+        if message is None:
+            message = Outbound(text=json.dumps({"type": "room_state", "players": self.room_state(room)}))
+            self._room_state_cache[room] = message
+        return message
+
+    def spectate(self) -> None:
+        """Send each spectated room's latest state, if it changed, to its spectators."""
+        for room, feed in list(self.feeds.items()):
+            text = feed.render(self._room_state_message(room).text, self.ticks.get(room))
+            if text is None:
+                continue
+            # One encoding per wire format, shared by every spectator.
+            feed.last = Outbound(text=text)
+            self.spectator_frames += 1
+            self.send_to(list(feed.spectators), feed.last)
+
+    async def _spectate_loop(self) -> None:
+        while True:
+            await asyncio.sleep(SPECTATOR_INTERVAL)
+            try:
+                self.spectate()
+            except Exception:
+                pass
+
+    def room_state(self, room: str) -> list[dict[str, str | bool]]:
+        players = self._local_players(room)
+        seen = {player["id"] for player in players}
+        for remote_players in self.remote.get(room, {}).values():
+            for player in remote_players:
+                # A player who reconnected through another worker shows once.
+                if player.get("id") not in seen:
+                    seen.add(player.get("id"))
+                    players.append(player)
+        return players
+
+    def _local_players(self, room: str) -> list[dict[str, str | bool]]:
+        players = []
+        for ws in self.rooms.get(room, []):
+            meta = self.players.get(ws)
+            if meta:
+                players.append(
+                    {"id": meta["id"], "name": meta["name"], "ready": meta["ready"]}
+                )
+        return players
+
+    def _publish(self, room: str, kind: bytes, data: bytes = b"") -> None:
+        if self.pubsub.distributed:
+            self.pubsub.publish(room, kind + data)
+
+    def _publish_presence(self, room: str) -> None:
+        if self.pubsub.distributed:
+            presence = {"worker": self.pubsub.worker_id, "players": self._local_players(room)}
+            self._publish(room, REMOTE_PRESENCE, json.dumps(presence).encode())
+
+    def _on_remote(self, room: str, payload: bytes) -> None:
+        if room not in self.rooms and room not in self.feeds:
+            return
+        kind, data = payload[:1], payload[1:]
+        if kind in (REMOTE_TEXT, REMOTE_PACKED, REMOTE_RAW):
+            # Relayed messages carry their sender: a length byte and the id.
+            end = 1 + data[0]
+            sender, data = data[1:end].decode(errors="replace") or None, data[end:]
+            if kind == REMOTE_TEXT:
+                message = Outbound(text=data.decode())
+            elif kind == REMOTE_PACKED:
+                message = Outbound(packed=data)
+            else:
+                message = Outbound(raw=data)
+            message.sender = sender
+            self._deliver(room, message)
+        elif kind == REMOTE_PRESENCE:
+            presence = json.loads(data)
+            self._set_remote(room, str(presence["worker"]), presence.get("players") or [])
+        elif kind == REMOTE_SYNC:
+            self._publish_presence(room)
+
+    def _on_peer_lost(self, room: str, worker_id: str) -> None:
+        if room in self.rooms or room in self.feeds:
+            self._set_remote(room, worker_id, [])
+
+    def _on_pubsub_connect(self) -> None:
+        # Anything learned before the broker went away may be stale; ask again.
+        self.remote.clear()
+        self._room_state_cache.clear()
+        for room in {*self.rooms, *self.feeds}:
+            self._publish_presence(room)
+            self._publish(room, REMOTE_SYNC)
+
+    def _set_remote(self, room: str, worker_id: str, players: list[dict[str, Any]]) -> None:
+        workers = self.remote.setdefault(room, {})
+        gone = {player.get("id") for player in workers.get(worker_id, ())} - {player.get("id") for player in players}
+        if players:
+            workers[worker_id] = players
+        elif workers.pop(worker_id, None) is None:
+            return
+        feed = self.feeds.get(room)
+        if feed is not None:
+            for player_id in gone:
+                feed.forget(str(player_id))
+        self._room_state_cache.pop(room, None)
+        room_registry.set_count(room, self.member_count(room))
+        self.broadcast_room_state(room)
+
+
+manager = ConnectionManager(SLOW_CONSUMER_POLICY, SEND_QUEUE_MAX, pubsub)
@@ -17,6 +17,24 @@ class GameOut(BaseModel):
     description: str
     prompt: str
     code: str
+    code_hash: str | None = None
+    created_at: datetime
+    creator_id: int | None = None
+    is_public: bool = True
+    play_count: int | None = None
+    multiplayer: bool = False
+    max_players: int | None = None
+    likes: int | None = None
+
+    class Config:
+        from_attributes = True
+
+
+class GameSummaryOut(BaseModel):
+    id: int
+    title: str
+    description: str
+    code_hash: str | None = None
     created_at: datetime
     creator_id: int | None = None
     is_public: bool = True
@@ -92,6 +110,7 @@ class CommentOut(BaseModel):
     id: int
     game_id: int
     user_id: int
+    username: str | None = None
     content: str
     created_at: datetime
 
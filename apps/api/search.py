@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import re
+
+from sqlalchemy import column, func, literal_column, select, table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.sql import Subquery
+
+FTS_TABLE = "games_fts"
+# bm25 column weights for title, description and prompt.
+FTS_WEIGHTS = (10.0, 4.0, 1.0)
+
+# Set by init_search(); False when SQLite was built without FTS5.
+fts_enabled = False
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+_FTS_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "title, description, prompt, content='games', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS games_fts_ai AFTER INSERT ON games BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, description, prompt) "
+    "VALUES (new.id, new.title, new.description, new.prompt); END",
+    f"CREATE TRIGGER IF NOT EXISTS games_fts_ad AFTER DELETE ON games BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, prompt) "
+    "VALUES ('delete', old.id, old.title, old.description, old.prompt); END",
+    f"CREATE TRIGGER IF NOT EXISTS games_fts_au AFTER UPDATE OF title, description, prompt ON games BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, title, description, prompt) "
+    "VALUES ('delete', old.id, old.title, old.description, old.prompt); "
+    f"INSERT INTO {FTS_TABLE}(rowid, title, description, prompt) "
+    "VALUES (new.id, new.title, new.description, new.prompt); END",
+]
+
+
+def init_search(engine: Engine) -> bool:
+    """Create the FTS index and its sync triggers, backfilling on first run."""
+    global fts_enabled
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": FTS_TABLE},
+            ).first()
+            for ddl in _FTS_DDL:
+                conn.execute(text(ddl))
+            if not exists:
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    except OperationalError:
+        fts_enabled = False
+        return False
+    fts_enabled = True
+    return True
+
+
+def rebuild_index(engine: Engine) -> None:
+    """Repopulate the FTS index from the games table."""
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+
+
+def build_match(q: str) -> str | None:
+    # Every word becomes a quoted prefix term, so user input can never be
+    # parsed as FTS5 query syntax and "neon ra" matches "Neon Racer".
+    tokens = _TOKEN_RE.findall(q)
+    if not tokens:
+        return None
+    return " ".join(f'"{tok}"*' for tok in tokens)
+
+
+def match_subquery(q: str) -> Subquery | None:
+    """Return (game_id, rank) rows matching q, or None if FTS can't serve it."""
+    if not fts_enabled:
+        return None
+    match = build_match(q)
+    if not match:
+        return None
+    fts = table(FTS_TABLE, column("rowid"))
+    fts_col = literal_column(FTS_TABLE)
+    rank = func.bm25(fts_col, *FTS_WEIGHTS)
+    return (
+        select(fts.c.rowid.label("game_id"), rank.label("rank"))
+        .select_from(fts)
+        .where(fts_col.op("MATCH")(match))
+        .subquery("fts_match")
+    )
@@ -0,0 +1,209 @@
+from __future__ import annotations
+
+import asyncio
+import bisect
+import hashlib
+import os
+from typing import Callable
+from urllib.parse import quote
+
+from fastapi import WebSocket
+
+from .rooms import manager, negotiate_subprotocol
+
+try:
+    import websockets
+except ImportError:  # comes with uvicorn[standard]; without it only redirect mode works
+    websockets = None
+
+# Sharded mode pins every room to one API process, chosen by hashing room_id
+# onto a ring of the processes' base URLs, so a room's broadcasts never leave
+# process memory. SHARD_NODES lists every process (comma separated, e.g.
+# http://10.0.0.1:8001) and SHARD_SELF is this process's entry. SHARD_FILE,
+# one URL per line, overrides SHARD_NODES and is re-read when it changes, so
+# adding a worker rebalances rooms without a restart.
+SHARD_NODES = [node.strip().rstrip("/") for node in os.getenv("SHARD_NODES", "").split(",") if node.strip()]
+SHARD_SELF = os.getenv("SHARD_SELF", "").strip().rstrip("/")
+SHARD_FILE = os.getenv("SHARD_FILE", "")
+SHARD_VNODES = int(os.getenv("SHARD_VNODES", "160"))
+SHARD_RELOAD_INTERVAL = float(os.getenv("SHARD_RELOAD_INTERVAL", "2.0"))
+# forward: proxy the socket to the owning process. redirect: close it with
+# CLOSE_MOVED and the owner's URL as the reason, and let the client reconnect.
+SHARD_MODE = os.getenv("SHARD_MODE", "forward")
+# Close code for "this room lives on another shard"; see SHARD_MODE.
+CLOSE_MOVED = 4010
+
+
+def _point(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring; adding a node moves only ~1/N of the keys."""
+
+    def __init__(self, nodes: list[str], vnodes: int) -> None:
+        self.nodes = sorted(set(nodes))
+        points = sorted((_point(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._keys = [key for key, _ in points]
+        self._owners = [node for _, node in points]
+
+    def owner(self, key: str) -> str | None:
+        if not self._keys:
+            return None
+        index = bisect.bisect(self._keys, _point(key)) % len(self._keys)
+        return self._owners[index]
+
+
+class ShardMap:
+    """The current ring and this process's place on it."""
+
+    def __init__(self, nodes: list[str], self_url: str, path: str, vnodes: int) -> None:
+        self.self_url = self_url
+        self.path = path
+        self.vnodes = vnodes
+        self.ring = HashRing(nodes, vnodes)
+        self.reloads = 0
+        self._mtime: float | None = None
+        self._task: asyncio.Task | None = None
+        if path:
+            self.reload()
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.self_url and self.ring.nodes)
+
+    def owner(self, room: str) -> str | None:
+        """URL of the process holding room, or None when it is this one."""
+        if not self.enabled:
+            return None
+        owner = self.ring.owner(room)
+        return None if owner == self.self_url else owner
+
+    def ws_url(self, node: str, room: str, query: str = "") -> str:
+        return f"{self.ws_base(node)}/ws/{quote(room, safe='')}" + (f"?{query}" if query else "")
+
+    def ws_base(self, node: str) -> str:
+        return "ws" + node[len("http") :] if node.startswith("http") else node
+
+    def moved_reason(self, owner: str) -> str:
+        """Close reason sent with CLOSE_MOVED: where to reconnect.
+
+        Empty, meaning "the same URL", when the front forwards.
+        """
+        return self.ws_base(owner) if SHARD_MODE == "redirect" else ""
+
+    def reload(self) -> bool:
+        """Re-read SHARD_FILE; True if the node list changed."""
+        try:
+            mtime = os.path.getmtime(self.path)
+            if mtime == self._mtime:
+                return False
+            with open(self.path) as fh:
+                nodes = [line.strip().rstrip("/") for line in fh if line.strip() and not line.startswith("#")]
+        except OSError:
+            return False
+        self._mtime = mtime
+        if sorted(set(nodes)) == self.ring.nodes:
+            return False
+        self.ring = HashRing(nodes, self.vnodes)
+        self.reloads += 1
+        return True
+
+    def start(self, on_change: Callable[[], None]) -> None:
+        if self.path and self._task is None:
+            self._task = asyncio.create_task(self._watch(on_change))
+
+    def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+
+    def stats(self) -> dict[str, object]:
+        return {"enabled": self.enabled, "mode": SHARD_MODE, "self": self.self_url, "nodes": self.ring.nodes, "reloads": self.reloads}
+
+    async def _watch(self, on_change: Callable[[], None]) -> None:
+        while True:
+            await asyncio.sleep(SHARD_RELOAD_INTERVAL)
+            try:
+                if self.reload():
+                    on_change()
+            except Exception:
+                pass
+
+
+async def forward(websocket: WebSocket, url: str) -> None:
+    """Proxy an incoming socket to url until either side closes.
+
+    Frames are passed through untouched in both directions and the owner's
+    close code (room full, moved, ...) is handed back to the client.
+    """
+    offered = websocket.scope.get("subprotocols") or []
+    try:
+        upstream = await websockets.connect(url, subprotocols=offered or None, max_size=None, open_timeout=5)
+    except Exception:
+        await websocket.close(code=1013)
+        return
+    await websocket.accept(subprotocol=upstream.subprotocol)
+
+    async def client_to_upstream() -> None:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            data = message.get("text")
+            if data is None:
+                data = message.get("bytes")
+            if data is not None:
+                await upstream.send(data)
+
+    async def upstream_to_client() -> None:
+        async for data in upstream:
+            if isinstance(data, bytes):
+                await websocket.send_bytes(data)
+            else:
+                await websocket.send_text(data)
+
+    tasks = [asyncio.create_task(client_to_upstream()), asyncio.create_task(upstream_to_client())]
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await upstream.close()
+        code = upstream.close_code
+        if code is None or code in (1005, 1006):  # reserved, can't be sent
+            code = 1000
+        try:
+            await websocket.close(code=code, reason=upstream.close_reason or "")
+        except Exception:
+            pass
+
+
+async def route(websocket: WebSocket, room: str) -> bool:
+    """Hand the socket to room's shard unless that is this process.
+
+    True if it was handed off, by proxying or by a CLOSE_MOVED redirect. A
+    socket that was already forwarded once is never forwarded again, so two
+    processes briefly disagreeing about the ring can't bounce it around.
+    """
+    owner = shard_map.owner(room)
+    if owner is None:
+        return False
+    if SHARD_MODE == "forward" and websockets is not None and not websocket.query_params.get("forwarded"):
+        query = websocket.url.query
+        await forward(websocket, shard_map.ws_url(owner, room, (f"{query}&" if query else "") + "forwarded=1"))
+    else:
+        await websocket.accept(subprotocol=negotiate_subprotocol(websocket))
+        await websocket.close(code=CLOSE_MOVED, reason=shard_map.moved_reason(owner))
+    return True
+
+
+def rebalance() -> None:
+    """Send the players of rooms that now hash elsewhere to their new shard."""
+    for room in list(manager.rooms):
+        owner = shard_map.owner(room)
+        if owner is not None:
+            manager.close_room(room, CLOSE_MOVED, shard_map.moved_reason(owner))
+
+
+shard_map = ShardMap(SHARD_NODES, SHARD_SELF, SHARD_FILE, SHARD_VNODES)
@@ -0,0 +1,77 @@
+from __future__ import annotations
+
+import json
+import os
+from typing import Any
+
+from fastapi import WebSocket
+
+# Spectators (?role=spectator) don't take a seat or show up in room_state;
+# instead of every relayed message they get one "_spectate" frame per
+# interval carrying the latest state, shared by all of a room's spectators.
+SPECTATOR_INTERVAL = float(os.getenv("WS_SPECTATOR_INTERVAL", "0.2"))
+SPECTATOR_ROLE = "spectator"
+
+
+class SpectatorFeed:
+    """What one room's spectators are shown.
+
+    Keeps the newest relayed message from each sender, and picks up the
+    room_state and, in tick rooms, the authoritative state as they change.
+    render() folds them into one frame,
+        {"type": "_spectate", "messages": [room_state, snapshot?, ...]}
+    with each message as the players saw it, so a client can dispatch them
+    in order. Messages are converted and checked once, when they arrive in
+    a render, not once per spectator.
+    """
+
+    def __init__(self) -> None:
+        self.spectators: set[WebSocket] = set()
+        self.last: Any = None
+        self._pending: dict[str | None, Any] = {}
+        self._latest: dict[str | None, str] = {}
+        self._room_state = ""
+        self._snapshot: str | None = None
+        self._tick: Any = None
+        self._tick_seq = 0
+        self._dirty = False
+
+    def record(self, sender: str | None, message: Any) -> None:
+        self._pending[sender] = message
+        self._dirty = True
+
+    def forget(self, sender: str) -> None:
+        self._pending.pop(sender, None)
+        if self._latest.pop(sender, None) is not None:
+            self._dirty = True
+
+    def render(self, room_state: str, tick: Any = None) -> str | None:
+        """The next frame, or None if nothing changed since the last one."""
+        if room_state != self._room_state:
+            self._room_state = room_state
+            self._dirty = True
+        if tick is not None and (tick is not self._tick or tick.seq != self._tick_seq) and tick.seq in tick.history:
+            self._tick, self._tick_seq = tick, tick.seq
+            self._snapshot = json.dumps(
+                {"type": "_snapshot", "seq": tick.seq, "base": None, "delta": tick.history[tick.seq], "removed": []}
+            )
+            self._dirty = True
+        if not self._dirty:
+            return None
+        self._dirty = False
+        for sender, message in self._pending.items():
+            text = message.for_text()
+            # Only JSON objects can be embedded as they are; opaque bytes
+            # and malformed text would spoil the whole frame.
+            if isinstance(text, str) and text.lstrip().startswith("{"):
+                try:
+                    json.loads(text)
+                except json.JSONDecodeError:
+                    continue
+                self._latest[sender] = text
+        self._pending.clear()
+        parts = [self._room_state]
+        if self._snapshot is not None:
+            parts.append(self._snapshot)
+        parts.extend(self._latest.values())
+        return '{"type":"_spectate","messages":[' + ",".join(parts) + "]}"
@@ -0,0 +1,24 @@
+from __future__ import annotations
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from apps.api import blobs, models  # noqa: F401  (registers the tables)
+from apps.api.db import Base
+
+
+@pytest.fixture
+def db(monkeypatch) -> Session:
+    """A session on a fresh in-memory database with every table created."""
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    Base.metadata.create_all(bind=engine)
+    # Read code back from the table, not the process-wide text cache.
+    monkeypatch.setattr(blobs, "cache", blobs._TextCache(0))
+    session = sessionmaker(autoflush=False, bind=engine, expire_on_commit=False)()
+    try:
+        yield session
+    finally:
+        session.close()
+        engine.dispose()
@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from apps.api import blobs, versions
+from apps.api.models import CodeBlob, Game
+
+
+def _hashes(db) -> set[str]:
+    return {blob.hash for blob in db.query(CodeBlob)}
+
+
+def test_gc_keeps_referenced_blobs(db):
+    game = Game(title="t", description="d", prompt="p")
+    game.code = "<html>current</html>"
+    db.add(game)
+    db.flush()
+    keyframe = versions.snapshot(db, game, "create")
+    assert keyframe.storage == "blob"
+    game.code = "<html>newer</html>"
+    db.flush()
+    orphan = blobs.put(db, "<html>nobody uses this</html>")
+    db.commit()
+
+    assert blobs.collect_garbage(db) == 1
+    db.commit()
+    assert _hashes(db) == {game.code_hash, keyframe.code_hash}
+    assert orphan not in _hashes(db)
+    assert versions.load_code(db, keyframe) == "<html>current</html>"
+    assert blobs.get(db, game.code_hash) == "<html>newer</html>"
+
+
+def test_gc_on_a_clean_store_deletes_nothing(db):
+    game = Game(title="t", description="d", prompt="p")
+    game.code = "<html>only</html>"
+    db.add(game)
+    db.commit()
+    assert blobs.collect_garbage(db) == 0
+    assert _hashes(db) == {game.code_hash}
@@ -0,0 +1,48 @@
+from __future__ import annotations
+
+import base64
+import json
+
+import pytest
+from fastapi import HTTPException
+
+from apps.api.main import _decode_cursor, _encode_cursor
+
+
+def _raw(value) -> str:
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["2024-05-01 12:00:00.000000", 42],
+        [7, "2024-05-01 12:00:00", 3],
+        [-1.25, 9],
+        ["ünïcode ✓", 1],
+    ],
+)
+def test_round_trip(values):
+    cursor = _encode_cursor(values)
+    assert "=" not in cursor
+    assert _decode_cursor(cursor, len(values)) == values
+
+
+@pytest.mark.parametrize(
+    "cursor, size",
+    [
+        ("not base64!", 2),
+        (_raw("text")[:-2], 2),
+        (base64.urlsafe_b64encode(b"{not json").decode(), 2),
+        (_raw({"a": 1}), 2),
+        (_raw([1, 2]), 3),
+        (_raw([{"a": 1}, 2]), 2),
+        (_raw([[1], 2]), 2),
+        (_raw([None, 2]), 2),
+        (_raw([True, 2]), 2),
+    ],
+)
+def test_invalid_cursor_is_400(cursor, size):
+    with pytest.raises(HTTPException) as info:
+        _decode_cursor(cursor, size)
+    assert info.value.status_code == 400
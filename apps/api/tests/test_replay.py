@@ -0,0 +1,40 @@
+from __future__ import annotations
+
+from apps.api.replay import ReplayBuffer
+
+
+def _filled(count: int, size: int = 8) -> ReplayBuffer:
+    buffer = ReplayBuffer(size)
+    for i in range(1, count + 1):
+        assert buffer.append(f"m{i}") == i
+    return buffer
+
+
+def test_resume_returns_only_what_was_missed():
+    buffer = _filled(5)
+    assert buffer.since(buffer.epoch, 3) == ["m4", "m5"]
+    assert buffer.since(buffer.epoch, 5) == []
+    assert buffer.since(buffer.epoch, 0) == ["m1", "m2", "m3", "m4", "m5"]
+
+
+def test_resume_fails_once_messages_have_left_the_ring():
+    buffer = _filled(12, size=8)
+    assert buffer.since(buffer.epoch, 4) == [f"m{i}" for i in range(5, 13)]
+    assert buffer.since(buffer.epoch, 3) is None
+
+
+def test_resume_across_an_epoch_change_is_refused():
+    before = _filled(5)
+    # A restart, expiry or another worker starts numbering from scratch.
+    after = _filled(5)
+    assert after.epoch != before.epoch
+    assert after.since(before.epoch, 3) is None
+    assert after.since(None, 3) is None
+    # Resuming from the new epoch's numbering works as usual.
+    assert after.since(after.epoch, 3) == ["m4", "m5"]
+
+
+def test_bad_sequence_numbers_are_refused():
+    buffer = _filled(3)
+    assert buffer.since(buffer.epoch, 4) is None
+    assert buffer.since(buffer.epoch, -1) is None
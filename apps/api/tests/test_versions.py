@@ -0,0 +1,51 @@
+from __future__ import annotations
+
+import pytest
+
+from apps.api import versions
+from apps.api.models import Game
+
+BASE = "".join(f"line {i}\n" for i in range(50))
+
+
+@pytest.mark.parametrize(
+    "target",
+    [
+        BASE,
+        "",
+        BASE.replace("line 10\n", "changed\n"),
+        "header\n" + BASE + "footer",
+        BASE[: len(BASE) // 2],
+        "no newline at all",
+    ],
+)
+def test_delta_round_trip(target):
+    assert versions.apply_delta(BASE, versions.encode_delta(BASE, target)) == target
+
+
+def test_delta_is_smaller_than_code_for_small_edits():
+    target = BASE.replace("line 25\n", "line twenty-five\n")
+    assert len(versions.encode_delta(BASE, target)) < len(target) // 2
+
+
+def test_keyframes_bound_the_chain_and_every_version_reconstructs(db, monkeypatch):
+    monkeypatch.setattr(versions, "KEYFRAME_INTERVAL", 3)
+    game = Game(title="t", description="d", prompt="p")
+    game.code = BASE
+    db.add(game)
+    db.flush()
+    codes = []
+    for i in range(8):
+        game.code = BASE + f"edit {i}\n" * (i + 1)
+        db.flush()
+        codes.append(game.code)
+        versions.snapshot(db, game, "edit")
+    db.commit()
+
+    history = versions.load_history(db, game.id)
+    assert [code for _, code in history] == codes
+    assert [versions.load_code(db, row) for row, _ in history] == codes
+    storage = [row.storage for row, _ in history]
+    assert storage[0] == "blob" and "delta" in storage
+    for row, _ in history:
+        assert len(versions._chain(db, row)) <= 3
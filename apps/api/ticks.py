@@ -0,0 +1,153 @@
+from __future__ import annotations
+
+import asyncio
+import copy
+import json
+import os
+from collections import OrderedDict
+from typing import Any, Callable, Iterable
+
+from fastapi import WebSocket
+
+# Authoritative rooms keep the shared state server-side and send it out at a
+# fixed rate instead of relaying every client's full state to every peer:
+#
+#   client -> server  {"type": "_input", "data": {...}}          merged into players[<client id>]
+#                     {"type": "_state_patch", "patch": {...}}   JSON merge patch (RFC 7386) on shared
+#                     {"type": "_ack", "seq": n}                 client now holds snapshot n
+#   server -> client  {"type": "_snapshot", "seq": n, "base": b, "delta": {...}, "removed": [[...], ...]}
+#
+# A snapshot with base null carries the whole state in delta. Otherwise
+# delta holds only what changed since snapshot b, the last one that client
+# acknowledged: objects present on both sides merge recursively, anything
+# else replaces, and removed lists key paths to delete.
+TICK_TYPES = ("_input", "_state_patch", "_ack")
+TICK_MAX_RATE = float(os.getenv("TICK_MAX_RATE", "60"))
+# Snapshots kept as delta bases; a client whose last ack is older gets a full one.
+TICK_HISTORY = int(os.getenv("TICK_HISTORY", "64"))
+
+
+def parse_rate(raw: str | None) -> float | None:
+    if not raw:
+        return None
+    try:
+        rate = float(raw)
+    except ValueError:
+        return None
+    if rate <= 0:
+        return None
+    return min(rate, TICK_MAX_RATE)
+
+
+def diff(old: dict[str, Any], new: dict[str, Any], path: tuple[str, ...] = ()) -> tuple[dict[str, Any], list[list[str]]]:
+    changes: dict[str, Any] = {}
+    removed: list[list[str]] = [[*path, key] for key in old if key not in new]
+    for key, value in new.items():
+        if key not in old:
+            changes[key] = value
+            continue
+        previous = old[key]
+        if previous == value:
+            continue
+        if isinstance(previous, dict) and isinstance(value, dict):
+            sub_changes, sub_removed = diff(previous, value, (*path, key))
+            if sub_changes:
+                changes[key] = sub_changes
+            removed.extend(sub_removed)
+        else:
+            changes[key] = value
+    return changes, removed
+
+
+def merge_patch(target: dict[str, Any], patch: dict[str, Any]) -> None:
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict):
+            current = target.get(key)
+            if not isinstance(current, dict):
+                current = target[key] = {}
+            merge_patch(current, value)
+        else:
+            target[key] = value
+
+
+class TickRoom:
+    """Server-held state for one authoritative room, snapshotted every tick."""
+
+    def __init__(
+        self,
+        rate: float,
+        members: Callable[[], Iterable[WebSocket]],
+        deliver: Callable[[str, list[WebSocket]], None],
+    ) -> None:
+        self.rate = rate
+        self.state: dict[str, Any] = {"players": {}, "shared": {}}
+        self.seq = 0
+        self.history: OrderedDict[int, dict[str, Any]] = OrderedDict()
+        self.acks: dict[WebSocket, int] = {}
+        self._members = members
+        self._deliver = deliver
+        self._dirty = True
+        self._task = asyncio.create_task(self._run())
+
+    def handle(self, websocket: WebSocket, player_id: str, payload: dict[str, Any]) -> None:
+        kind = payload["type"]
+        if kind == "_ack":
+            seq = payload.get("seq")
+            if isinstance(seq, int) and seq in self.history and seq > self.acks.get(websocket, 0):
+                self.acks[websocket] = seq
+        elif kind == "_input" and isinstance(payload.get("data"), dict):
+            player = self.state["players"].setdefault(player_id, {})
+            player.update(payload["data"])
+            self._dirty = True
+        elif kind == "_state_patch" and isinstance(payload.get("patch"), dict):
+            merge_patch(self.state["shared"], payload["patch"])
+            self._dirty = True
+
+    def remove(self, websocket: WebSocket, player_id: str | None) -> None:
+        self.acks.pop(websocket, None)
+        if player_id and self.state["players"].pop(player_id, None) is not None:
+            self._dirty = True
+
+    def stop(self) -> None:
+        self._task.cancel()
+
+    def tick(self) -> None:
+        if self._dirty:
+            self.seq += 1
+            self.history[self.seq] = copy.deepcopy(self.state)
+            while len(self.history) > TICK_HISTORY:
+                self.history.popitem(last=False)
+            self._dirty = False
+        if not self.history:
+            return
+        current = self.history[self.seq]
+        # Clients acked on the same base get the same bytes.
+        by_base: dict[int | None, list[WebSocket]] = {}
+        for websocket in self._members():
+            base = self.acks.get(websocket)
+            if base == self.seq:
+                continue
+            by_base.setdefault(base if base in self.history else None, []).append(websocket)
+        for base, recipients in by_base.items():
+            if base is None:
+                delta, removed = current, []
+            else:
+                delta, removed = diff(self.history[base], current)
+            message = json.dumps({"type": "_snapshot", "seq": self.seq, "base": base, "delta": delta, "removed": removed})
+            self._deliver(message, recipients)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.rate
+        next_tick = loop.time()
+        while True:
+            # Fixed schedule, but skip ticks we've fallen behind on rather
+            # than bursting to catch up.
+            next_tick = max(next_tick + interval, loop.time())
+            await asyncio.sleep(next_tick - loop.time())
+            try:
+                self.tick()
+            except Exception:
+                pass
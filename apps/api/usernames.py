@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+
+from sqlalchemy.orm import Session
+
+from .models import User
+
+
+class UsernameCache:
+    """Bounded LRU of user id -> username; usernames never change once set."""
+
+    def __init__(self, max_size: int = 10000) -> None:
+        self.max_size = max_size
+        self._names: OrderedDict[int, str] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(self, user_id: int, username: str) -> None:
+        with self._lock:
+            self._names[user_id] = username
+            self._names.move_to_end(user_id)
+            while len(self._names) > self.max_size:
+                self._names.popitem(last=False)
+
+    def lookup(self, db: Session, user_ids: list[int]) -> dict[int, str]:
+        """Resolve ids to usernames, loading all misses in one query."""
+        found: dict[int, str] = {}
+        with self._lock:
+            for user_id in user_ids:
+                name = self._names.get(user_id)
+                if name is not None:
+                    self._names.move_to_end(user_id)
+                    found[user_id] = name
+        missing = {user_id for user_id in user_ids if user_id not in found}
+        if missing:
+            for user_id, username in db.query(User.id, User.username).filter(User.id.in_(missing)):
+                self.put(user_id, username)
+                found[user_id] = username
+        return found
+
+
+usernames = UsernameCache()
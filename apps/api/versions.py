@@ -0,0 +1,145 @@
+from __future__ import annotations
+
+import json
+import os
+import zlib
+from difflib import SequenceMatcher
+
+from sqlalchemy.orm import Session
+
+from . import blobs
+from .models import Game, GameVersion
+
+# A version is stored as one of:
+#   blob  - keyframe; the full code is the code_blobs row named by code_hash
+#   delta - zlib-compressed line delta against GameVersion.base_id
+#   full  - legacy row, raw text in GameVersion.code
+#   key   - legacy row, zlib-compressed full text in GameVersion.payload
+# New rows record code_hash whatever their storage, so "is this unchanged"
+# is a string comparison.
+# Deltas always point at the previous version of the same game, and a
+# keyframe is written at least every KEYFRAME_INTERVAL versions so
+# reconstruction never replays more than that many deltas.
+KEYFRAME_INTERVAL = int(os.getenv("VERSION_KEYFRAME_INTERVAL", "20"))
+
+
+def encode_delta(base: str, target: str) -> bytes:
+    """Encode target as copy ranges of base's lines plus inserted text."""
+    a = base.splitlines(keepends=True)
+    b = target.splitlines(keepends=True)
+    ops: list[list[int] | str] = []
+    for tag, i1, i2, j1, j2 in SequenceMatcher(None, a, b).get_opcodes():
+        if tag == "equal":
+            ops.append([i1, i2])
+        elif j2 > j1:
+            ops.append("".join(b[j1:j2]))
+    return zlib.compress(json.dumps(ops, separators=(",", ":")).encode(), 9)
+
+
+def apply_delta(base: str, payload: bytes) -> str:
+    lines = base.splitlines(keepends=True)
+    out = []
+    for op in json.loads(zlib.decompress(payload)):
+        if isinstance(op, str):
+            out.append(op)
+        else:
+            out.extend(lines[op[0] : op[1]])
+    return "".join(out)
+
+
+def _chain(db: Session, version: GameVersion) -> list[GameVersion]:
+    """The version followed by each delta base back to its keyframe."""
+    chain = [version]
+    while chain[-1].storage == "delta":
+        base = db.get(GameVersion, chain[-1].base_id)
+        if base is None:
+            raise ValueError(f"Version {chain[-1].id} is missing its base {chain[-1].base_id}")
+        chain.append(base)
+    return chain
+
+
+def _keyframe_code(db: Session, version: GameVersion) -> str:
+    if version.storage == "blob":
+        code = blobs.get(db, version.code_hash)
+        if code is None:
+            raise ValueError(f"Version {version.id} references missing blob {version.code_hash}")
+        return code
+    if version.storage == "key":
+        return zlib.decompress(version.payload).decode()
+    return version.code
+
+
+def load_code(db: Session, version: GameVersion) -> str:
+    chain = _chain(db, version)
+    code = _keyframe_code(db, chain.pop())
+    while chain:
+        code = apply_delta(code, chain.pop().payload)
+    return code
+
+
+def load_history(db: Session, game_id: int) -> list[tuple[GameVersion, str]]:
+    """All versions of a game, oldest first, with their reconstructed code."""
+    rows = db.query(GameVersion).filter(GameVersion.game_id == game_id).order_by(GameVersion.id.asc()).all()
+    codes: dict[int, str] = {}
+    history = []
+    for row in rows:
+        if row.storage == "delta" and row.base_id in codes:
+            code = apply_delta(codes[row.base_id], row.payload)
+        else:
+            code = load_code(db, row)
+        codes[row.id] = code
+        history.append((row, code))
+    return history
+
+
+def _encode(db: Session, game_id: int, code: str, code_hash: str | None = None, before_id: int | None = None) -> dict:
+    code_hash = code_hash or blobs.hash_code(code)
+    query = db.query(GameVersion).filter(GameVersion.game_id == game_id)
+    if before_id is not None:
+        query = query.filter(GameVersion.id < before_id)
+    prev = query.order_by(GameVersion.id.desc()).first()
+    if prev is not None:
+        chain = _chain(db, prev)
+        if len(chain) < KEYFRAME_INTERVAL:
+            if prev.code_hash == code_hash:
+                # Unchanged since the previous version: copy every line.
+                delta = zlib.compress(json.dumps([[0, len(code.splitlines())]]).encode())
+            else:
+                delta = encode_delta(load_code(db, prev), code)
+            keyframe_size = blobs.stored_size(db, code_hash) or len(zlib.compress(code.encode()))
+            if len(delta) < keyframe_size:
+                return {"storage": "delta", "base_id": prev.id, "payload": delta, "code": "", "code_hash": code_hash}
+    blobs.put(db, code, code_hash)
+    return {"storage": "blob", "base_id": None, "payload": None, "code": "", "code_hash": code_hash}
+
+
+def snapshot(db: Session, game: Game, action: str) -> GameVersion:
+    """Record the game's current state as a new version."""
+    if not game.code_hash:
+        # Move a pre-blob-store game's code into the store while we're here.
+        game.code = game.legacy_code
+    version = GameVersion(
+        game_id=game.id,
+        title=game.title,
+        description=game.description,
+        prompt=game.prompt,
+        action=action,
+        **_encode(db, game.id, game.code, game.code_hash),
+    )
+    db.add(version)
+    db.flush()
+    return version
+
+
+def compress_history(db: Session, game_id: int) -> int:
+    """Convert a game's legacy full/key versions in place; returns rows changed."""
+    history = load_history(db, game_id)
+    changed = 0
+    for row, code in history:
+        if row.storage not in ("full", "key"):
+            continue
+        for key, value in _encode(db, game_id, code, before_id=row.id).items():
+            setattr(row, key, value)
+        db.flush()
+        changed += 1
+    return changed
@@ -2,6 +2,7 @@
 
 import { useEffect, useMemo, useRef, useState } from "react";
 import Link from "next/link";
+import { multiplayerShim } from "../lib/multiplayerShim";
 
 const API = process.env.NEXT_PUBLIC_API_URL ?? "http://localhost:8000";
 
@@ -181,97 +182,7 @@ window.GameFactoryAI = async function(prompt, system, timeoutMs=8000){
     clearTimeout(timer);
   }
 };
-window.GameFactoryMultiplayer = function(roomId, options){
-  if (roomId && typeof roomId === 'object') { options = roomId; roomId = options.roomId; }
-  options = options || {};
-  const room = roomId || window.__GF_DEFAULT_ROOM || "lobby";
-  const clientId = (options.clientId || window.__GF_CLIENT_ID || "").toString().slice(0, 48);
-  const name = (options.name || window.__GF_USERNAME || "").toString().slice(0, 24);
-  const maxPlayers = options.maxPlayers || window.__GF_MP_MAX || null;
-  const params = new URLSearchParams();
-  if (clientId) params.set("client_id", clientId);
-  if (name) params.set("name", name);
-  if (maxPlayers) params.set("max_players", String(maxPlayers));
-  const ws = new WebSocket("${wsUrl}/ws/" + encodeURIComponent(room) + (params.toString() ? "?" + params.toString() : ""));
-  const handlers = [];
-  const stateHandlers = [];
-  const statusHandlers = [];
-  const queue = [];
-  let hud;
-  function setStatus(s){
-    statusHandlers.forEach((fn)=>fn(s));
-    if (window.__GF_MP_HUD){
-      if (!hud){
-        hud = document.createElement('div');
-        hud.style.cssText = 'position:fixed;right:12px;bottom:12px;z-index:9999;background:rgba(0,0,0,0.6);color:#9ff;padding:6px 8px;border-radius:8px;font:12px system-ui';
-        document.body.appendChild(hud);
-      }
-      hud.textContent = 'MP: ' + s + ' (' + room + ')';
-    }
-  }
-  ws.onopen = ()=>{
-    setStatus('connected');
-    while (queue.length) ws.send(queue.shift());
-  };
-  ws.onclose = ()=>setStatus('disconnected');
-  ws.onerror = ()=>setStatus('error');
-  ws.onmessage = (evt) => {
-    let parsed = null;
-    try { parsed = JSON.parse(evt.data); } catch {}
-    if (parsed && parsed.type === 'room_state') {
-      if (maxPlayers && (parsed.players?.length || 0) >= maxPlayers && !parsed.players?.find((p)=>p.id===clientId)) {
-        setStatus('full');
-        try { ws.close(); } catch {}
-        return;
-      }
-      if (window.__GF_MP_HUD && hud) {
-        hud.textContent = 'MP: ' + 'connected' + ' (' + room + ') ' + (parsed.players?.length || 0) + ' players';
-      }
-    }
-    if (parsed && parsed.type === 'state') {
-      stateHandlers.forEach((fn)=>fn(parsed.state));
-    }
-    handlers.forEach((fn) => fn(evt.data, parsed));
-  };
-  return {
-    room,
-    clientId,
-    send: (data) => {
-      const normalize = (input) => {
-        if (typeof input !== "string") {
-          if (input && input.type === "join") {
-            input.id = clientId || input.id;
-            input.name = name || input.name;
-            if (!input.joinedAt) input.joinedAt = Date.now();
-          }
-          return JSON.stringify(input);
-        }
-        try {
-          const parsed = JSON.parse(input);
-          if (parsed && parsed.type === "join") {
-            parsed.id = clientId || parsed.id;
-            parsed.name = name || parsed.name;
-            if (!parsed.joinedAt) parsed.joinedAt = Date.now();
-            return JSON.stringify(parsed);
-          }
-        } catch {}
-        return input;
-      };
-      const payload = normalize(data);
-      if (ws.readyState === 1) ws.send(payload);
-      else queue.push(payload);
-    },
-    broadcastState: (state) => {
-      const payload = JSON.stringify({ type: 'state', state });
-      if (ws.readyState === 1) ws.send(payload);
-      else queue.push(payload);
-    },
-    onMessage: (fn) => handlers.push(fn),
-    onState: (fn) => stateHandlers.push(fn),
-    onStatus: (fn) => statusHandlers.push(fn),
-    disconnect: () => ws.close()
-  };
-};
+${multiplayerShim(wsUrl)}
 window.GameFactoryKit = (function(){
   const clamp = (v,min,max)=>Math.max(min,Math.min(max,v));
   const lerp = (a,b,t)=>a+(b-a)*t;
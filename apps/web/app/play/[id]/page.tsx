@@ -8,8 +8,7 @@ type Game = {
   id: number;
   title: string;
   description: string;
-  prompt: string;
-  code: string;
+  code_hash?: string | null;
   created_at: string;
   multiplayer?: boolean;
   max_players?: number | null;
@@ -17,16 +16,22 @@ type Game = {
 
 export default function PlayPage({ params }: { params: { id: string } }) {
   const [game, setGame] = useState<Game | null>(null);
+  const [code, setCode] = useState("");
   const [perfMode, setPerfMode] = useState(true);
   const iframeRef = useRef<HTMLIFrameElement | null>(null);
   const previewRef = useRef<HTMLDivElement | null>(null);
-  const previewKey = useMemo(() => (game ? game.title + game.code.length + String(perfMode) : "empty"), [game, perfMode]);
+  const previewKey = useMemo(() => (game ? game.title + (game.code_hash || code.length) + String(perfMode) : "empty"), [game, code, perfMode]);
 
   useEffect(() => {
     async function load() {
-      const res = await fetch(`${API}/games/${params.id}`);
-      if (res.ok) {
+      // The HTML endpoint is ETag-cached, so repeat plays revalidate instead of re-downloading.
+      const [res, htmlRes] = await Promise.all([
+        fetch(`${API}/games/${params.id}?view=summary`),
+        fetch(`${API}/games/${params.id}/html`)
+      ]);
+      if (res.ok && htmlRes.ok) {
         const data = await res.json();
+        setCode(await htmlRes.text());
         setGame(data);
         fetch(`${API}/games/${params.id}/play`, { method: "POST" }).catch(() => {});
       }
@@ -66,7 +71,7 @@ export default function PlayPage({ params }: { params: { id: string } }) {
           <h1>{game.title}</h1>
           <p style={{ color: "#98a0b5" }}>{game.description}</p>
           <div className="preview" style={{ height: "80vh" }} ref={previewRef} onClick={focusPreview}>
-            <iframe ref={iframeRef} key={previewKey} srcDoc={withHelper(game.code)} sandbox="allow-scripts" />
+            <iframe ref={iframeRef} key={previewKey} srcDoc={withHelper(code)} sandbox="allow-scripts" />
           </div>
           <div className="button-row">
             <button className="secondary" onClick={() => setPerfMode((v) => !v)}>
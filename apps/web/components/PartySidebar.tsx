@@ -134,6 +134,7 @@ export default function PartySidebar() {
     const params = new URLSearchParams();
     params.set("multiplayer", "true");
     params.set("min_players", String(minPlayers));
+    params.set("view", "summary");
     const res = await fetch(`${API}/games?${params.toString()}`);
     if (!res.ok) return;
     const data: Game[] = await res.json();
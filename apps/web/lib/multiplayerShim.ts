@@ -0,0 +1,363 @@
+// The gfPack MessagePack codec and window.GameFactoryMultiplayer, as script
+// text for the helper pages inject into game iframes.
+export function multiplayerShim(wsUrl: string): string {
+  return `
+const gfPack = (function(){
+  // Minimal MessagePack codec for the gf.msgpack WebSocket subprotocol.
+  const te = new TextEncoder();
+  const td = new TextDecoder();
+  function encode(value){
+    let buf = new Uint8Array(256);
+    let view = new DataView(buf.buffer);
+    let pos = 0;
+    const ensure = (n)=>{
+      if (pos + n <= buf.length) return;
+      let size = buf.length * 2;
+      while (size < pos + n) size *= 2;
+      const next = new Uint8Array(size);
+      next.set(buf);
+      buf = next;
+      view = new DataView(buf.buffer);
+    };
+    const u8 = (v)=>{ ensure(1); buf[pos++] = v; };
+    const u16 = (v)=>{ ensure(2); view.setUint16(pos, v); pos += 2; };
+    const u32 = (v)=>{ ensure(4); view.setUint32(pos, v); pos += 4; };
+    const raw = (b)=>{ ensure(b.length); buf.set(b, pos); pos += b.length; };
+    const head = (len, fix, fixMax, t8, t16, t32)=>{
+      if (fix !== null && len <= fixMax) u8(fix | len);
+      else if (t8 !== null && len < 256) { u8(t8); u8(len); }
+      else if (len < 65536) { u8(t16); u16(len); }
+      else { u8(t32); u32(len); }
+    };
+    const write = (v)=>{
+      if (v === null || v === undefined) u8(0xc0);
+      else if (v === false) u8(0xc2);
+      else if (v === true) u8(0xc3);
+      else if (typeof v === 'number') {
+        if (Number.isInteger(v) && v >= -32 && v < 128) u8(v & 0xff);
+        else if (Number.isInteger(v) && v >= 0 && v < 4294967296) {
+          if (v < 256) { u8(0xcc); u8(v); }
+          else if (v < 65536) { u8(0xcd); u16(v); }
+          else { u8(0xce); u32(v); }
+        }
+        else if (Number.isInteger(v) && v < 0 && v >= -2147483648) { u8(0xd2); ensure(4); view.setInt32(pos, v); pos += 4; }
+        else { u8(0xcb); ensure(8); view.setFloat64(pos, v); pos += 8; }
+      }
+      else if (typeof v === 'string') { const b = te.encode(v); head(b.length, 0xa0, 31, 0xd9, 0xda, 0xdb); raw(b); }
+      else if (v instanceof ArrayBuffer || ArrayBuffer.isView(v)) {
+        const b = v instanceof ArrayBuffer ? new Uint8Array(v) : new Uint8Array(v.buffer, v.byteOffset, v.byteLength);
+        head(b.length, null, 0, 0xc4, 0xc5, 0xc6);
+        raw(b);
+      }
+      else if (Array.isArray(v)) { head(v.length, 0x90, 15, null, 0xdc, 0xdd); v.forEach(write); }
+      else if (typeof v.toJSON === 'function') write(v.toJSON());
+      else {
+        const keys = Object.keys(v).filter((k)=>v[k] !== undefined && typeof v[k] !== 'function');
+        head(keys.length, 0x80, 15, null, 0xde, 0xdf);
+        keys.forEach((k)=>{ write(k); write(v[k]); });
+      }
+    };
+    write(value);
+    return buf.subarray(0, pos);
+  }
+  function decode(input){
+    const buf = input instanceof Uint8Array ? input : new Uint8Array(input);
+    const view = new DataView(buf.buffer, buf.byteOffset, buf.byteLength);
+    let pos = 0;
+    const str = (n)=>{ const s = td.decode(buf.subarray(pos, pos + n)); pos += n; return s; };
+    const bin = (n)=>{ const b = buf.slice(pos, pos + n); pos += n; return b; };
+    const arr = (n)=>{ const out = new Array(n); for (let i = 0; i < n; i++) out[i] = read(); return out; };
+    const map = (n)=>{ const out = {}; for (let i = 0; i < n; i++) { const k = read(); out[k] = read(); } return out; };
+    const num = (getter, size)=>{ const v = view[getter](pos); pos += size; return v; };
+    const read = ()=>{
+      const t = buf[pos++];
+      if (t < 0x80) return t;
+      if (t < 0x90) return map(t & 0x0f);
+      if (t < 0xa0) return arr(t & 0x0f);
+      if (t < 0xc0) return str(t & 0x1f);
+      if (t >= 0xe0) return t - 256;
+      switch (t) {
+        case 0xc0: return null;
+        case 0xc2: return false;
+        case 0xc3: return true;
+        case 0xc4: return bin(num('getUint8', 1));
+        case 0xc5: return bin(num('getUint16', 2));
+        case 0xc6: return bin(num('getUint32', 4));
+        case 0xca: return num('getFloat32', 4);
+        case 0xcb: return num('getFloat64', 8);
+        case 0xcc: return num('getUint8', 1);
+        case 0xcd: return num('getUint16', 2);
+        case 0xce: return num('getUint32', 4);
+        case 0xcf: return num('getUint32', 4) * 4294967296 + num('getUint32', 4);
+        case 0xd0: return num('getInt8', 1);
+        case 0xd1: return num('getInt16', 2);
+        case 0xd2: return num('getInt32', 4);
+        case 0xd3: return num('getInt32', 4) * 4294967296 + num('getUint32', 4);
+        case 0xd9: return str(num('getUint8', 1));
+        case 0xda: return str(num('getUint16', 2));
+        case 0xdb: return str(num('getUint32', 4));
+        case 0xdc: return arr(num('getUint16', 2));
+        case 0xdd: return arr(num('getUint32', 4));
+        case 0xde: return map(num('getUint16', 2));
+        case 0xdf: return map(num('getUint32', 4));
+      }
+      throw new Error('Unsupported MessagePack type ' + t);
+    };
+    return read();
+  }
+  return { encode, decode };
+})();
+window.GameFactoryMultiplayer = function(roomId, options){
+  if (roomId && typeof roomId === 'object') { options = roomId; roomId = options.roomId; }
+  options = options || {};
+  const room = roomId || window.__GF_DEFAULT_ROOM || "lobby";
+  const clientId = (options.clientId || window.__GF_CLIENT_ID || "").toString().slice(0, 48);
+  const name = (options.name || window.__GF_USERNAME || "").toString().slice(0, 24);
+  const maxPlayers = options.maxPlayers || window.__GF_MP_MAX || null;
+  const params = new URLSearchParams();
+  if (clientId) params.set("client_id", clientId);
+  if (name) params.set("name", name);
+  if (maxPlayers) params.set("max_players", String(maxPlayers));
+  // Asks the server to hold the room's state and send snapshots at this rate.
+  if (options.tickRate) params.set("tick_rate", String(options.tickRate));
+  // Opt-in: messages arrive numbered (a "_seq" field), so a reconnect can
+  // ask for just what it missed.
+  if (options.replay === true) params.set("replay", "1");
+  // Watch without taking a seat: the server sends the room's latest state a
+  // few times a second instead of every message, and ignores what we send.
+  const spectator = options.spectate === true;
+  if (spectator) params.set("role", "spectator");
+  // Offer MessagePack; the server falls back to JSON text if it can't.
+  const protocols = options.binary === false ? undefined : ["gf.msgpack", "gf.json"];
+  // A sharded server closes with 4010 when the room lives on another
+  // process; the close reason, if set, is the server to reconnect to.
+  let base = "${wsUrl}";
+  let ws;
+  let closing = false;
+  let attempts = 0;
+  let epoch = null;
+  let lastSeq = 0;
+  // Interest management: channels this client listens to and its area of
+  // interest in grid cells. Until set, it receives everything.
+  const channels = new Set();
+  let area = null;
+  const cellSize = options.cellSize || 256;
+  let binary = false;
+  const handlers = [];
+  const stateHandlers = [];
+  const statusHandlers = [];
+  const snapshotHandlers = [];
+  const replayHandlers = [];
+  const queue = [];
+  // Recent snapshots by seq; the server sends deltas against the last one acked.
+  const snapshots = new Map();
+  let snapshot = null;
+  let hud;
+  function setStatus(s){
+    statusHandlers.forEach((fn)=>fn(s));
+    if (window.__GF_MP_HUD){
+      if (!hud){
+        hud = document.createElement('div');
+        hud.style.cssText = 'position:fixed;right:12px;bottom:12px;z-index:9999;background:rgba(0,0,0,0.6);color:#9ff;padding:6px 8px;border-radius:8px;font:12px system-ui';
+        document.body.appendChild(hud);
+      }
+      hud.textContent = 'MP: ' + s + ' (' + room + ')';
+    }
+  }
+  function transmit(data){
+    let value = data;
+    let parsed = null;
+    if (typeof value !== "string") parsed = value;
+    else { try { parsed = JSON.parse(value); } catch {} }
+    if (parsed && typeof parsed === "object" && parsed.type === "join") {
+      parsed.id = clientId || parsed.id;
+      parsed.name = name || parsed.name;
+      if (!parsed.joinedAt) parsed.joinedAt = Date.now();
+      value = parsed;
+    }
+    if (binary) ws.send(gfPack.encode(parsed && typeof parsed === "object" ? parsed : { type: "message", data: value }));
+    else ws.send(typeof value === "string" ? value : JSON.stringify(value));
+  }
+  function applyDelta(target, delta){
+    Object.keys(delta).forEach((key)=>{
+      const value = delta[key];
+      const current = target[key];
+      if (value && typeof value === "object" && !Array.isArray(value) && current && typeof current === "object" && !Array.isArray(current)) applyDelta(current, value);
+      else target[key] = value;
+    });
+  }
+  function applySnapshot(msg){
+    let next;
+    if (msg.base === null || msg.base === undefined) next = msg.delta || {};
+    else {
+      const base = snapshots.get(msg.base);
+      if (!base) return false;
+      next = JSON.parse(JSON.stringify(base));
+      applyDelta(next, msg.delta || {});
+    }
+    (msg.removed || []).forEach((path)=>{
+      let node = next;
+      for (let i = 0; node && i < path.length - 1; i++) node = node[path[i]];
+      if (node && typeof node === "object") delete node[path[path.length - 1]];
+    });
+    snapshots.set(msg.seq, next);
+    while (snapshots.size > 32) snapshots.delete(snapshots.keys().next().value);
+    snapshot = next;
+    if (!spectator) transmit({ type: "_ack", seq: msg.seq });
+    return true;
+  }
+  function addressed(data, key, value){
+    const payload = data && typeof data === "object" && !Array.isArray(data) ? Object.assign({}, data) : { type: "message", data };
+    payload[key] = value;
+    return payload;
+  }
+  function sendOrQueue(payload){
+    if (ws.readyState === 1) transmit(payload);
+    else queue.push(payload);
+  }
+  function handleOpen(){
+    binary = ws.protocol === "gf.msgpack";
+    if (binary) ws.binaryType = "arraybuffer";
+    attempts = 0;
+    setStatus('connected');
+    while (queue.length) transmit(queue.shift());
+  }
+  function handleClose(evt){
+    if (closing) {
+      setStatus('disconnected');
+      return;
+    }
+    if (evt.code === 4010) {
+      if (evt.reason && evt.reason.indexOf("ws") === 0) base = evt.reason;
+      setStatus('moving');
+      setTimeout(open, 250);
+      return;
+    }
+    // Dropped connections and server restarts; not refusals like a full room.
+    if (options.reconnect !== false && [1001, 1006, 1011, 1012, 1013].indexOf(evt.code) !== -1) {
+      const delay = Math.min(10000, 250 * Math.pow(2, attempts++)) * (0.5 + Math.random() / 2);
+      setStatus('reconnecting');
+      setTimeout(open, delay);
+      return;
+    }
+    setStatus('disconnected');
+  }
+  function handleMessage(evt){
+    let data = evt.data;
+    let parsed = null;
+    if (typeof data === "string") {
+      try { parsed = JSON.parse(data); } catch {}
+    } else if (binary) {
+      try { parsed = gfPack.decode(data); } catch {}
+      // onMessage handlers have always been given JSON text.
+      if (parsed !== null && handlers.length) data = JSON.stringify(parsed);
+    }
+    if (parsed && parsed.type === '_spectate') {
+      // One batch per interval; each message is handled as if sent alone.
+      (parsed.messages || []).forEach((m)=>dispatch(handlers.length ? JSON.stringify(m) : null, m));
+      return;
+    }
+    dispatch(data, parsed);
+  }
+  function dispatch(data, parsed){
+    if (parsed && parsed.type === '_ping') {
+      // Server heartbeat; a socket that never answers is eventually dropped.
+      transmit({ type: '_pong', t: parsed.t });
+      return;
+    }
+    if (parsed && parsed.type === '_replay') {
+      // The missed messages, if any, follow this one.
+      epoch = parsed.epoch;
+      lastSeq = parsed.seq - (parsed.count || 0);
+      replayHandlers.forEach((fn)=>fn(parsed));
+      return;
+    }
+    if (parsed && typeof parsed._seq === 'number') {
+      lastSeq = parsed._seq;
+    }
+    if (parsed && parsed.type === 'room_state') {
+      if (!spectator && maxPlayers && (parsed.players?.length || 0) >= maxPlayers && !parsed.players?.find((p)=>p.id===clientId)) {
+        setStatus('full');
+        closing = true;
+        try { ws.close(); } catch {}
+        return;
+      }
+      if (window.__GF_MP_HUD && hud) {
+        hud.textContent = 'MP: ' + 'connected' + ' (' + room + ') ' + (parsed.players?.length || 0) + ' players';
+      }
+    }
+    if (parsed && parsed.type === 'state') {
+      stateHandlers.forEach((fn)=>fn(parsed.state));
+    }
+    if (parsed && parsed.type === '_snapshot') {
+      if (applySnapshot(parsed)) {
+        snapshotHandlers.forEach((fn)=>fn(snapshot, parsed));
+        stateHandlers.forEach((fn)=>fn(snapshot));
+      }
+      return;
+    }
+    handlers.forEach((fn) => fn(data, parsed));
+  }
+  function open(){
+    if (channels.size) params.set("channels", Array.from(channels).join(","));
+    else params.delete("channels");
+    if (area) params.set("aoi", area.join(","));
+    else params.delete("aoi");
+    if (epoch) {
+      params.set("epoch", epoch);
+      params.set("since", String(lastSeq));
+    }
+    ws = new WebSocket(base + "/ws/" + encodeURIComponent(room) + (params.toString() ? "?" + params.toString() : ""), protocols);
+    ws.onopen = handleOpen;
+    ws.onclose = handleClose;
+    ws.onerror = ()=>setStatus('error');
+    ws.onmessage = handleMessage;
+  }
+  open();
+  return {
+    room,
+    clientId,
+    spectator,
+    protocol: () => (binary ? "msgpack" : "json"),
+    send: (data) => sendOrQueue(data),
+    broadcastState: (state) => sendOrQueue({ type: 'state', state }),
+    // Authoritative rooms (tickRate): per-player input and merge patches to
+    // the shared object; the server answers with snapshots.
+    sendInput: (data) => sendOrQueue({ type: '_input', data }),
+    patchShared: (patch) => sendOrQueue({ type: '_state_patch', patch }),
+    getSnapshot: () => snapshot,
+    // Channels: publish(channel, data) reaches only clients subscribed to
+    // it (and clients that never subscribed to anything).
+    subscribe: (names) => {
+      const list = [].concat(names);
+      list.forEach((n)=>channels.add(String(n)));
+      sendOrQueue({ type: '_subscribe', channels: list });
+    },
+    unsubscribe: (names) => {
+      const list = [].concat(names);
+      list.forEach((n)=>channels.delete(String(n)));
+      sendOrQueue({ type: '_unsubscribe', channels: list });
+    },
+    publish: (channel, data) => sendOrQueue(addressed(data, '_channel', channel)),
+    // Areas of interest on a grid of cellSize world units: setArea(cx, cy, r)
+    // receives messages published into cells within r of (cx, cy).
+    cellOf: (x, y) => [Math.floor(x / cellSize), Math.floor(y / cellSize)],
+    setArea: (cx, cy, radius) => {
+      const r = radius === undefined ? 1 : radius;
+      if (area && area[0] === cx && area[1] === cy && area[2] === r) return;
+      area = cx === null || cx === undefined ? null : [cx, cy, r];
+      sendOrQueue(area ? { type: '_aoi', x: cx, y: cy, radius: r } : { type: '_aoi' });
+    },
+    publishAt: (cx, cy, data) => sendOrQueue(addressed(data, '_cell', [cx, cy])),
+    onMessage: (fn) => handlers.push(fn),
+    onState: (fn) => stateHandlers.push(fn),
+    onSnapshot: (fn) => snapshotHandlers.push(fn),
+    // Called after each (re)connect; complete is false when the server no
+    // longer had everything that was missed and the game should resync.
+    onReplay: (fn) => replayHandlers.push(fn),
+    onStatus: (fn) => statusHandlers.push(fn),
+    disconnect: () => { closing = true; ws.close(); }
+  };
+};
+`;
+}